@@ -0,0 +1,222 @@
+# Standard library imports
+from typing import Dict, Optional
+
+# Related third-party imports
+import pandas as pd
+
+# Column types used by the schemas. Categoricals are used for keys and labels that repeat across many rows, nullable integers and booleans keep missing values without falling back to float64 or object, and API timestamps are parsed once as UTC datetimes.
+CATEGORY = "category"
+INTEGER = "Int64"
+BOOLEAN = "boolean"
+DATETIME = "datetime"
+DATE = "date"
+
+# Columns that every entity and join file shares
+shared_schema = {
+    "coding_dh_date": DATE,
+    "coding_dh_id": INTEGER,
+    "id": INTEGER,
+    "login": CATEGORY,
+    "type": CATEGORY,
+    "site_admin": BOOLEAN,
+    "created_at": DATETIME,
+    "updated_at": DATETIME,
+}
+
+user_schema = {
+    **shared_schema,
+    "followers": INTEGER,
+    "following": INTEGER,
+    "public_repos": INTEGER,
+    "public_gists": INTEGER,
+    "hireable": BOOLEAN,
+}
+
+org_schema = {
+    **user_schema,
+    "is_verified": BOOLEAN,
+    "has_organization_projects": BOOLEAN,
+    "has_repository_projects": BOOLEAN,
+}
+
+repo_schema = {
+    **shared_schema,
+    "full_name": CATEGORY,
+    "language": CATEGORY,
+    "visibility": CATEGORY,
+    "default_branch": CATEGORY,
+    "owner.id": INTEGER,
+    "owner.login": CATEGORY,
+    "owner.type": CATEGORY,
+    "owner.site_admin": BOOLEAN,
+    "size": INTEGER,
+    "forks": INTEGER,
+    "watchers": INTEGER,
+    "open_issues": INTEGER,
+    "private": BOOLEAN,
+    "fork": BOOLEAN,
+    "archived": BOOLEAN,
+    "disabled": BOOLEAN,
+    "is_template": BOOLEAN,
+    "allow_forking": BOOLEAN,
+    "has_issues": BOOLEAN,
+    "has_projects": BOOLEAN,
+    "has_downloads": BOOLEAN,
+    "has_wiki": BOOLEAN,
+    "has_pages": BOOLEAN,
+    "has_discussions": BOOLEAN,
+    "web_commit_signoff_required": BOOLEAN,
+    "pushed_at": DATETIME,
+}
+
+# Search results carry the query they were found with on top of the entity fields
+search_schema = {
+    "search_query": CATEGORY,
+    "search_term": CATEGORY,
+    "search_term_source": CATEGORY,
+    "natural_language": CATEGORY,
+    "search_query_time": DATETIME,
+}
+
+entity_schemas = {
+    "users": user_schema,
+    "orgs": org_schema,
+    "repos": repo_schema,
+    "search_users": {**user_schema, **search_schema},
+    "search_repos": {**repo_schema, **search_schema},
+}
+
+# Join files hold the fields of the entity they point to, keyed by the entity they were collected from
+join_target_schemas = {
+    "org_members": "users",
+    "org_repos": "repos",
+    "user_followers": "users",
+    "user_following": "users",
+    "user_repos": "repos",
+    "user_orgs": "orgs",
+    "user_starred": "repos",
+    "user_subscriptions": "repos",
+    "repo_contributors": "users",
+    "repo_forks": "repos",
+    "repo_stargazers": "users",
+    "repo_subscribers": "users",
+    "repo_issues": None,
+    "repo_pulls": None,
+    "issues_comments": None,
+    "pulls_comments": None,
+    "search_queries_repo": "search_repos",
+    "search_queries_user": "search_users",
+}
+
+# Types inferred from the column name for columns a schema does not declare, such as the prefixed source columns of join files (e.g. org_login, repo_id) or counts added by the metadata scripts
+suffix_column_types = {
+    "_login": CATEGORY,
+    "_full_name": CATEGORY,
+    "_id": INTEGER,
+    ".id": INTEGER,
+    "_count": INTEGER,
+    "_at": DATETIME,
+}
+
+boolean_values = {True: True, False: False, "True": True, "False": False, "true": True, "false": False}
+
+def get_schema(schema_name: str) -> Dict[str, str]:
+    """
+    Gets the declared column types of an entity, search or join schema. Join schemas combine the schema of the entity they point to with the shared columns.
+
+    :param schema_name: Name of the schema, either an entity type (users, orgs, repos), a search type (search_users, search_repos) or a join type (e.g. org_members, repo_stargazers).
+    :return: Dictionary mapping column names to column types.
+    """
+    if schema_name in entity_schemas:
+        return entity_schemas[schema_name]
+    if schema_name in join_target_schemas:
+        target_schema = join_target_schemas[schema_name]
+        return entity_schemas[target_schema] if target_schema is not None else shared_schema
+    raise ValueError(f"No schema declared for {schema_name}")
+
+def has_schema(schema_name: str) -> bool:
+    """
+    Checks whether a schema is declared.
+
+    :param schema_name: Name of the schema.
+    :return: True if get_schema can return the schema.
+    """
+    return (schema_name in entity_schemas) or (schema_name in join_target_schemas)
+
+def get_column_type(column: str, schema: Dict[str, str]) -> Optional[str]:
+    """
+    Gets the type of a column, either from the schema or inferred from the suffix of its name.
+
+    :param column: Name of the column.
+    :param schema: Dictionary mapping column names to column types.
+    :return: Column type, or None if the column is left as it is.
+    """
+    if column in schema:
+        return schema[column]
+    for suffix, column_type in suffix_column_types.items():
+        if column.endswith(suffix):
+            return column_type
+    return None
+
+def convert_column(series: pd.Series, column_type: str) -> pd.Series:
+    """
+    Converts a column to a schema type. Numeric and boolean conversions are only applied when every non-null value converts cleanly, so a column holding unexpected values is left as it is rather than losing them.
+
+    :param series: Column to convert.
+    :param column_type: Type to convert to.
+    :return: Converted column.
+    """
+    if column_type == CATEGORY:
+        return series.astype("category")
+    if column_type == INTEGER:
+        numeric_series = pd.to_numeric(series, errors="coerce")
+        non_null_values = numeric_series.dropna()
+        if len(non_null_values) != series.notna().sum() or not (non_null_values % 1 == 0).all():
+            return series
+        return numeric_series.astype("Int64")
+    if column_type == BOOLEAN:
+        if series.dtype == bool:
+            return series.astype("boolean")
+        boolean_series = series.map(boolean_values)
+        if boolean_series.notna().sum() != series.notna().sum():
+            return series
+        return boolean_series.astype("boolean")
+    if column_type == DATETIME:
+        return pd.to_datetime(series, errors="coerce", utc=True)
+    if column_type == DATE:
+        return pd.to_datetime(series, errors="coerce")
+    return series
+
+def apply_schema(df: pd.DataFrame, schema_name: str) -> pd.DataFrame:
+    """
+    Applies a schema to a DataFrame, converting every declared or inferrable column to its compact type. Columns that are already of the right type are left untouched.
+
+    :param df: DataFrame to convert.
+    :param schema_name: Name of the schema to apply.
+    :return: DataFrame with converted columns.
+    """
+    schema = get_schema(schema_name)
+    df = df.copy()
+    for column in df.columns:
+        column_type = get_column_type(column, schema)
+        if column_type is None or str(df[column].dtype) == column_type:
+            continue
+        if column_type == DATETIME and pd.api.types.is_datetime64tz_dtype(df[column]):
+            continue
+        if column_type == DATE and pd.api.types.is_datetime64_dtype(df[column]):
+            continue
+        df[column] = convert_column(df[column], column_type)
+    return df
+
+def format_schema_for_csv(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Formats typed columns so they are written to CSV the way the API returned them. UTC datetimes are written back as ISO 8601 strings rather than with a +00:00 offset.
+
+    :param df: DataFrame with schema types applied.
+    :return: DataFrame ready to be written to CSV.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64tz_dtype(df[column]):
+            df[column] = df[column].dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return df
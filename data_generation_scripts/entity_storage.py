@@ -0,0 +1,1056 @@
+# Standard library imports
+import io
+import os
+import json
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# Related third-party imports
+import pandas as pd
+from rich.console import Console
+from tqdm import tqdm
+
+# Local application/library specific imports
+from data_generation_scripts.entity_schemas import apply_schema, format_schema_for_csv
+
+# Initiate the console
+console = Console()
+
+# Columns that change on every crawl without the entity itself changing
+snapshot_exclude_columns = ["coding_dh_date", "coding_dh_id", "org_query_time", "user_query_time", "repo_query_time", "search_query_time"]
+
+def compute_payload_hash(payload_df: pd.DataFrame, exclude_columns: Optional[List[str]] = None) -> str:
+    """
+    Computes a content hash of a single entity payload. Columns are sorted before hashing so the hash does not depend on the order the API returned the fields in.
+
+    :param payload_df: DataFrame holding one row with the projected entity payload.
+    :param exclude_columns: Columns to leave out of the hash. Defaults to the crawl date and query time columns.
+    :return: Hex digest of the payload.
+    """
+    exclude_columns = snapshot_exclude_columns if exclude_columns is None else exclude_columns
+    hashed_columns = sorted(col for col in payload_df.columns if col not in exclude_columns)
+    payload_json = payload_df[hashed_columns].iloc[0:1].to_json(orient="records", date_format="iso")
+    return hashlib.sha1(payload_json.encode("utf-8")).hexdigest()
+
+class EntitySnapshotStore:
+    """
+    Keeps the content hash of the latest stored version of every entity of one type, keyed by GitHub id. A crawl only needs to write a new version when the payload hash differs from the stored one; every crawl is recorded as a compact observation (entity id, hash and date) instead.
+    Both tables are append-only CSVs under `historic_data/entity_snapshots`, so concurrent runs never rewrite each other's rows. Recorded rows are buffered and appended in one write per table by `flush`, which EntityBatchWriter calls whenever it writes a partition.
+
+    :param data_directory_path: Path to the data directory.
+    :param entity_type: Type of entity (users, orgs or repos).
+    """
+    def __init__(self, data_directory_path: str, entity_type: str):
+        snapshot_dir = os.path.join(data_directory_path, "historic_data", "entity_snapshots")
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self.hashes_path = os.path.join(snapshot_dir, f"{entity_type}_snapshot_hashes.csv")
+        self.observations_path = os.path.join(snapshot_dir, f"{entity_type}_observations.csv")
+        self.latest_hashes = {}
+        self.stored_keys = set()
+        self.pending_hashes = []
+        self.pending_observations = []
+        if os.path.exists(self.hashes_path):
+            hashes_df = pd.read_csv(self.hashes_path, dtype={"entity_id": str})
+            # Later rows are newer versions, so the last hash per entity wins
+            self.latest_hashes = dict(zip(hashes_df.entity_id, hashes_df.payload_hash))
+            self.stored_keys = set(hashes_df.entity_key)
+
+    def has_changed(self, entity_id: Union[str, int], payload_hash: str) -> bool:
+        """
+        Checks whether a payload differs from the latest stored version of the entity.
+
+        :param entity_id: GitHub id of the entity.
+        :param payload_hash: Content hash of the new payload.
+        :return: True if the entity has no stored version or the stored version has a different hash.
+        """
+        return self.latest_hashes.get(str(entity_id)) != payload_hash
+
+    def record_observation(self, entity_id: Union[str, int], payload_hash: str, coding_dh_date: str) -> None:
+        """
+        Records that an entity was seen with a given payload on a date. The observation is written on the next flush.
+
+        :param entity_id: GitHub id of the entity.
+        :param payload_hash: Content hash of the payload that was seen.
+        :param coding_dh_date: Date of the crawl.
+        """
+        self.pending_observations.append({"entity_id": str(entity_id), "payload_hash": payload_hash, "coding_dh_date": coding_dh_date})
+
+    def record_version(self, entity_id: Union[str, int], entity_key: str, payload_hash: str, coding_dh_date: str) -> None:
+        """
+        Records that a new version of an entity was written, along with the observation of it. Both are written on the next flush, but has_changed sees the new hash straight away.
+
+        :param entity_id: GitHub id of the entity.
+        :param entity_key: Login or full name of the entity.
+        :param payload_hash: Content hash of the new version.
+        :param coding_dh_date: Date of the crawl.
+        """
+        self.pending_hashes.append({"entity_id": str(entity_id), "entity_key": entity_key, "payload_hash": payload_hash, "coding_dh_date": coding_dh_date})
+        self.latest_hashes[str(entity_id)] = payload_hash
+        self.stored_keys.add(entity_key)
+        self.record_observation(entity_id, payload_hash, coding_dh_date)
+
+    def flush(self) -> None:
+        """
+        Appends the buffered versions and observations to their CSVs.
+        """
+        self._append_rows(self.hashes_path, self.pending_hashes)
+        self._append_rows(self.observations_path, self.pending_observations)
+        self.pending_hashes = []
+        self.pending_observations = []
+
+    @staticmethod
+    def _append_rows(file_path: str, rows: List[dict]) -> None:
+        if len(rows) == 0:
+            return
+        rows_df = pd.DataFrame(rows)
+        if os.path.exists(file_path):
+            rows_df.to_csv(file_path, mode="a", header=False, index=False)
+        else:
+            rows_df.to_csv(file_path, index=False)
+
+def get_entity_column(entity_type: str) -> str:
+    """
+    Gets the column that identifies an entity by name.
+
+    :param entity_type: Type of entity (users, orgs or repos).
+    :return: full_name for repos, login otherwise.
+    """
+    return "full_name" if entity_type == "repos" else "login"
+
+def get_interaction_stage(interaction_type: str, url_column: str) -> str:
+    """
+    Gets the name under which the status store records the crawls of one join. Interaction types such as repo_user are shared by several joins (stargazers, forks, contributors and so on), so the url column the join is crawled from is part of the name.
+
+    :param interaction_type: Type of interaction, e.g. repo_user.
+    :param url_column: Url column the join is crawled from, e.g. stargazers_url.
+    :return: Stage name, e.g. repo_user.stargazers_url.
+    """
+    return f"{interaction_type}.{url_column}"
+
+def get_entity_partition_dir(data_directory_path: str, entity_type: str) -> str:
+    """
+    Gets the directory holding the batched entity partitions of one entity type.
+
+    :param data_directory_path: Path to the data directory.
+    :param entity_type: Type of entity (users, orgs or repos).
+    :return: Path to the partition directory.
+    """
+    return os.path.join(data_directory_path, "historic_data", "entity_partitions", entity_type)
+
+def get_legacy_entity_file_path(data_directory_path: str, entity_type: str, entity_key: str) -> str:
+    """
+    Gets the path of the one-CSV-per-entity file that entities were stored in before they were batched into partitions.
+
+    :param data_directory_path: Path to the data directory.
+    :param entity_type: Type of entity (users, orgs or repos).
+    :param entity_key: Login or full name of the entity.
+    :return: Path to the legacy entity file.
+    """
+    file_name = f"{entity_key.replace('/', '_').replace(' ', '_')}_coding_dh_{entity_type[:-1]}.csv"
+    return os.path.join(data_directory_path, "historic_data", "entity_files", f"all_{entity_type}", file_name)
+
+def read_entity_csv(file_path: str, usecols: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+    """
+    Reads an entity partition or legacy entity file, returning None if it cannot be read.
+
+    :param file_path: Path to the file.
+    :param usecols: Optional list of columns to read. Columns missing from the file are ignored.
+    :return: DataFrame with the file contents, or None.
+    """
+    try:
+        if usecols is not None:
+            projected_columns = set(usecols)
+            return pd.read_csv(file_path, low_memory=False, usecols=lambda column: column in projected_columns)
+        return pd.read_csv(file_path, low_memory=False)
+    except Exception as e:
+        console.print(f"Failed to read {file_path}. Error: {e}", style="bold red")
+        return None
+
+def read_entity_files(file_paths: List[str], entity_type: str, usecols: Optional[List[str]] = None, max_workers: Optional[int] = None) -> List[Optional[pd.DataFrame]]:
+    """
+    Reads entity partitions or legacy entity files concurrently in a thread pool. The entity key and coding_dh_date are always read when projecting columns.
+
+    :param file_paths: Paths to the files.
+    :param entity_type: Type of entity (users, orgs or repos).
+    :param usecols: Optional list of columns to read. If None, every column is read.
+    :param max_workers: Number of threads used to read the files. Defaults to None, which lets the executor pick.
+    :return: List with the DataFrame of each file, in the same order as file_paths, or None for files that could not be read.
+    """
+    if usecols is not None:
+        usecols = list(usecols) + [get_entity_column(entity_type), "coding_dh_date"]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(tqdm(executor.map(lambda file_path: read_entity_csv(file_path, usecols), file_paths), total=len(file_paths), desc=f"Reading {entity_type} files"))
+
+class EntityLocator:
+    """
+    Persistent index from entity key (login or full name) and GitHub id to the file or partition holding the latest version of the entity, along with its latest coding_dh_date. It lives in `historic_data/entity_snapshots/entity_locator.db` and is kept up to date by EntityBatchWriter, so looking up a core set of entities never has to list the entity directories.
+    Stored file paths are relative to the data directory. The legacy one-CSV-per-entity files are indexed once per entity type by `backfill`, reading the keys from the files rather than reconstructing them from file names.
+    Renamed users and transferred repos are tracked in an alias table mapping every name an entity was requested under to its GitHub id and current name, so crawls can resolve old names instead of fetching and storing the same entity twice.
+
+    :param data_directory_path: Path to the data directory.
+    """
+    def __init__(self, data_directory_path: str):
+        self.data_directory_path = data_directory_path
+        snapshot_dir = os.path.join(data_directory_path, "historic_data", "entity_snapshots")
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self.locator_path = os.path.join(snapshot_dir, "entity_locator.db")
+        with self.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS entity_locations (
+                entity_type TEXT, entity_key TEXT, entity_id INTEGER, file_path TEXT, coding_dh_date TEXT,
+                PRIMARY KEY (entity_type, entity_key))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS entity_locations_id ON entity_locations (entity_type, entity_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS locator_backfills (entity_type TEXT PRIMARY KEY, backfill_date TEXT)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS entity_aliases (
+                entity_type TEXT, alias_key TEXT, entity_id INTEGER, canonical_key TEXT, first_seen TEXT, last_seen TEXT,
+                PRIMARY KEY (entity_type, alias_key))""")
+
+    @contextmanager
+    def connect(self):
+        """
+        Connects to the locator database, committing on success and closing the connection afterwards.
+
+        :return: Connection to the locator database.
+        """
+        conn = sqlite3.connect(self.locator_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record_locations(self, entity_type: str, entity_df: pd.DataFrame, file_path: str) -> None:
+        """
+        Records the file holding each entity of a DataFrame. A location is only replaced by one at least as recent, so writing an older version never hides a newer one.
+
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_df: DataFrame with the entity rows that were written to the file.
+        :param file_path: Path to the file the rows were written to.
+        """
+        entity_column = get_entity_column(entity_type)
+        if len(entity_df) == 0 or entity_column not in entity_df.columns:
+            return
+        relative_path = os.path.relpath(file_path, self.data_directory_path)
+        entity_ids = pd.to_numeric(entity_df["id"], errors="coerce") if "id" in entity_df.columns else pd.Series(float("nan"), index=entity_df.index)
+        coding_dh_dates = pd.to_datetime(entity_df["coding_dh_date"], errors="coerce").dt.strftime("%Y-%m-%d")
+        records = [
+            (entity_type, str(entity_key), int(entity_id) if pd.notna(entity_id) else None, relative_path, coding_dh_date if pd.notna(coding_dh_date) else None)
+            for entity_key, entity_id, coding_dh_date in zip(entity_df[entity_column], entity_ids, coding_dh_dates)
+            if pd.notna(entity_key)
+        ]
+        with self.connect() as conn:
+            conn.executemany("""INSERT INTO entity_locations (entity_type, entity_key, entity_id, file_path, coding_dh_date) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (entity_type, entity_key) DO UPDATE SET
+                    entity_id = COALESCE(excluded.entity_id, entity_locations.entity_id),
+                    file_path = excluded.file_path,
+                    coding_dh_date = excluded.coding_dh_date
+                WHERE COALESCE(excluded.coding_dh_date, '') >= COALESCE(entity_locations.coding_dh_date, '')""", records)
+        
+    def locate(self, entity_type: str, entity_keys: Optional[List[str]] = None, entity_ids: Optional[List[int]] = None) -> pd.DataFrame:
+        """
+        Looks up where entities are stored, by key, by GitHub id or both. If neither is given, every located entity of the type is returned.
+
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_keys: Optional list of logins or full names to look up.
+        :param entity_ids: Optional list of GitHub ids to look up.
+        :return: DataFrame with the entity key, entity id, file path and latest coding_dh_date of every located entity.
+        """
+        with self.connect() as conn:
+            if entity_keys is None and entity_ids is None:
+                return pd.read_sql_query("SELECT entity_key, entity_id, file_path, coding_dh_date FROM entity_locations WHERE entity_type = ?", conn, params=[entity_type])
+            # Look the keys up through a temporary table so large core sets do not hit the SQLite parameter limit
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_keys (entity_key TEXT, entity_id INTEGER)")
+            conn.execute("DELETE FROM lookup_keys")
+            conn.executemany("INSERT INTO lookup_keys (entity_key) VALUES (?)", [(str(entity_key),) for entity_key in (entity_keys or []) if pd.notna(entity_key)])
+            conn.executemany("INSERT INTO lookup_keys (entity_id) VALUES (?)", [(int(entity_id),) for entity_id in (entity_ids or []) if pd.notna(entity_id)])
+            located_df = pd.read_sql_query("""SELECT DISTINCT locations.entity_key, locations.entity_id, locations.file_path, locations.coding_dh_date
+                FROM entity_locations AS locations
+                JOIN lookup_keys ON (lookup_keys.entity_key = locations.entity_key OR lookup_keys.entity_id = locations.entity_id)
+                WHERE locations.entity_type = ?""", conn, params=[entity_type])
+        return located_df
+
+    def record_alias(self, entity_type: str, alias_key: str, entity_id: Optional[Union[str, int]], canonical_key: str) -> None:
+        """
+        Records that an entity requested under one name was served under another, either through a 301 redirect or because the payload holds a different login or full name.
+
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param alias_key: Login or full name the entity was requested under.
+        :param entity_id: GitHub id of the entity.
+        :param canonical_key: Current login or full name of the entity.
+        """
+        seen_date = datetime.now().strftime("%Y-%m-%d")
+        entity_id = int(entity_id) if entity_id is not None and pd.notna(entity_id) else None
+        with self.connect() as conn:
+            conn.execute("""INSERT INTO entity_aliases (entity_type, alias_key, entity_id, canonical_key, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (entity_type, alias_key) DO UPDATE SET
+                    entity_id = COALESCE(excluded.entity_id, entity_aliases.entity_id),
+                    canonical_key = excluded.canonical_key,
+                    last_seen = excluded.last_seen""", (entity_type, str(alias_key), entity_id, str(canonical_key), seen_date, seen_date))
+
+    def resolve_aliases(self, entity_type: str, entity_keys: List[str]) -> Dict[str, str]:
+        """
+        Maps the keys that are known aliases to the current name of their entity.
+
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_keys: List of logins or full names.
+        :return: Dictionary mapping each aliased key to its canonical key. Keys that are not aliases are left out.
+        """
+        with self.connect() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_aliases (alias_key TEXT)")
+            conn.execute("DELETE FROM lookup_aliases")
+            conn.executemany("INSERT INTO lookup_aliases (alias_key) VALUES (?)", [(str(entity_key),) for entity_key in entity_keys if pd.notna(entity_key)])
+            aliases = conn.execute("""SELECT aliases.alias_key, aliases.canonical_key FROM entity_aliases AS aliases
+                JOIN lookup_aliases ON lookup_aliases.alias_key = aliases.alias_key
+                WHERE aliases.entity_type = ? AND aliases.alias_key != aliases.canonical_key""", (entity_type,)).fetchall()
+        return dict(aliases)
+
+    def get_located_keys(self, entity_type: str, entity_keys: List[str]) -> set:
+        """
+        Gets which of a list of entities are already stored.
+
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_keys: List of logins or full names.
+        :return: Set of the keys that have a stored version.
+        """
+        return set(self.locate(entity_type, entity_keys=entity_keys).entity_key)
+
+    def backfill(self, entity_type: str, force: bool = False) -> None:
+        """
+        Indexes the entities already on disk for one entity type: the legacy one-CSV-per-entity files first and then the partitions, so the latest location wins. This only scans the directories the first time it is called for an entity type, unless force is True.
+
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param force: Whether to rescan the directories even if they were already indexed.
+        """
+        with self.connect() as conn:
+            already_backfilled = conn.execute("SELECT 1 FROM locator_backfills WHERE entity_type = ?", (entity_type,)).fetchone() is not None
+        if already_backfilled and not force:
+            return
+        entity_column = get_entity_column(entity_type)
+        legacy_dir = os.path.join(self.data_directory_path, "historic_data", "entity_files", f"all_{entity_type}")
+        partition_dir = get_entity_partition_dir(self.data_directory_path, entity_type)
+        file_paths = []
+        if os.path.exists(legacy_dir):
+            file_paths.extend(os.path.join(legacy_dir, file) for file in os.listdir(legacy_dir) if file.endswith(".csv"))
+        if os.path.exists(partition_dir):
+            file_paths.extend(os.path.join(partition_dir, file) for file in sorted(os.listdir(partition_dir)) if file.endswith(".csv"))
+        for file_path in tqdm(file_paths, desc=f"Indexing {entity_type} locations"):
+            try:
+                location_df = pd.read_csv(file_path, usecols=lambda column: column in [entity_column, "id", "coding_dh_date"], low_memory=False)
+            except Exception as e:
+                console.print(f"Failed to read {file_path}. Error: {e}", style="bold red")
+                continue
+            if "coding_dh_date" in location_df.columns:
+                self.record_locations(entity_type, location_df, file_path)
+        with self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO locator_backfills (entity_type, backfill_date) VALUES (?, ?)", (entity_type, datetime.now().strftime("%Y-%m-%d")))
+
+class EntityStatusStore:
+    """
+    Indexed status table recording, per stage and entity, whether the entity is pending, ok, errored (with the status code), excluded or over the threshold of an interaction, along with how many attempts were made and when it can next be retried.
+    It lives in `historic_data/entity_snapshots/entity_status.db` and replaces re-reading and deduplicating the error, excluded and over-threshold CSVs at the start of every stage. Those CSVs are imported once per stage by `import_legacy_files`, and the error CSVs are still appended to as a readable log.
+
+    :param data_directory_path: Path to the data directory.
+    :param max_attempts: Number of failed attempts after which an errored entity is only retried when errors are explicitly retried. Defaults to 5.
+    :param retry_backoff_days: Days to wait before retrying an entity after its first error. The wait doubles with every further attempt, up to 30 days. Defaults to 1.
+    """
+    statuses = ["pending", "ok", "error", "excluded", "over_threshold"]
+
+    def __init__(self, data_directory_path: str, max_attempts: int = 5, retry_backoff_days: int = 1):
+        snapshot_dir = os.path.join(data_directory_path, "historic_data", "entity_snapshots")
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self.status_path = os.path.join(snapshot_dir, "entity_status.db")
+        self.max_attempts = max_attempts
+        self.retry_backoff_days = retry_backoff_days
+        with self.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS entity_status (
+                stage TEXT, entity_type TEXT, entity_key TEXT, status TEXT, status_code INTEGER, attempts INTEGER DEFAULT 0,
+                last_attempt TEXT, next_retry TEXT, detail TEXT,
+                PRIMARY KEY (stage, entity_type, entity_key))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS entity_status_lookup ON entity_status (stage, entity_type, status, next_retry)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS legacy_file_imports (
+                stage TEXT, entity_type TEXT, file_kind TEXT, file_path TEXT, file_mtime REAL, file_size INTEGER, file_offset INTEGER,
+                PRIMARY KEY (stage, entity_type, file_kind))""")
+            # Databases created before append-only files were imported from an offset lack the offset column
+            if "file_offset" not in [column[1] for column in conn.execute("PRAGMA table_info(legacy_file_imports)").fetchall()]:
+                conn.execute("ALTER TABLE legacy_file_imports ADD COLUMN file_offset INTEGER")
+            conn.execute("""CREATE TABLE IF NOT EXISTS crawl_cursors (
+                stage TEXT, entity_type TEXT, entity_key TEXT, next_url TEXT, pages_done INTEGER, rows_done INTEGER, updated_at TEXT,
+                PRIMARY KEY (stage, entity_type, entity_key))""")
+
+    @contextmanager
+    def connect(self):
+        """
+        Connects to the status database, committing on success and closing the connection afterwards.
+
+        :return: Connection to the status database.
+        """
+        conn = sqlite3.connect(self.status_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def mark(self, stage: str, entity_type: str, entity_keys: Union[str, List[str]], status: str, status_code: Optional[int] = None, detail: Optional[Union[str, List[str]]] = None) -> None:
+        """
+        Sets the status of one or more entities for a stage. Errors increment the attempt count and push back the next retry time; any other status resets them.
+
+        :param stage: Name of the stage, e.g. entities or a join stage from get_interaction_stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_keys: Login or full name, or list of them.
+        :param status: One of pending, ok, error, excluded or over_threshold.
+        :param status_code: Optional HTTP status code of the error.
+        :param detail: Optional detail, such as the failing url or the count that was over the threshold, or a list of details aligned with entity_keys.
+        """
+        if status not in self.statuses:
+            raise ValueError(f"Unknown status {status}")
+        entity_keys = [entity_keys] if isinstance(entity_keys, str) else list(entity_keys)
+        details = detail if isinstance(detail, list) else [detail] * len(entity_keys)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        status_code = int(status_code) if status_code is not None and pd.notna(status_code) else None
+        records = [(stage, entity_type, str(entity_key), status, status_code, now, entity_detail) for entity_key, entity_detail in zip(entity_keys, details) if pd.notna(entity_key)]
+        with self.connect() as conn:
+            conn.executemany("""INSERT INTO entity_status (stage, entity_type, entity_key, status, status_code, attempts, last_attempt, detail)
+                VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+                ON CONFLICT (stage, entity_type, entity_key) DO UPDATE SET
+                    status = excluded.status, status_code = excluded.status_code, last_attempt = excluded.last_attempt, detail = excluded.detail""", records)
+            if status == "error":
+                keys = [(stage, entity_type, record[2]) for record in records]
+                conn.executemany("UPDATE entity_status SET attempts = attempts + 1 WHERE stage = ? AND entity_type = ? AND entity_key = ?", keys)
+                conn.executemany(f"""UPDATE entity_status SET next_retry = datetime(last_attempt, '+' || MIN({self.retry_backoff_days} * (1 << (attempts - 1)), 30) || ' days')
+                    WHERE stage = ? AND entity_type = ? AND entity_key = ?""", keys)
+            else:
+                conn.executemany("UPDATE entity_status SET attempts = 0, next_retry = NULL WHERE stage = ? AND entity_type = ? AND entity_key = ?", [(stage, entity_type, record[2]) for record in records])
+
+    def get_status(self, stage: str, entity_type: str, status: Optional[str] = None) -> pd.DataFrame:
+        """
+        Gets the status rows of a stage.
+
+        :param stage: Name of the stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param status: Optional status to restrict the rows to.
+        :return: DataFrame with one row per entity.
+        """
+        query = "SELECT * FROM entity_status WHERE stage = ? AND entity_type = ?"
+        params = [stage, entity_type]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        with self.connect() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    def get_blocked_keys(self, stage: str, entity_type: str, entity_keys: List[str], retry_errors: bool = False, blocked_statuses: List[str] = ["excluded", "over_threshold"]) -> set:
+        """
+        Gets which of a list of entities should be left out of a stage's work set: entities with one of the blocked statuses, by default excluded or over the threshold, and errored entities that are not due for a retry. Errored entities are due once their next retry time has passed and they have fewer than max_attempts attempts, or always if retry_errors is True.
+
+        :param stage: Name of the stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_keys: List of logins or full names making up the candidate work set.
+        :param retry_errors: Whether to retry every errored entity.
+        :param blocked_statuses: Statuses that always leave an entity out. Defaults to excluded and over_threshold.
+        :return: Set of keys to leave out.
+        """
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.connect() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_keys (entity_key TEXT)")
+            conn.execute("DELETE FROM lookup_keys")
+            conn.executemany("INSERT INTO lookup_keys (entity_key) VALUES (?)", [(str(entity_key),) for entity_key in entity_keys if pd.notna(entity_key)])
+            blocked = conn.execute(f"""SELECT status.entity_key FROM entity_status AS status
+                JOIN lookup_keys ON lookup_keys.entity_key = status.entity_key
+                WHERE status.stage = ? AND status.entity_type = ? AND (
+                    status.status IN ({", ".join(["?"] * len(blocked_statuses))})
+                    OR (status.status = 'error' AND ? = 0 AND (status.attempts >= ? OR COALESCE(status.next_retry, '') > ?)))""",
+                (stage, entity_type, *blocked_statuses, int(retry_errors), self.max_attempts, now)).fetchall()
+        return {entity_key for (entity_key,) in blocked}
+
+    def get_last_success(self, stage: str, entity_type: str, entity_keys: List[str]) -> Dict[str, str]:
+        """
+        Gets when a stage last succeeded for each of a list of entities.
+
+        :param stage: Name of the stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_keys: List of logins or full names.
+        :return: Dictionary mapping the keys of entities with an ok status to the time of their last attempt.
+        """
+        with self.connect() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_keys (entity_key TEXT)")
+            conn.execute("DELETE FROM lookup_keys")
+            conn.executemany("INSERT INTO lookup_keys (entity_key) VALUES (?)", [(str(entity_key),) for entity_key in entity_keys if pd.notna(entity_key)])
+            last_success = conn.execute("""SELECT status.entity_key, status.last_attempt FROM entity_status AS status
+                JOIN lookup_keys ON lookup_keys.entity_key = status.entity_key
+                WHERE status.stage = ? AND status.entity_type = ? AND status.status = 'ok'""", (stage, entity_type)).fetchall()
+        return dict(last_success)
+
+    def get_cursor(self, stage: str, entity_type: str, entity_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Gets where a page by page crawl of an entity left off.
+
+        :param stage: Name of the stage, e.g. a join stage from get_interaction_stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_key: Login or full name.
+        :return: Dictionary with the next page url, the number of pages and rows collected so far and when the cursor was saved, or None if no crawl is in progress.
+        """
+        with self.connect() as conn:
+            cursor = conn.execute("SELECT next_url, pages_done, rows_done, updated_at FROM crawl_cursors WHERE stage = ? AND entity_type = ? AND entity_key = ?", (stage, entity_type, str(entity_key))).fetchone()
+        if cursor is None:
+            return None
+        return dict(zip(["next_url", "pages_done", "rows_done", "updated_at"], cursor))
+
+    def save_cursor(self, stage: str, entity_type: str, entity_key: str, next_url: Optional[str], pages_done: int, rows_done: int) -> None:
+        """
+        Saves where a page by page crawl of an entity left off, after each page.
+
+        :param stage: Name of the stage, e.g. a join stage from get_interaction_stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_key: Login or full name.
+        :param next_url: Url of the next page, or None once the last page was collected.
+        :param pages_done: Number of pages collected so far.
+        :param rows_done: Number of rows collected so far.
+        """
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO crawl_cursors (stage, entity_type, entity_key, next_url, pages_done, rows_done, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (stage, entity_type, str(entity_key), next_url, pages_done, rows_done, now))
+
+    def clear_cursor(self, stage: str, entity_type: str, entity_key: str) -> None:
+        """
+        Removes the cursor of a finished crawl.
+
+        :param stage: Name of the stage, e.g. a join stage from get_interaction_stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_key: Login or full name.
+        """
+        with self.connect() as conn:
+            conn.execute("DELETE FROM crawl_cursors WHERE stage = ? AND entity_type = ? AND entity_key = ?", (stage, entity_type, str(entity_key)))
+
+    def import_legacy_files(self, stage: str, entity_type: str, entity_column: str, error_file_path: Optional[str] = None, excluded_file_path: Optional[str] = None, threshold_file_path: Optional[str] = None, error_filter: Optional[Callable[[pd.DataFrame], pd.Series]] = None) -> None:
+        """
+        Imports the error, excluded and over-threshold CSVs of a stage into the status table. Each file is imported again whenever its modification time or size changes, so edits to the curated excluded files take effect on the next run. The error CSV is only appended to, so only the rows appended since its last import are read, with their attempts added to the ones already recorded. It is read in full again if it shrank, e.g. after clean_write_error_file deduplicated it.
+        Rows are only imported for entities whose status was last set before the file was last modified, so a re-import never overwrites a newer status such as a later successful crawl. Entities removed from the excluded file are set back to pending.
+
+        :param stage: Name of the stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_column: Column holding the entity key in the CSVs.
+        :param error_file_path: Optional path to the error CSV. Each logged error counts as an attempt.
+        :param excluded_file_path: Optional path to the excluded entities CSV.
+        :param threshold_file_path: Optional path to the over-threshold CSV.
+        :param error_filter: Optional function returning which rows of the error CSV belong to the stage, for error CSVs that several stages log to.
+        """
+        error_df, appended_only = self._read_changed_legacy_file(stage, entity_type, "error", error_file_path, entity_column, append_only=True)
+        if error_df is not None:
+            if error_filter is not None:
+                error_df = error_df[error_filter(error_df)]
+            error_df = error_df[error_df[entity_column].notna()]
+            status_codes = error_df.groupby(entity_column).status_code.last() if "status_code" in error_df.columns else pd.Series(dtype=float)
+            attempts = error_df[entity_column].value_counts()
+            last_errors = error_df.groupby(entity_column).error_date.last() if "error_date" in error_df.columns else pd.Series(dtype=object)
+            records = []
+            for entity_key, entity_attempts in attempts.items():
+                last_attempt = pd.to_datetime(last_errors.get(entity_key), errors="coerce")
+                last_attempt = last_attempt if pd.notna(last_attempt) else datetime.fromtimestamp(os.path.getmtime(error_file_path))
+                status_code = status_codes.get(entity_key)
+                records.append((stage, entity_type, str(entity_key), "error", int(status_code) if pd.notna(status_code) else None, int(entity_attempts), last_attempt.strftime("%Y-%m-%d %H:%M:%S")))
+            with self.connect() as conn:
+                # Appended rows add to the attempts of entities that were already errored, a full read replaces them
+                conn.executemany(f"""INSERT INTO entity_status (stage, entity_type, entity_key, status, status_code, attempts, last_attempt)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (stage, entity_type, entity_key) DO UPDATE SET
+                        status = excluded.status, status_code = excluded.status_code, last_attempt = excluded.last_attempt,
+                        attempts = CASE WHEN {int(appended_only)} = 1 AND entity_status.status = 'error' THEN entity_status.attempts + excluded.attempts ELSE excluded.attempts END
+                    WHERE COALESCE(entity_status.last_attempt, '') < excluded.last_attempt""", records)
+                conn.executemany(f"""UPDATE entity_status SET next_retry = datetime(last_attempt, '+' || MIN({self.retry_backoff_days} * (1 << (attempts - 1)), 30) || ' days')
+                    WHERE stage = ? AND entity_type = ? AND entity_key = ? AND status = 'error'""", [record[:3] for record in records])
+        threshold_df, _ = self._read_changed_legacy_file(stage, entity_type, "threshold", threshold_file_path, entity_column)
+        if threshold_df is not None:
+            self._mark_older(stage, entity_type, threshold_df[entity_column].dropna().unique().tolist(), "over_threshold", threshold_file_path)
+        excluded_df, _ = self._read_changed_legacy_file(stage, entity_type, "excluded", excluded_file_path, entity_column)
+        if excluded_df is not None:
+            excluded_keys = [str(entity_key) for entity_key in excluded_df[entity_column].dropna().unique()]
+            self._mark_older(stage, entity_type, excluded_keys, "excluded", excluded_file_path)
+            # Entities taken out of the curated file are no longer excluded
+            previously_excluded = self.get_status(stage, entity_type, status="excluded").entity_key
+            self.mark(stage, entity_type, sorted(set(previously_excluded) - set(excluded_keys)), "pending")
+
+    def _read_changed_legacy_file(self, stage: str, entity_type: str, file_kind: str, file_path: Optional[str], entity_column: str, append_only: bool = False) -> Tuple[Optional[pd.DataFrame], bool]:
+        """
+        Reads a legacy CSV if its modification time or size changed since it was last imported, and records its new signature.
+        For append-only files, the byte offset up to which the file was imported is recorded too, and only the complete rows after it are read, unless the file is now shorter than the offset.
+
+        :param stage: Name of the stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param file_kind: Kind of file (error, excluded or threshold).
+        :param file_path: Optional path to the CSV.
+        :param entity_column: Column holding the entity key in the CSV.
+        :param append_only: Whether the file is only ever appended to. Defaults to False.
+        :return: Tuple of the DataFrame of the rows read, or None if the file does not exist, has not changed, has no new rows or has no entity column, and whether only the appended rows were read.
+        """
+        if file_path is None or not os.path.exists(file_path):
+            return None, False
+        file_mtime, file_size = os.path.getmtime(file_path), os.path.getsize(file_path)
+        with self.connect() as conn:
+            signature = conn.execute("SELECT file_path, file_mtime, file_size, file_offset FROM legacy_file_imports WHERE stage = ? AND entity_type = ? AND file_kind = ?", (stage, entity_type, file_kind)).fetchone()
+        if signature is not None and signature[:3] == (file_path, file_mtime, file_size):
+            return None, False
+        file_offset = None
+        appended_only = False
+        if append_only:
+            previous_offset = signature[3] if signature is not None and signature[0] == file_path else None
+            with open(file_path, "rb") as legacy_file:
+                header = legacy_file.readline()
+                appended_only = previous_offset is not None and len(header) <= previous_offset <= file_size
+                if appended_only:
+                    legacy_file.seek(previous_offset)
+                    content = legacy_file.read()
+                else:
+                    previous_offset = 0
+                    content = header + legacy_file.read()
+            # A row that is still being written is left for the next import
+            content = content[:content.rfind(b"\n") + 1]
+            file_offset = previous_offset + len(content)
+            legacy_df = None
+            if len(content) > 0:
+                try:
+                    legacy_df = pd.read_csv(io.BytesIO(header + content if appended_only else content), low_memory=False)
+                except Exception as e:
+                    console.print(f"Failed to read {file_path}. Error: {e}", style="bold red")
+        else:
+            legacy_df = read_entity_csv(file_path)
+        with self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO legacy_file_imports (stage, entity_type, file_kind, file_path, file_mtime, file_size, file_offset) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (stage, entity_type, file_kind, file_path, file_mtime, file_size, file_offset))
+        if legacy_df is None or entity_column not in legacy_df.columns:
+            return None, False
+        return legacy_df, appended_only
+
+    def _mark_older(self, stage: str, entity_type: str, entity_keys: List[str], status: str, file_path: str) -> None:
+        """
+        Sets the status of the entities whose status was last set before a legacy CSV was last modified.
+
+        :param stage: Name of the stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_keys: List of logins or full names listed in the CSV.
+        :param status: Status to set.
+        :param file_path: Path to the CSV.
+        """
+        file_modified = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime("%Y-%m-%d %H:%M:%S")
+        status_df = self.get_status(stage, entity_type)
+        newer_keys = set(status_df[status_df.last_attempt.fillna("") >= file_modified].entity_key)
+        self.mark(stage, entity_type, [entity_key for entity_key in entity_keys if str(entity_key) not in newer_keys], status)
+
+class EntityRefreshPolicy:
+    """
+    Decides which entities of a stage could have changed since the stage last crawled them, so routine refreshes only schedule the active subset. The activity timestamps that search results and entity payloads already hold (updated_at, pushed_at) are compared against the last successful crawl recorded in the `EntityStatusStore`.
+    Entities that were never crawled, or have no activity timestamp, are always scheduled. Since timestamps do not reflect every change (a user's updated_at does not move when they gain followers), entities are also scheduled once their last crawl is older than max_age_days.
+
+    :param activity_columns: Columns holding when an entity last changed, keyed by entity type. The most recent of them is used. Defaults to updated_at for users and orgs, and pushed_at and updated_at for repos.
+    :param max_age_days: Days after which an entity is scheduled even without newer activity, or None to never force a refresh. Defaults to 90.
+    :param stage_overrides: Overrides of activity_columns (keyed by entity type) and max_age_days, keyed by stage, e.g. {"repo_user.stargazers_url": {"max_age_days": 30}}.
+    :param clock_margin_days: Margin subtracted from the last crawl date, since crawl times are recorded in local time and coding_dh_date only holds the day. Defaults to 1.
+    """
+    default_activity_columns = {"users": ["updated_at"], "orgs": ["updated_at"], "repos": ["pushed_at", "updated_at"]}
+
+    def __init__(self, activity_columns: Optional[Dict[str, List[str]]] = None, max_age_days: Optional[int] = 90, stage_overrides: Optional[Dict[str, Dict[str, Any]]] = None, clock_margin_days: int = 1):
+        self.activity_columns = activity_columns if activity_columns is not None else self.default_activity_columns
+        self.max_age_days = max_age_days
+        self.stage_overrides = stage_overrides if stage_overrides is not None else {}
+        self.clock_margin_days = clock_margin_days
+
+    def get_settings(self, stage: str, entity_type: str) -> tuple:
+        """
+        Gets the activity columns and maximum age that apply to a stage.
+
+        :param stage: Name of the stage, e.g. a join stage from get_interaction_stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :return: Tuple of the list of activity columns and the maximum age in days.
+        """
+        overrides = self.stage_overrides.get(stage, {})
+        activity_columns = overrides.get("activity_columns", self.activity_columns).get(entity_type, [])
+        max_age_days = overrides.get("max_age_days", self.max_age_days)
+        return activity_columns, max_age_days
+
+    def needs_refresh(self, entities_df: pd.DataFrame, stage: str, entity_type: str, last_crawled: pd.Series) -> pd.Series:
+        """
+        Checks which entities could have changed since they were last crawled.
+
+        :param entities_df: DataFrame of entities with their activity columns.
+        :param stage: Name of the stage, e.g. a join stage from get_interaction_stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param last_crawled: Last successful crawl of each entity, aligned with the index of entities_df. Missing values mean never crawled.
+        :return: Boolean Series aligned with entities_df, True for entities to schedule.
+        """
+        activity_columns, max_age_days = self.get_settings(stage, entity_type)
+        activity_columns = [column for column in activity_columns if column in entities_df.columns]
+        last_crawled = pd.to_datetime(last_crawled, errors="coerce")
+        if len(activity_columns) == 0:
+            needs_refresh = pd.Series(True, index=entities_df.index)
+        else:
+            activity = pd.concat([pd.to_datetime(entities_df[column], errors="coerce", utc=True).dt.tz_convert(None) for column in activity_columns], axis=1).max(axis=1)
+            needs_refresh = activity.isna() | (activity > last_crawled - timedelta(days=self.clock_margin_days))
+        needs_refresh = needs_refresh | last_crawled.isna()
+        if max_age_days is not None:
+            needs_refresh = needs_refresh | (last_crawled < datetime.now() - timedelta(days=max_age_days))
+        return needs_refresh
+
+    def select_for_refresh(self, status_store: "EntityStatusStore", entities_df: pd.DataFrame, stage: str, entity_type: str, entity_column: str) -> pd.Series:
+        """
+        Checks which entities to schedule, using the last successful crawl of the stage from the status store.
+
+        :param status_store: Status store holding the stage's last successful crawls.
+        :param entities_df: DataFrame of entities with their keys and activity columns.
+        :param stage: Name of the stage, e.g. a join stage from get_interaction_stage.
+        :param entity_type: Type of entity (users, orgs or repos).
+        :param entity_column: Column holding the entity keys (login or full_name).
+        :return: Boolean Series aligned with entities_df, True for entities to schedule.
+        """
+        last_success = status_store.get_last_success(stage, entity_type, entities_df[entity_column].tolist())
+        last_crawled = entities_df[entity_column].astype(str).map(last_success)
+        return self.needs_refresh(entities_df, stage, entity_type, last_crawled)
+
+class EntityEdgeStore:
+    """
+    Single indexed edge table holding the interactions of every join, e.g. org members, repo stargazers or user followers, keyed by interaction type, url column and the GitHub ids of the source and target entities. Interaction types such as repo_user are shared by several joins (stargazers, forks, contributors and so on), so the url column the join was crawled from keeps their edges apart. It lives in `historic_data/entity_snapshots/entity_edges.db` and is written by get_entities_interactions alongside the join files, so cross-interaction queries and network builds read only the interaction types, entities and columns they need rather than reloading every join CSV.
+    Each edge keeps when it was first and last seen, and a JSON object of the attributes that describe the edge itself, such as when a repo was starred or how many contributions a user made.
+
+    :param data_directory_path: Path to the data directory.
+    """
+    edge_columns = ["interaction_type", "url_column", "source_type", "source_id", "source_key", "target_id", "target_key", "first_seen", "last_seen", "attributes"]
+    # Columns of the join files that describe the edge rather than the target entity
+    attribute_columns = ["starred_at", "contributions", "role_name", "permissions.admin", "permissions.push", "permissions.pull"]
+
+    def __init__(self, data_directory_path: str):
+        snapshot_dir = os.path.join(data_directory_path, "historic_data", "entity_snapshots")
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self.edge_path = os.path.join(snapshot_dir, "entity_edges.db")
+        with self.connect() as conn:
+            stored_columns = [column_info[1] for column_info in conn.execute("PRAGMA table_info(entity_edges)").fetchall()]
+            if (len(stored_columns) > 0) and ("url_column" not in stored_columns):
+                # Edges stored before they were keyed by url column mix the joins of an interaction type and cannot be told apart, so they are dropped and rebuilt as the joins are crawled again
+                console.print("Dropping edges that are not keyed by url column", style="bold red")
+                conn.execute("DROP TABLE entity_edges")
+            conn.execute("""CREATE TABLE IF NOT EXISTS entity_edges (
+                interaction_type TEXT, url_column TEXT, source_type TEXT, source_id INTEGER, source_key TEXT, target_id INTEGER, target_key TEXT,
+                first_seen TEXT, last_seen TEXT, attributes TEXT,
+                PRIMARY KEY (interaction_type, url_column, source_id, target_id))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS entity_edges_target ON entity_edges (target_id, interaction_type, url_column)")
+
+    @contextmanager
+    def connect(self):
+        """
+        Connects to the edge database, committing on success and closing the connection afterwards.
+
+        :return: Connection to the edge database.
+        """
+        conn = sqlite3.connect(self.edge_path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record_edges(self, interaction_type: str, url_column: str, source_type: str, join_df: pd.DataFrame, source_id_column: str, source_key_column: str, target_key_column: str, target_id_column: Optional[str] = None, seen_date: Optional[str] = None) -> None:
+        """
+        Records the edges of a join file, extending the first and last seen dates of edges that are already stored.
+
+        :param interaction_type: Type of interaction, e.g. repo_user.
+        :param url_column: Url column the join was crawled from, e.g. stargazers_url.
+        :param source_type: Type of the source entity (users, orgs or repos).
+        :param join_df: DataFrame of interactions, one row per target entity.
+        :param source_id_column: Column holding the GitHub id of the source entity.
+        :param source_key_column: Column holding the login or full name of the source entity.
+        :param target_key_column: Column holding the login or full name of the target entity, e.g. login, full_name, user.login or owner.login.
+        :param target_id_column: Column holding the GitHub id of the target entity. Defaults to the id column next to target_key_column, e.g. user.id for user.login.
+        :param seen_date: Date the edges were seen. Defaults to the coding_dh_date column, or today.
+        """
+        if len(join_df) == 0:
+            return
+        # Responses that wrap the target entity, like stargazers, issues or forks, hold its id under the same prefix as its key
+        if target_id_column is None:
+            target_prefix = target_key_column.rsplit(".", 1)[0] + "." if "." in target_key_column else ""
+            target_id_column = f"{target_prefix}id"
+        if target_id_column not in join_df.columns:
+            return
+        seen_dates = pd.Series(seen_date, index=join_df.index) if seen_date is not None else pd.to_datetime(join_df["coding_dh_date"], errors="coerce").dt.strftime("%Y-%m-%d") if "coding_dh_date" in join_df.columns else pd.Series(datetime.now().strftime("%Y-%m-%d"), index=join_df.index)
+        attribute_columns = [column for column in self.attribute_columns if column in join_df.columns]
+        attributes = join_df[attribute_columns].apply(lambda row: json.dumps({key: value for key, value in row.items() if pd.notna(value)}, default=str), axis=1) if len(attribute_columns) > 0 else pd.Series(None, index=join_df.index)
+        target_keys = join_df[target_key_column] if target_key_column in join_df.columns else pd.Series(None, index=join_df.index)
+        records = [(interaction_type, url_column, source_type, int(source_id), source_key, int(target_id), target_key if pd.notna(target_key) else None, seen, seen, edge_attributes)
+            for source_id, source_key, target_id, target_key, seen, edge_attributes in zip(join_df[source_id_column], join_df[source_key_column], join_df[target_id_column], target_keys, seen_dates, attributes)
+            if pd.notna(source_id) and pd.notna(target_id)]
+        with self.connect() as conn:
+            conn.executemany("""INSERT INTO entity_edges (interaction_type, url_column, source_type, source_id, source_key, target_id, target_key, first_seen, last_seen, attributes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (interaction_type, url_column, source_id, target_id) DO UPDATE SET
+                    source_key = excluded.source_key, target_key = COALESCE(excluded.target_key, target_key),
+                    first_seen = MIN(first_seen, excluded.first_seen), last_seen = MAX(last_seen, excluded.last_seen),
+                    attributes = COALESCE(excluded.attributes, attributes)""", records)
+
+    def read_edges(self, interaction_types: Optional[List[str]] = None, source_ids: Optional[List[int]] = None, target_ids: Optional[List[int]] = None, columns: Optional[List[str]] = None, parse_attributes: bool = False, source_keys: Optional[List[str]] = None, url_columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Reads edges, restricted to the interaction types, joins, entities and columns asked for.
+
+        :param interaction_types: Optional list of interaction types to read.
+        :param url_columns: Optional list of url columns of the joins to read, e.g. stargazers_url. Needed to read a single join of a shared interaction type.
+        :param source_ids: Optional list of source entity ids to read the edges of.
+        :param source_keys: Optional list of logins or full names of the source entities to read the edges of.
+        :param target_ids: Optional list of target entity ids to read the edges of.
+        :param columns: Optional list of edge columns to read. Defaults to all of them.
+        :param parse_attributes: Whether to expand the attributes into one column each.
+        :return: DataFrame of edges.
+        """
+        columns = self.edge_columns if columns is None else [column for column in columns if column in self.edge_columns]
+        query = f"SELECT {', '.join(f'edges.{column}' for column in columns)} FROM entity_edges AS edges"
+        with self.connect() as conn:
+            # Filter values are joined from temp tables, since a long list of them would exceed SQLite's variable limit
+            for column, values, value_type in [("interaction_type", interaction_types, str), ("url_column", url_columns, str), ("source_id", source_ids, int), ("source_key", source_keys, str), ("target_id", target_ids, int)]:
+                if values is None:
+                    continue
+                lookup_table = f"lookup_{column}s"
+                conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {lookup_table} (value {'TEXT' if value_type is str else 'INTEGER'})")
+                conn.execute(f"DELETE FROM {lookup_table}")
+                conn.executemany(f"INSERT INTO {lookup_table} (value) VALUES (?)", [(value,) for value in {value_type(value) for value in values if pd.notna(value)}])
+                query += f" JOIN {lookup_table} ON {lookup_table}.value = edges.{column}"
+            edges_df = pd.read_sql_query(query, conn)
+        if parse_attributes and "attributes" in edges_df.columns:
+            attributes_df = pd.json_normalize(edges_df.attributes.apply(lambda attributes: json.loads(attributes) if attributes is not None else {}).tolist())
+            edges_df = pd.concat([edges_df.drop(columns=["attributes"]), attributes_df], axis=1)
+        return edges_df
+
+    def count_targets(self, interaction_type: str, url_column: str, source_keys: List[str]) -> Dict[str, int]:
+        """
+        Counts the distinct target entities of each source entity for one join, in a single grouped query. Edges are kept once seen, so targets that have since been removed, e.g. unstarred repos, are still counted.
+
+        :param interaction_type: Type of interaction, e.g. repo_user.
+        :param url_column: Url column the join was crawled from, e.g. stargazers_url.
+        :param source_keys: List of logins or full names of the source entities.
+        :return: Dictionary of the number of distinct targets keyed by source entity. Entities without any stored edges are left out.
+        """
+        with self.connect() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_keys (entity_key TEXT)")
+            conn.execute("DELETE FROM lookup_keys")
+            conn.executemany("INSERT INTO lookup_keys (entity_key) VALUES (?)", [(str(source_key),) for source_key in source_keys if pd.notna(source_key)])
+            rows = conn.execute("""SELECT edges.source_key, COUNT(DISTINCT edges.target_id) FROM entity_edges AS edges
+                JOIN lookup_keys ON lookup_keys.entity_key = edges.source_key
+                WHERE edges.interaction_type = ? AND edges.url_column = ?
+                GROUP BY edges.source_key""", [interaction_type, url_column]).fetchall()
+        return dict(rows)
+
+class EntityBatchWriter:
+    """
+    Buffers fetched entity rows and flushes them in large batches to partition files under `historic_data/entity_partitions/{entity_type}`, instead of reading and rewriting one CSV per entity. Partition names start with the flush time, so sorting them gives the order they were written in.
+    Versions buffered with a payload hash are only recorded in the snapshot store once their partition is on disk, so an interrupted run never marks an unwritten version as stored.
+
+    :param data_directory_path: Path to the data directory.
+    :param entity_type: Type of entity (users, orgs or repos).
+    :param batch_size: Number of buffered rows that triggers a flush. Defaults to 1000.
+    :param snapshot_store: Optional snapshot store to record the written versions in.
+    :param locator: Optional entity locator to record the partition of each written entity in. Defaults to the locator of the data directory.
+    """
+    def __init__(self, data_directory_path: str, entity_type: str, batch_size: int = 1000, snapshot_store: Optional[EntitySnapshotStore] = None, locator: Optional[EntityLocator] = None):
+        self.entity_type = entity_type
+        self.entity_column = get_entity_column(entity_type)
+        self.partition_dir = get_entity_partition_dir(data_directory_path, entity_type)
+        os.makedirs(self.partition_dir, exist_ok=True)
+        self.batch_size = batch_size
+        self.snapshot_store = snapshot_store
+        self.locator = locator if locator is not None else EntityLocator(data_directory_path)
+        self.buffer = []
+        self.buffered_rows = 0
+        self.pending_versions = []
+
+    def add(self, entity_df: pd.DataFrame, entity_id: Optional[Union[str, int]] = None, payload_hash: Optional[str] = None) -> None:
+        """
+        Adds entity rows to the buffer, flushing it if it is full. The coding_dh_id column is dropped because version numbers are assigned when partitions are read.
+
+        :param entity_df: DataFrame with the entity rows to write.
+        :param entity_id: Optional GitHub id of the entity, recorded in the snapshot store with payload_hash.
+        :param payload_hash: Optional content hash of the entity payload.
+        """
+        entity_df = entity_df.drop(columns=["coding_dh_id"], errors="ignore")
+        self.buffer.append(entity_df)
+        self.buffered_rows += len(entity_df)
+        if payload_hash is not None:
+            self.pending_versions.append((entity_id, entity_df[self.entity_column].values[0], payload_hash, str(entity_df["coding_dh_date"].values[0])))
+        if self.buffered_rows >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> Optional[str]:
+        """
+        Writes the buffered rows to a new partition file, then the snapshot store's buffered versions and observations.
+
+        :return: Path to the partition file, or None if the buffer was empty.
+        """
+        if len(self.buffer) == 0:
+            # Observations of unchanged entities are still written
+            if self.snapshot_store is not None:
+                self.snapshot_store.flush()
+            return None
+        batch_df = apply_schema(pd.concat(self.buffer, ignore_index=True), self.entity_type)
+        partition_path = os.path.join(self.partition_dir, f"{self.entity_type}_{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{os.getpid()}.csv")
+        # Write to a temporary file first so that readers never see a partly written partition
+        format_schema_for_csv(batch_df).to_csv(f"{partition_path}.tmp", index=False)
+        os.replace(f"{partition_path}.tmp", partition_path)
+        self.locator.record_locations(self.entity_type, batch_df, partition_path)
+        if self.snapshot_store is not None:
+            for pending_version in self.pending_versions:
+                self.snapshot_store.record_version(*pending_version)
+            self.snapshot_store.flush()
+        console.print(f"Wrote {len(batch_df)} {self.entity_type} to {partition_path}", style="bold green")
+        self.buffer = []
+        self.buffered_rows = 0
+        self.pending_versions = []
+        return partition_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+def read_located_entities(data_directory_path: str, entity_type: str, entity_keys: List[str], include_legacy_files: bool = True, usecols: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Reads the latest version of a set of entities, using the entity locator to only open the files that hold them. Each entity is only taken from the file its latest version is located in, and keys that are aliases of a renamed entity are resolved to its current name.
+
+    :param data_directory_path: Path to the data directory.
+    :param entity_type: Type of entity (users, orgs or repos).
+    :param entity_keys: List of logins or full names to read.
+    :param include_legacy_files: Whether to also read entities located in the legacy entity files. Defaults to True.
+    :param usecols: Optional list of columns to read. If None, every column is read.
+    :return: DataFrame with one row per located entity, with the entity schema types applied.
+    """
+    entity_column = get_entity_column(entity_type)
+    locator = EntityLocator(data_directory_path)
+    locator.backfill(entity_type)
+    # Entities requested under an old name are served under their current one
+    aliases = locator.resolve_aliases(entity_type, list(entity_keys))
+    located_df = locator.locate(entity_type, entity_keys=list(entity_keys) + list(aliases.values()))
+    if not include_legacy_files:
+        located_df = located_df[~located_df.file_path.str.startswith(os.path.join("historic_data", "entity_files"))]
+    keys_by_file: Dict[str, set] = located_df.groupby("file_path").entity_key.agg(set).to_dict()
+
+    file_dfs = read_entity_files([os.path.join(data_directory_path, file_path) for file_path in keys_by_file], entity_type, usecols)
+    dfs = []
+    for df, file_keys in zip(file_dfs, keys_by_file.values()):
+        if df is None or entity_column not in df.columns:
+            continue
+        dfs.append(df[df[entity_column].astype(str).isin(file_keys)])
+    if len(dfs) == 0:
+        return pd.DataFrame()
+    combined_df = apply_schema(pd.concat(dfs, ignore_index=True), entity_type)
+    combined_df = combined_df.sort_values(by="coding_dh_date", kind="mergesort", na_position="first")
+    combined_df = combined_df.drop_duplicates(subset=[entity_column], keep="last")
+    combined_df["coding_dh_id"] = pd.array([0] * len(combined_df), dtype="Int64")
+    return combined_df.reset_index(drop=True)
+
+def read_latest_entities(data_directory_path: str, entity_type: str, entity_keys: Optional[List[str]] = None, include_legacy_files: bool = True, return_all: bool = False, usecols: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Reads entities from their partitions, and from the legacy one-CSV-per-entity files, and serves the latest version of each. When the same entity was written more than once on the same coding_dh_date, the last write wins.
+
+    :param data_directory_path: Path to the data directory.
+    :param entity_type: Type of entity (users, orgs or repos).
+    :param entity_keys: Optional list of logins or full names to read. If None, every stored entity is read. If given and return_all is False, only the files the entity locator points to are read.
+    :param include_legacy_files: Whether to also read the legacy entity files. Defaults to True.
+    :param return_all: Whether to return every version of each entity rather than only the latest. Defaults to False.
+    :param usecols: Optional list of columns to read. If None, every column is read.
+    :return: DataFrame with one row per entity, or one row per version if return_all is True, numbered by coding_dh_id, with the entity schema types applied.
+    """
+    entity_column = get_entity_column(entity_type)
+    entity_keys = set(entity_keys) if entity_keys is not None else None
+    if entity_keys is not None and not return_all:
+        return read_located_entities(data_directory_path, entity_type, entity_keys, include_legacy_files, usecols)
+    file_paths = []
+    if include_legacy_files:
+        legacy_dir = os.path.join(data_directory_path, "historic_data", "entity_files", f"all_{entity_type}")
+        if entity_keys is None:
+            legacy_files = [os.path.join(legacy_dir, file) for file in os.listdir(legacy_dir) if file.endswith(".csv")] if os.path.exists(legacy_dir) else []
+        else:
+            legacy_files = [get_legacy_entity_file_path(data_directory_path, entity_type, entity_key) for entity_key in entity_keys]
+        file_paths.extend(file_path for file_path in legacy_files if os.path.exists(file_path))
+    partition_dir = get_entity_partition_dir(data_directory_path, entity_type)
+    if os.path.exists(partition_dir):
+        # Partitions come after the legacy files since they are always newer
+        file_paths.extend(os.path.join(partition_dir, file) for file in sorted(os.listdir(partition_dir)) if file.endswith(".csv"))
+
+    dfs = []
+    for df in read_entity_files(file_paths, entity_type, usecols):
+        if df is None or entity_column not in df.columns:
+            continue
+        if entity_keys is not None:
+            df = df[df[entity_column].isin(entity_keys)]
+        dfs.append(df)
+    if len(dfs) == 0:
+        return pd.DataFrame()
+    # The schema is applied after combining the files so categoricals share the same categories
+    combined_df = apply_schema(pd.concat(dfs, ignore_index=True), entity_type)
+    combined_df = combined_df.sort_values(by="coding_dh_date", kind="mergesort", na_position="first")
+    combined_df = combined_df.drop_duplicates(subset=[entity_column, "coding_dh_date"], keep="last")
+    combined_df["coding_dh_id"] = combined_df.groupby(entity_column, observed=True).cumcount().astype("Int64")
+    if not return_all:
+        combined_df = combined_df.drop_duplicates(subset=[entity_column], keep="last")
+    return combined_df.reset_index(drop=True)
+
+class EntityRecord(dict):
+    """
+    Lightweight record of one entity's fields. It is a plain dict that also allows attribute access (e.g. record.url), so stages can treat records like the rows they used to get from `iterrows`.
+    """
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+def iter_record_chunks(entities: Union[pd.DataFrame, Iterable[Any]], chunk_size: int = 1000) -> Iterator[List[EntityRecord]]:
+    """
+    Streams entities as chunks of EntityRecords, so stages can process any number of candidates without materializing them. Accepts a DataFrame, or any iterable of dicts, named tuples, DataFrames or Arrow record batches (anything with `to_pylist`).
+
+    :param entities: Entities to stream.
+    :param chunk_size: Maximum number of records per chunk. Defaults to 1000.
+    :return: Iterator over lists of records.
+    """
+    if isinstance(entities, pd.DataFrame):
+        entities = [entities]
+    buffer = []
+    for item in entities:
+        if isinstance(item, pd.DataFrame):
+            records = (EntityRecord(record) for start in range(0, len(item), chunk_size) for record in item.iloc[start:start + chunk_size].to_dict("records"))
+        elif hasattr(item, "to_pylist"):
+            records = (EntityRecord(record) for record in item.to_pylist())
+        elif hasattr(item, "_asdict"):
+            records = [EntityRecord(item._asdict())]
+        else:
+            records = [EntityRecord(item)]
+        for record in records:
+            buffer.append(record)
+            if len(buffer) >= chunk_size:
+                yield buffer
+                buffer = []
+    if len(buffer) > 0:
+        yield buffer
+
+def iter_latest_entities(data_directory_path: str, entity_type: str, entity_keys: Optional[List[str]] = None, usecols: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Streams the latest version of entities from the files the entity locator points to, one file at a time, so only one file is held in memory. Pass the result to `iter_record_chunks` or straight to a stage.
+
+    :param data_directory_path: Path to the data directory.
+    :param entity_type: Type of entity (users, orgs or repos).
+    :param entity_keys: Optional list of logins or full names to stream. If None, every located entity is streamed.
+    :param usecols: Optional list of columns to read. If None, every column is read.
+    :return: Iterator over DataFrames holding the latest versions of the entities located in each file.
+    """
+    entity_column = get_entity_column(entity_type)
+    locator = EntityLocator(data_directory_path)
+    locator.backfill(entity_type)
+    if entity_keys is not None:
+        aliases = locator.resolve_aliases(entity_type, list(entity_keys))
+        located_df = locator.locate(entity_type, entity_keys=list(entity_keys) + list(aliases.values()))
+    else:
+        located_df = locator.locate(entity_type)
+    for file_path, file_keys in located_df.groupby("file_path").entity_key.agg(set).items():
+        df = read_entity_csv(os.path.join(data_directory_path, file_path), None if usecols is None else list(usecols) + [entity_column, "coding_dh_date"])
+        if df is None or entity_column not in df.columns:
+            continue
+        df = df[df[entity_column].astype(str).isin(file_keys)]
+        df = apply_schema(df, entity_type).sort_values(by="coding_dh_date", kind="mergesort", na_position="first")
+        yield df.drop_duplicates(subset=[entity_column], keep="last")
@@ -7,6 +7,9 @@ warnings.filterwarnings('ignore')
 import pandas as pd
 import os
 import time
+import shutil
+import threading
+from typing import Any, Iterable, Optional, Union
 sys.path.append("..")
 from data_generation_scripts.general_utils import *
 
@@ -19,8 +22,170 @@ console = Console()
 
 data_directory_path = get_data_directory_path()
 
+# Budget for the background crawl of entities over the threshold, kept well below the core limit so that regular crawls are not starved
+background_rate_limiter = RateLimiter(1000, 3600.0)
 
-def get_entities_interactions(entity_df: pd.DataFrame, url_column: str, entity_type: str, interaction_directory_path: str, interaction_type: str, threshold_limit: int, source_column: str, target_column: str, retry_errors: bool=False, write_only_new: bool=False) -> None:
+
+# Interaction endpoints that can be crawled from their newest end. Stargazers are listed oldest first, so they are walked back from the last page. Forks and pulls can be sorted newest first, and issues filtered to those updated since the last crawl. Crawls stop at the first page holding a key already stored, or a timestamp no newer than the latest one stored.
+incremental_strategies = {
+    "stargazers_url": {"reverse": True, "key_columns": ["user.id", "id"]},
+    "forks_url": {"params": "sort=newest", "key_columns": ["id"]},
+    "pulls_url": {"params": "sort=updated&direction=desc", "timestamp_column": "updated_at"},
+    "issues_url": {"since_column": "updated_at"},
+}
+
+def get_new_interactions(query: str, url_column: str, subset_existing_df: pd.DataFrame, active_auth_headers: dict) -> tuple:
+    """
+    Collects the interactions added since an existing join file was crawled, starting from the newest end of a time-ordered endpoint and stopping at the first interactions already stored.
+
+    :param query: Url of the first page of the interaction
+    :param url_column: Column holding the url of the interaction, one of incremental_strategies
+    :param subset_existing_df: Rows of the existing join file
+    :param active_auth_headers: Authorization headers, with the star+json media type for stargazers
+    :return: Tuple of the list of dataframes of new interactions (None if a request failed), the last status code and the last url requested
+    """
+    strategy = incremental_strategies[url_column]
+    if "params" in strategy:
+        query = f"{query}&{strategy['params']}"
+    since_column = strategy.get("since_column")
+    if (since_column is not None) and (since_column in subset_existing_df.columns):
+        since = pd.to_datetime(subset_existing_df[since_column], errors="coerce", utc=True).max()
+        if pd.notna(since):
+            query = f"{query}&since={since.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+    key_column = next((column for column in strategy.get("key_columns", []) if column in subset_existing_df.columns), None)
+    known_keys = set(pd.to_numeric(subset_existing_df[key_column], errors="coerce").dropna().astype(int)) if key_column is not None else set()
+    timestamp_column = strategy.get("timestamp_column")
+    latest_timestamp = pd.to_datetime(subset_existing_df[timestamp_column], errors="coerce", utc=True).max() if (timestamp_column is not None) and (timestamp_column in subset_existing_df.columns) else pd.NaT
+
+    response, status_code = make_request_with_rate_limiting(query, active_auth_headers)
+    if response is None:
+        return None, status_code, query
+    link_name = "next"
+    if strategy.get("reverse") and ("last" in response.links):
+        # Jump to the newest page and walk back through the older ones
+        query = response.links["last"]["url"]
+        link_name = "prev"
+        response, status_code = make_request_with_rate_limiting(query, active_auth_headers)
+        if response is None:
+            return None, status_code, query
+    dfs = []
+    while True:
+        page_df = pd.json_normalize(response.json())
+        if "message" in page_df.columns:
+            console.print(f"Error for {query}: {page_df.message.values[0]}", style="bold red")
+            return None, status_code, query
+        if len(page_df) == 0:
+            break
+        is_known = pd.Series(False, index=page_df.index)
+        if (key_column is not None) and (key_column in page_df.columns):
+            is_known = is_known | pd.to_numeric(page_df[key_column], errors="coerce").isin(known_keys)
+        if pd.notna(latest_timestamp) and (timestamp_column in page_df.columns):
+            is_known = is_known | (pd.to_datetime(page_df[timestamp_column], errors="coerce", utc=True) <= latest_timestamp)
+        dfs.append(page_df[~is_known])
+        if is_known.any() or (link_name not in response.links):
+            break
+        query = response.links[link_name]["url"]
+        response, status_code = make_request_with_rate_limiting(query, active_auth_headers)
+        if response is None:
+            return None, status_code, query
+    return [df for df in dfs if len(df) > 0], status_code, query
+
+def write_interaction_file(combined_response_df: pd.DataFrame, subset_existing_df: pd.DataFrame, row: dict, file_path: str, entity_type: str, url_column: str, source_column: str, original_source_column: str, grouped_columns: list, join_schema_name: str, interaction_type: Optional[str] = None, edge_store: Optional[EntityEdgeStore] = None) -> None:
+    """
+    Adds the source entity's columns to newly collected interactions, combines them with the existing join file and writes it. The new interactions are also recorded in the edge store, if one is given.
+
+    :param combined_response_df: Interactions collected in this crawl
+    :param subset_existing_df: Rows of the existing join file, or an empty dataframe
+    :param row: Record of the source entity
+    :param file_path: Path to the join file
+    :param entity_type: Type of entity (users, orgs or repos)
+    :param url_column: Column holding the url of the interaction
+    :param source_column: Column identifying the source entity (login or full_name)
+    :param original_source_column: Column identifying the source entity in the join file
+    :param grouped_columns: Columns identifying an interaction, used to number its versions
+    :param join_schema_name: Name of the join schema applied before writing, if declared
+    :param interaction_type: Type of interaction, used to record the edges
+    :param edge_store: Optional edge store to record the edges in
+    """
+    entity_type_singular = entity_type[:-1]
+    combined_response_df[f"{entity_type_singular}_id"] = row.id
+    combined_response_df[f"{entity_type_singular}_url"] = row.url
+    combined_response_df[f"{entity_type_singular}_html_url"] = row.html_url
+    combined_response_df[f"{original_source_column}"] = row[source_column]
+    combined_response_df[f"{entity_type_singular}_{url_column}"] = row[url_column]
+    combined_response_df["coding_dh_date"] = datetime.now().strftime("%Y-%m-%d")
+    concat_df = pd.concat([subset_existing_df, combined_response_df])
+    concat_df['coding_dh_date'] = pd.to_datetime(concat_df['coding_dh_date'], format="%Y-%m-%d", errors="coerce")
+    concat_df = concat_df.reset_index(drop=True)
+    subset_columns = ["coding_dh_date"]
+    final_processed_df = add_coding_dh_ids(concat_df, grouped_columns, subset_columns)
+    if has_schema(join_schema_name):
+        final_processed_df = format_schema_for_csv(apply_schema(final_processed_df, join_schema_name))
+    final_processed_df.to_csv(file_path, index=False)
+    if edge_store is not None:
+        edge_store.record_edges(interaction_type, url_column, entity_type, combined_response_df, f"{entity_type_singular}_id", original_source_column, grouped_columns[1])
+
+def is_join_error(error_df: pd.DataFrame, url_column: str) -> pd.Series:
+    """
+    Selects the rows of an interaction error CSV that were logged by one join. Errors of every join of an interaction type are logged to the same CSV, with the url the join was crawled from, e.g. https://api.github.com/repos/a/b/stargazers for stargazers_url.
+
+    :param error_df: DataFrame of the error CSV
+    :param url_column: Url column of the join
+    :return: Boolean series marking the rows of the join. Every row is kept if the CSV does not record the url.
+    """
+    if 'url_column' not in error_df.columns:
+        return pd.Series(True, index=error_df.index)
+    url_endpoint = url_column[:-len('_url')] if url_column.endswith('_url') else url_column
+    join_urls = error_df['url_column'].astype(str).str.split('{').str[0].str.rstrip('/')
+    return join_urls.str.endswith(f"/{url_endpoint}")
+
+def write_recorded_counts(recorded_counts: dict, collectable_rows: list, entity_type: str, source_column: str, count_column: str, entity_writer: EntityBatchWriter) -> None:
+    """
+    Merges the totals recorded by get_entities_interactions into the stored latest version of each entity whose count changed, and adds the new versions to the writer.
+
+    :param recorded_counts: Totals of the crawls that finished ok, keyed by entity
+    :param collectable_rows: Entity rows that were crawled, used to skip entities whose count did not change
+    :param entity_type: Type of entity (users, orgs or repos)
+    :param source_column: Column identifying the entity (login or full_name)
+    :param count_column: Column to write the totals to
+    :param entity_writer: Writer to add the new versions to. Versions are recorded in its snapshot store once flushed.
+    """
+    changed_keys = [row[source_column] for row in collectable_rows if row[source_column] in recorded_counts and not (pd.notna(row.get(count_column)) and row[count_column] == recorded_counts[row[source_column]])]
+    if len(changed_keys) == 0:
+        return
+    latest_df = read_latest_entities(data_directory_path, entity_type, changed_keys)
+    if len(latest_df) == 0:
+        return
+    coding_dh_date = datetime.now().strftime("%Y-%m-%d")
+    for _, latest_row in latest_df.iterrows():
+        if latest_row[source_column] not in recorded_counts:
+            continue
+        entity_df = pd.DataFrame([latest_row]).drop(columns=["coding_dh_id"], errors="ignore")
+        entity_df[count_column] = recorded_counts[latest_row[source_column]]
+        entity_df["coding_dh_date"] = coding_dh_date
+        entity_id = entity_df["id"].values[0] if ("id" in entity_df.columns) and pd.notna(entity_df["id"].values[0]) else latest_row[source_column]
+        entity_writer.add(entity_df, entity_id, compute_payload_hash(entity_df))
+
+def get_entities_interactions(entities: Union[pd.DataFrame, Iterable[Any]], url_column: str, entity_type: str, interaction_directory_path: str, interaction_type: str, threshold_limit: int, source_column: str, target_column: str, retry_errors: bool=False, write_only_new: bool=False, chunk_size: int=1000, record_counts: bool=False, refresh_policy: Optional[EntityRefreshPolicy]=None, incremental: bool=False) -> None:
+    """
+    Collects the interactions of entities, e.g. the repos of orgs or the stargazers of repos, and writes them to one join file per entity. Entities are streamed in chunks of lightweight records, so they can be passed as a dataframe or any iterable of dicts, named tuples, dataframes or Arrow record batches.
+    Entities over the threshold whose interactions were already crawled in full, e.g. by crawl_over_threshold_entities, are crawled again incrementally where incremental is set and the endpoint allows it, and otherwise marked over_threshold for a new background crawl. With a refresh policy, only those it finds could have changed since their last crawl are crawled again.
+
+    :param entities: Entities to collect the interactions of
+    :param url_column: Column holding the url of the interaction
+    :param entity_type: Type of entity (users, orgs or repos)
+    :param interaction_directory_path: Directory to write the join files to
+    :param interaction_type: Type of interaction
+    :param threshold_limit: Maximum number of interactions to collect for an entity. Entities over it are recorded as over_threshold.
+    :param source_column: Column identifying the source entity in the join files
+    :param target_column: Column identifying the target entity in the join files
+    :param retry_errors: Boolean indicating whether to retry errors
+    :param write_only_new: Boolean indicating whether to skip entities that already have a join file
+    :param chunk_size: Number of entities looked up and processed at a time
+    :param record_counts: Boolean indicating whether to record counts as a by-product of the crawl. Entities without a count are crawled rather than skipped, and the total estimated from the Link header of the first page is used for the threshold check. The number of rows collected by every crawl that finished ok is merged into the stored latest version of the entity and written back through the snapshot store, so a separate count pass is then optional.
+    :param refresh_policy: Optional refresh policy. If given, entities this join already crawled are only crawled again if their activity timestamps show they could have changed since, or their last crawl is older than the policy's maximum age.
+    :param incremental: Boolean indicating whether to only collect new interactions for entities that already have a join file, for the time-ordered endpoints in incremental_strategies. Crawls start from the newest end and stop at the first interactions already stored, so a refresh costs pages in proportion to new activity. Counts are not recorded for these entities.
+    """
     original_source_column = source_column
     source_column = 'login' if 'login' in source_column else 'full_name'
     entity_type_singular = entity_type[:-1]
@@ -35,122 +200,262 @@ def get_entities_interactions(entity_df: pd.DataFrame, url_column: str, entity_t
     subset_metadata_df = metadata_df[metadata_df.url_column == url_column]
     count_column = subset_metadata_df.count_column.values[0]
     error_file_path = os.path.join(data_directory_path, "error_logs", f"{interaction_type}_interaction_errors.csv")
-    if os.path.exists(error_file_path):
-        error_drop_fields = [source_column, 'interaction_type', 'error_url']
-        clean_write_error_file(error_file_path, error_drop_fields)
-        if retry_errors == False:
-            error_df = pd.read_csv(error_file_path)
-            entity_df = entity_df[(~entity_df[source_column].isin(error_df[source_column])) & (~entity_df[target_column].isin(error_df[target_column]))]
-            if entity_df.empty:
-                console.print(f"All {entity_type_singular} have been processed for {interaction_type}", style="bold green")
-                return
+    # Leave out excluded entities and errored entities that are not due for a retry. Entities over the threshold are checked again against the current threshold limit.
+    status_store = EntityStatusStore(data_directory_path)
+    edge_store = EntityEdgeStore(data_directory_path)
+    # Several joins share an interaction type, so their statuses and cursors are kept under a stage of their own
+    interaction_stage = get_interaction_stage(interaction_type, url_column)
+    status_store.import_legacy_files(interaction_stage, entity_type, source_column, error_file_path=error_file_path, threshold_file_path=threshold_file_path, error_filter=lambda error_df: is_join_error(error_df, url_column))
     
     drop_columns = ["coding_dh_id", "Unnamed: 0"]
+    # Join directories are named after their join type, e.g. historic_data/join_files/org_repos_join_dataset
+    join_schema_name = os.path.basename(interaction_directory_path.rstrip('/')).replace('_join_dataset', '')
     
-    progress_bar = tqdm(total=entity_df.shape[0], desc=f"Processing {interaction_directory_path} {entity_type_singular}")
-    for _, row in entity_df[entity_df[count_column] > 0].iterrows():
-        try:
+    progress_bar = tqdm(total=len(entities) if hasattr(entities, "__len__") else None, desc=f"Processing {interaction_directory_path} {entity_type_singular}")
+    # One writer for the whole call, so recorded counts end up in as few partitions as possible
+    entity_writer = EntityBatchWriter(data_directory_path, entity_type, snapshot_store=EntitySnapshotStore(data_directory_path, entity_type)) if record_counts else None
+    for chunk in iter_record_chunks(entities, chunk_size):
+        # Leave out entities without any interactions to collect
+        collectable_rows = [row for row in chunk if pd.notna(row.get(source_column)) and ((record_counts and pd.isna(row.get(count_column))) or (pd.notna(row.get(count_column)) and row[count_column] > 0))]
+        blocked_keys = status_store.get_blocked_keys(interaction_stage, entity_type, [row[source_column] for row in collectable_rows], retry_errors, blocked_statuses=["excluded"])
+        collectable_rows = [row for row in collectable_rows if row[source_column] not in blocked_keys]
+        if (refresh_policy is not None) and (len(collectable_rows) > 0):
+            # Leave out entities that have not changed since they were last crawled
+            refresh_mask = refresh_policy.select_for_refresh(status_store, pd.DataFrame(collectable_rows), interaction_stage, entity_type, source_column)
+            collectable_rows = [row for row, needs_refresh in zip(collectable_rows, refresh_mask) if needs_refresh]
+        progress_bar.update(len(chunk) - len(collectable_rows))
+        # Totals of the crawls that finished ok, keyed by entity
+        recorded_counts = {}
+        # Entities over the threshold whose interactions were already crawled in full, e.g. by crawl_over_threshold_entities
+        over_threshold_keys = [row[source_column] for row in collectable_rows if pd.notna(row.get(count_column)) and (row[count_column] > threshold_limit)]
+        crawled_keys = set(status_store.get_last_success(interaction_stage, entity_type, over_threshold_keys)) if len(over_threshold_keys) > 0 else set()
+        for row in collectable_rows:
+            # Reset per row so the error handler never sees values left over from the previous row, or unbound ones
+            status_code, query = None, row.get(url_column)
+            additional_data = {source_column: row[source_column], 'url_column': row.get(url_column), 'interaction_type': interaction_type}
+            try:
 
-            if (row[count_column] == None) or (row[count_column] == 0):
-                console.print(f"Skipping {row[source_column]} as it has no {interaction_type}")
-                progress_bar.update(1)
-                continue
-            elif row[count_column] > threshold_limit:
-                over_threshold_df = pd.DataFrame([{f"{source_column}": row[source_column], f"{count_column}": row[count_column], 'threshold_check_date': datetime.now().strftime("%Y-%m-%d"), 'threshold_limit': threshold_limit, 'url_column': row[url_column]}])
-                console.print(f"Saving {row[source_column]} as it has {row[count_column]} {interaction_type} which is over the threshold limit of {threshold_limit}")
-                if os.path.exists(threshold_file_path):
-                    over_threshold_df.to_csv(threshold_file_path, mode='a', header=False, index=False)
+                if pd.notna(row.get(count_column)) and (row[count_column] == 0):
+                    console.print(f"Skipping {row[source_column]} as it has no {interaction_type}")
+                    progress_bar.update(1)
+                    continue
+                elif pd.notna(row.get(count_column)) and (row[count_column] > threshold_limit) and not ((row[source_column] in crawled_keys) and incremental and (url_column in incremental_strategies)):
+                    console.print(f"Saving {row[source_column]} as it has {row[count_column]} {interaction_type} which is over the threshold limit of {threshold_limit}")
+                    status_store.mark(interaction_stage, entity_type, row[source_column], "over_threshold", detail=f"{count_column}={row[count_column]};threshold_limit={threshold_limit};url_column={row[url_column]}")
+                    progress_bar.update(1)
+                    continue
                 else:
-                    over_threshold_df.to_csv(threshold_file_path, index=False)
-                progress_bar.update(1)
-                continue
-            else:
-                console.print(f"Processing {row[source_column]} for {interaction_type}")
-                entity_name = row[source_column].replace("/", "_")
-                interaction_directory_path = interaction_directory_path.lstrip('/')
-                file_path = os.path.join(data_directory_path, interaction_directory_path, f"{entity_name}_{interaction_type}_{url_column}.csv")
-                grouped_columns = [original_source_column, target_column]
-                if os.path.exists(file_path):
-                    existing_df = read_csv_file(file_path)
-                    existing_df["coding_dh_date"] = pd.to_datetime(existing_df["coding_dh_date"], format="%Y-%m-%d", errors="coerce")
-                    existing_df = existing_df.sort_values(by="coding_dh_date", ascending=False)
-                    # subset_existing_df = existing_df.groupby(grouped_columns).first().reset_index()
-                    subset_existing_df = drop_columns_from_df(existing_df, drop_columns)
-                    if write_only_new:
-                        console.print(f"Skipping {row[source_column]} as it already exists")
+                    console.print(f"Processing {row[source_column]} for {interaction_type}")
+                    entity_name = row[source_column].replace("/", "_")
+                    interaction_directory_path = interaction_directory_path.lstrip('/')
+                    file_path = os.path.join(data_directory_path, interaction_directory_path, f"{entity_name}_{interaction_type}_{url_column}.csv")
+                    grouped_columns = [original_source_column, target_column]
+                    if os.path.exists(file_path):
+                        existing_df = read_csv_file(file_path)
+                        existing_df["coding_dh_date"] = pd.to_datetime(existing_df["coding_dh_date"], format="%Y-%m-%d", errors="coerce")
+                        existing_df = existing_df.sort_values(by="coding_dh_date", ascending=False)
+                        # subset_existing_df = existing_df.groupby(grouped_columns).first().reset_index()
+                        subset_existing_df = drop_columns_from_df(existing_df, drop_columns)
+                        if write_only_new:
+                            console.print(f"Skipping {row[source_column]} as it already exists")
+                            progress_bar.update(1)
+                            continue
+                    else:
+                        subset_existing_df = pd.DataFrame()
+                
+                    query = row[url_column].split('{')[0] + '?per_page=100&page=1' if '{' in row[url_column] else row[url_column] + '?per_page=100&page=1'
+
+                    if 'check_state' in metadata_df.columns:
+                        if subset_metadata_df['check_state'].values[0]:
+                            query = query.replace('?', '?state=all&')
+                    additional_data = {source_column: row[source_column], 'url_column': row[url_column], 'interaction_type': interaction_type}
+                    if incremental and (len(subset_existing_df) > 0) and (url_column in incremental_strategies):
+                        # Only collect the interactions added since the existing join file was crawled
+                        dfs, status_code, failed_query = get_new_interactions(query, url_column, subset_existing_df, active_auth_headers)
+                        if dfs is None:
+                            log_error_to_file(error_file_path, additional_data, status_code, failed_query)
+                            status_store.mark(interaction_stage, entity_type, row[source_column], "error", status_code, failed_query)
+                            progress_bar.update(1)
+                            continue
+                        if len(dfs) > 0:
+                            console.print(f"Saving {sum(len(df) for df in dfs)} new {interaction_type} of {row[source_column]} to {file_path}")
+                            write_interaction_file(pd.concat(dfs), subset_existing_df, row, file_path, entity_type, url_column, source_column, original_source_column, grouped_columns, join_schema_name, interaction_type, edge_store)
+                        else:
+                            console.print(f"No new {interaction_type} for {row[source_column]}")
+                        status_store.mark(interaction_stage, entity_type, row[source_column], "ok")
                         progress_bar.update(1)
                         continue
-                else:
-                    subset_existing_df = pd.DataFrame()
-                    
-                query = row[url_column].split('{')[0] + '?per_page=100&page=1' if '{' in row[url_column] else row[url_column] + '?per_page=100&page=1'
+                    response, status_code = make_request_with_rate_limiting(query, active_auth_headers)
 
-                if 'check_state' in metadata_df.columns:
-                    if subset_metadata_df['check_state']:
-                        query = query.replace('?', '?state=all&')
-                response, status_code = make_request_with_rate_limiting(query, active_auth_headers)
-
-                dfs = []
-                additional_data = {source_column: row[source_column], 'url_column': row[url_column], 'interaction_type': interaction_type}
-                
-                if response is None:
-                    log_error_to_file(error_file_path, additional_data, status_code, query)
-                    console.print(f"Error for {row[source_column]}, status code: {status_code}", style="bold red")
-                    progress_bar.update(1)
-                    continue
-                else:
-                    response_data = response.json()
-                    response_df = pd.json_normalize(response_data)
-                    if "message" in response_df.columns:
-                        console.print(f"Error for {row[source_column]}: {response_df.message.values[0]}", style="bold red")
+                    dfs = []
+            
+                    if response is None:
                         log_error_to_file(error_file_path, additional_data, status_code, query)
+                        status_store.mark(interaction_stage, entity_type, row[source_column], "error", status_code, query)
+                        console.print(f"Error for {row[source_column]}, status code: {status_code}", style="bold red")
                         progress_bar.update(1)
                         continue
-                    dfs.append(response_df)
-                    while "next" in response.links.keys():
-                        next_url = response.links["next"]["url"]
-                        response, status_code = make_request_with_rate_limiting(next_url, active_auth_headers)
-                        if response is None:
-                            log_error_to_file(error_file_path, next_url, status_code, additional_data)
+                    else:
+                        response_data = response.json()
+                        response_df = pd.json_normalize(response_data)
+                        if "message" in response_df.columns:
+                            console.print(f"Error for {row[source_column]}: {response_df.message.values[0]}", style="bold red")
+                            log_error_to_file(error_file_path, additional_data, status_code, query)
+                            status_store.mark(interaction_stage, entity_type, row[source_column], "error", status_code, query)
                             progress_bar.update(1)
                             continue
-                        else:
-                            response_data = response.json()
-                            response_df = pd.json_normalize(response_data)
-                            if "message" in response_df.columns:
-                                console.print(f"Error for {row[source_column]}: {response_df.message.values[0]}", style="bold red")
-                                log_error_to_file(error_file_path, additional_data, status_code, next_url)
+                        if record_counts:
+                            estimated_total = estimate_total_results(response, len(response_data))
+                            if estimated_total > threshold_limit:
+                                console.print(f"Saving {row[source_column]} as it has about {estimated_total} {interaction_type} which is over the threshold limit of {threshold_limit}")
+                                status_store.mark(interaction_stage, entity_type, row[source_column], "over_threshold", detail=f"{count_column}={estimated_total};threshold_limit={threshold_limit};url_column={row[url_column]}")
                                 progress_bar.update(1)
                                 continue
                         dfs.append(response_df)
-                    if dfs:
-                        combined_response_df = pd.concat(dfs)
-                        combined_response_df[f"{entity_type_singular}_id"] = row.id
-                        combined_response_df[f"{entity_type_singular}_url"] = row.url
-                        combined_response_df[f"{entity_type_singular}_html_url"] = row.html_url
-                        combined_response_df[f"{original_source_column}"] = row[source_column]
-                        combined_response_df[f"{entity_type_singular}_{url_column}"] = row[url_column]
-                        combined_response_df["coding_dh_date"] = datetime.now().strftime("%Y-%m-%d")
-                        concat_df = pd.concat([subset_existing_df, combined_response_df])
-                        concat_df['coding_dh_date'] = pd.to_datetime(concat_df['coding_dh_date'], format="%Y-%m-%d", errors="coerce")
-                        concat_df = concat_df.reset_index(drop=True)
-                        grouped_df = concat_df.groupby(grouped_columns)
-                        processed_files = []
-                        for _, group in tqdm(grouped_df, desc=f"Grouping files"):
-                            subset_columns = ["coding_dh_date"]
-                            group = sort_groups_add_coding_dh_id(group, subset_columns)
-                            processed_files.append(group)
-                        final_processed_df = pd.concat(processed_files).reset_index(drop=True)
-                        console.print(f"Saving {row[source_column]} for {interaction_type} to {file_path}")
-                        final_processed_df.to_csv(file_path, index=False)
-
-        except Exception as e:
-            console.print(f"Error for {row[source_column]} for {interaction_type}: {e}", style="bold red")
-            log_error_to_file(error_file_path, additional_data, status_code, query)
-            progress_bar.update(1)
-            continue
+                        crawl_failed = False
+                        while "next" in response.links.keys():
+                            next_url = response.links["next"]["url"]
+                            response, status_code = make_request_with_rate_limiting(next_url, active_auth_headers)
+                            if response is None:
+                                crawl_failed = True
+                            else:
+                                response_data = response.json()
+                                response_df = pd.json_normalize(response_data)
+                                if "message" in response_df.columns:
+                                    console.print(f"Error for {row[source_column]}: {response_df.message.values[0]}", style="bold red")
+                                    crawl_failed = True
+                            if crawl_failed:
+                                # Keep the error status rather than saving a truncated crawl as complete
+                                log_error_to_file(error_file_path, additional_data, status_code, next_url)
+                                status_store.mark(interaction_stage, entity_type, row[source_column], "error", status_code, next_url)
+                                progress_bar.update(1)
+                                break
+                            dfs.append(response_df)
+                        if crawl_failed:
+                            continue
+                        if dfs:
+                            combined_response_df = pd.concat(dfs)
+                            console.print(f"Saving {row[source_column]} for {interaction_type} to {file_path}")
+                            write_interaction_file(combined_response_df, subset_existing_df, row, file_path, entity_type, url_column, source_column, original_source_column, grouped_columns, join_schema_name, interaction_type, edge_store)
+                            status_store.mark(interaction_stage, entity_type, row[source_column], "ok")
+                            recorded_counts[row[source_column]] = len(combined_response_df)
+                            progress_bar.update(1)
+
+            except Exception as e:
+                console.print(f"Error for {row[source_column]} for {interaction_type}: {e}", style="bold red")
+                log_error_to_file(error_file_path, additional_data, status_code, query)
+                status_store.mark(interaction_stage, entity_type, row[source_column], "error", status_code, str(e))
+                progress_bar.update(1)
+                continue
+        if entity_writer is not None:
+            write_recorded_counts(recorded_counts, collectable_rows, entity_type, source_column, count_column, entity_writer)
+    if entity_writer is not None:
+        entity_writer.flush()
     progress_bar.close()
         
+def crawl_over_threshold_entities(url_column: str, entity_type: str, interaction_directory_path: str, interaction_type: str, source_column: str, target_column: str, reserve_quota: int = 1000, max_pages: Optional[int] = None) -> None:
+    """
+    Crawls the interactions of the entities that get_entities_interactions left over the threshold, e.g. repos with hundreds of thousands of stargazers, page by page. Each page is saved to its own file and the next page url to a cursor in the status store, so a crawl can run across many rate limit windows and restarts without starting over. Once the last page is collected, the pages are combined into the entity's join file and the entity is marked ok.
+    Requests draw from a separate background budget and pause whenever the remaining core quota drops below reserve_quota, so the crawl runs at a lower priority than the regular ones.
+
+    :param url_column: Column holding the url of the interaction
+    :param entity_type: Type of entity (users, orgs or repos)
+    :param interaction_directory_path: Directory to write the join files to
+    :param interaction_type: Type of interaction
+    :param source_column: Column identifying the source entity in the join files
+    :param target_column: Column identifying the target entity in the join files
+    :param reserve_quota: Core requests left for the regular crawls. The crawl sleeps until the rate limit resets once fewer remain.
+    :param max_pages: Optional maximum number of pages to collect in this run, across entities. The cursor is kept, so the next run continues where this one stopped.
+    """
+    original_source_column = source_column
+    source_column = 'login' if 'login' in source_column else 'full_name'
+    active_auth_headers = auth_headers.copy() if 'stargazers' not in url_column else stargazers_auth_headers.copy()
+    metadata_entity = "user" if entity_type == "orgs" else entity_type[:-1]
+    metadata_df = read_csv_file(os.path.join(data_directory_path, "metadata_files", f"{metadata_entity}_url_cols.csv"))
+    subset_metadata_df = metadata_df[metadata_df.url_column == url_column]
+    check_state = ('check_state' in metadata_df.columns) and bool(subset_metadata_df['check_state'].values[0])
+    error_file_path = os.path.join(data_directory_path, "error_logs", f"{interaction_type}_interaction_errors.csv")
+    join_schema_name = os.path.basename(interaction_directory_path.rstrip('/')).replace('_join_dataset', '')
+    grouped_columns = [original_source_column, target_column]
+    drop_columns = ["coding_dh_id", "Unnamed: 0"]
+
+    status_store = EntityStatusStore(data_directory_path)
+    edge_store = EntityEdgeStore(data_directory_path)
+    interaction_stage = get_interaction_stage(interaction_type, url_column)
+    over_threshold_keys = status_store.get_status(interaction_stage, entity_type, status="over_threshold").entity_key.tolist()
+    if len(over_threshold_keys) == 0:
+        console.print(f"No {entity_type} over the threshold for {interaction_type}", style="bold blue")
+        return
+    entities_df = read_latest_entities(data_directory_path, entity_type, over_threshold_keys)
+    pages_collected = 0
+    progress_bar = tqdm(total=len(entities_df), desc=f"Crawling {entity_type} over the threshold for {interaction_type}")
+    for chunk in iter_record_chunks(entities_df):
+        for row in chunk:
+            entity_name = row[source_column].replace("/", "_")
+            file_path = os.path.join(data_directory_path, interaction_directory_path.lstrip('/'), f"{entity_name}_{interaction_type}_{url_column}.csv")
+            pages_dir = file_path.replace(".csv", "_pages")
+            cursor = status_store.get_cursor(interaction_stage, entity_type, row[source_column])
+            if cursor is None:
+                # Start from the first page, discarding pages of a crawl whose cursor was lost
+                shutil.rmtree(pages_dir, ignore_errors=True)
+                query = row[url_column].split('{')[0] + '?per_page=100&page=1'
+                cursor = {"next_url": query.replace('?', '?state=all&') if check_state else query, "pages_done": 0, "rows_done": 0}
+            os.makedirs(pages_dir, exist_ok=True)
+            next_url, pages_done, rows_done = cursor["next_url"], cursor["pages_done"], cursor["rows_done"]
+            while next_url is not None:
+                if (max_pages is not None) and (pages_collected >= max_pages):
+                    progress_bar.close()
+                    console.print(f"Stopping after {pages_collected} pages. The crawl continues from the saved cursors on the next run.", style="bold blue")
+                    return
+                background_rate_limiter.wait()
+                response, status_code = make_request_with_rate_limiting(next_url, active_auth_headers)
+                if response is None:
+                    # Keep the cursor so the next run retries this page
+                    log_error_to_file(error_file_path, {source_column: row[source_column], 'url_column': row[url_column], 'interaction_type': interaction_type}, status_code, next_url)
+                    break
+                page_df = pd.json_normalize(response.json())
+                if "message" in page_df.columns:
+                    console.print(f"Error for {row[source_column]}: {page_df.message.values[0]}", style="bold red")
+                    log_error_to_file(error_file_path, {source_column: row[source_column], 'url_column': row[url_column], 'interaction_type': interaction_type}, status_code, next_url)
+                    break
+                # Writing the page before the cursor makes a retried page overwrite its own file rather than duplicate it
+                page_df.to_csv(os.path.join(pages_dir, f"page_{pages_done + 1:06d}.csv"), index=False)
+                next_url = response.links["next"]["url"] if "next" in response.links else None
+                pages_done, rows_done = pages_done + 1, rows_done + len(page_df)
+                status_store.save_cursor(interaction_stage, entity_type, row[source_column], next_url, pages_done, rows_done)
+                pages_collected += 1
+                remaining = response.headers.get("X-RateLimit-Remaining")
+                if (remaining is not None) and (int(remaining) < reserve_quota):
+                    reset_time = int(response.headers.get("X-RateLimit-Reset", time.time() + 3600))
+                    console.print(f"Pausing the background crawl until the rate limit resets, {remaining} requests remain", style="bold blue")
+                    time.sleep(max(reset_time - time.time(), 0) + 1)
+            if next_url is None:
+                page_files = sorted(os.listdir(pages_dir))
+                combined_response_df = pd.concat([read_csv_file(os.path.join(pages_dir, page_file)) for page_file in page_files]) if len(page_files) > 0 else pd.DataFrame()
+                if os.path.exists(file_path):
+                    subset_existing_df = drop_columns_from_df(read_csv_file(file_path), drop_columns)
+                else:
+                    subset_existing_df = pd.DataFrame()
+                if len(combined_response_df) > 0:
+                    console.print(f"Saving {row[source_column]} for {interaction_type} to {file_path} after {pages_done} pages")
+                    write_interaction_file(combined_response_df, subset_existing_df, row, file_path, entity_type, url_column, source_column, original_source_column, grouped_columns, join_schema_name, interaction_type, edge_store)
+                status_store.mark(interaction_stage, entity_type, row[source_column], "ok", detail=f"pages={pages_done};rows={rows_done}")
+                status_store.clear_cursor(interaction_stage, entity_type, row[source_column])
+                shutil.rmtree(pages_dir, ignore_errors=True)
+            progress_bar.update(1)
+    progress_bar.close()
+
+def start_over_threshold_crawl(*args, **kwargs) -> threading.Thread:
+    """
+    Starts crawl_over_threshold_entities in a background daemon thread, so the regular crawls can run alongside it.
+
+    :param args: Positional arguments of crawl_over_threshold_entities
+    :param kwargs: Keyword arguments of crawl_over_threshold_entities
+    :return: The started thread
+    """
+    crawl_thread = threading.Thread(target=crawl_over_threshold_entities, args=args, kwargs=kwargs, daemon=True, name="over_threshold_crawl")
+    crawl_thread.start()
+    return crawl_thread
 
 if __name__ == "__main__":
 
@@ -9,6 +9,7 @@ import os
 sys.path.append("..")
 from data_generation_scripts.general_utils import *
 from ast import literal_eval
+from typing import Any, Iterable, List, Optional, Union
 import apikey
 
 auth_token = apikey.load("DH_GITHUB_DATA_PERSONAL_TOKEN")
@@ -24,83 +25,95 @@ def turn_names_into_list(prefix: str, df: pd.DataFrame) -> pd.DataFrame:
     :return: dataframe with names as a list"""
     return pd.DataFrame([{prefix: df.name.tolist()}])    
 
-def get_repo_metadata(repo_df: pd.DataFrame, error_file_path: str, existing_repo_dir: str, check_column: str, url_column: str):
-    """Function to get repo metadata
+# Repo metadata fetched alongside the repo payload. Each type has the url column it is requested from, an optional path appended to that url, and the column (or column prefix) that shows it has already been collected.
+repo_metadata_types = {
+    "community_profile": {"url_column": "url", "path": "/community/profile", "check_column": "health_percentage"},
+    "languages": {"url_column": "languages_url", "path": "", "check_column": "languages."},
+    "tags": {"url_column": "tags_url", "path": "", "check_column": "tags"},
+    "labels": {"url_column": "labels_url", "path": "", "check_column": "labels"},
+}
+
+def has_repo_metadata(row: dict, metadata_type: str) -> bool:
+    """Function to check whether a repo already has a metadata type
+
+    :param row: record holding the latest version of a repo
+    :param metadata_type: type of metadata, one of repo_metadata_types
+    :return: True if the check column has a value, or for prefixed columns if any of them has a value"""
+    check_column = repo_metadata_types[metadata_type]["check_column"]
+    if check_column.endswith('.'):
+        check_values = [value for key, value in row.items() if key.startswith(check_column)]
+    else:
+        check_values = [row.get(check_column)]
+    return any(isinstance(value, (list, dict)) or pd.notna(value) for value in check_values)
+
+def fetch_repo_metadata(row: dict, metadata_type: str) -> tuple:
+    """Function to fetch one metadata type for a repo and shape it into the columns stored on the repo
+
+    :param row: record holding the latest version of a repo
+    :param metadata_type: type of metadata, one of repo_metadata_types
+    :return: tuple of the metadata dataframe (None if the request failed), the status code and the query"""
+    metadata_spec = repo_metadata_types[metadata_type]
+    query = row[metadata_spec["url_column"]].split('{')[0] + metadata_spec["path"]
+    response, status_code = make_request_with_rate_limiting(query, auth_headers)
+    if response is None:
+        return None, status_code, query
+    response_df = pd.json_normalize(response.json())
+    if 'message' in response_df.columns:
+        console.print(response_df.message.values[0], style="bold red")
+        return None, status_code, query
+    if metadata_type == "community_profile":
+        response_df = response_df.rename(columns={'updated_at': 'community_profile_updated_at'})
+    elif metadata_type == "languages":
+        # prefix languages to each column
+        response_df = response_df.add_prefix('languages.')
+    else:
+        response_df = turn_names_into_list(metadata_type, response_df)
+    return response_df.reset_index(drop=True), status_code, query
 
-    :param repo_df: dataframe of repos
-    :param existing_repo_dir: path to directory to write existing repos
+def get_repo_metadata(repos: Union[pd.DataFrame, Iterable[Any]], error_file_path: str, metadata_types: Optional[List[str]] = None, chunk_size: int = 1000, max_workers: int = 4):
+    """Function to get repo metadata. Repos are streamed in chunks of lightweight records. Every missing metadata type of a chunk is fetched concurrently, merged into the latest version of each repo in memory and written back once per repo through the batched entity writer.
+
+    :param repos: repos holding the latest version of each repo, as a dataframe or any iterable of dicts, named tuples, dataframes or Arrow record batches (e.g. from iter_latest_entities)
     :param error_file_path: path to file to write errors
-    :param check_column: column to check
-    :param url_column: column that contains the url to get the total results
+    :param metadata_types: types of metadata to collect, from repo_metadata_types. Defaults to all of them. Types a repo already has are skipped.
+    :param chunk_size: number of repos read at a time
+    :param max_workers: maximum number of concurrent requests
     """
     drop_fields = ["full_name", "error_url"]
     clean_write_error_file(error_file_path, drop_fields)
-    if check_column in repo_df.columns:
-        repos_without_metadata = repo_df[repo_df[check_column].isna()]
-    else: 
-        repos_without_metadata = repo_df
-
-    if len(repos_without_metadata) > 0:
-        profile_bar = tqdm(total=len(repos_without_metadata), desc="Getting Metadata")
-        for _, row in repos_without_metadata.iterrows():
-            existing_entities_path = f"{row.full_name.replace('/', '_').replace(' ', '_')}_coding_dh_repo.csv"
-            existing_output_path = existing_repo_dir + existing_entities_path
-            if os.path.exists(existing_output_path):
-                existing_df = pd.read_csv(existing_output_path)
+    metadata_types = list(repo_metadata_types) if metadata_types is None else metadata_types
+
+    profile_bar = tqdm(total=len(repos) if hasattr(repos, "__len__") else None, desc="Getting Metadata")
+    with EntityBatchWriter(get_data_directory_path(), "repos") as entity_writer, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk in iter_record_chunks(repos, chunk_size):
+            futures = {}
+            for row_index, row in enumerate(chunk):
+                for metadata_type in metadata_types:
+                    if not has_repo_metadata(row, metadata_type):
+                        futures[executor.submit(fetch_repo_metadata, row, metadata_type)] = (row_index, metadata_type)
+            response_dfs = {}
+            for future in as_completed(futures):
+                row_index, metadata_type = futures[future]
+                row = chunk[row_index]
                 try:
-                    query = row[url_column] + '/community/profile' if 'health_percentage' in check_column else row[url_column]
-                    response, status_code = make_request_with_rate_limiting(query, auth_headers)
-                    if response is not None:
-                        response_df = pd.json_normalize(response)
-                        if 'message' in response_df.columns:
-                            console.print(response_df.message.values[0], style="bold red")
-                            additional_data = {'repo_full_name': row.full_name}
-                            log_error_to_file(error_file_path, additional_data, status_code, query)
-                            profile_bar.update(1)
-                            continue
-                        if 'health_percentage' in response_df.columns:
-                            response_df = response_df.rename(columns={'updated_at': 'community_profile_updated_at'})
-                        elif 'languages' in url_column:
-                            # prefix languages to each column
-                            response_df = response_df.add_prefix('languages.')
-                        else:
-                            prefixes = ['tags', 'labels']
-                            for prefix in prefixes:
-                                if prefix in url_column:
-                                    response_df = turn_names_into_list(prefix, response_df)
-                        # convert the 'updated_at' column to datetime
-                        existing_df['coding_dh_date'] = pd.to_datetime(existing_df['coding_dh_date'])
-
-                        # get the row with the latest date
-                        latest_date = existing_df['coding_dh_date'].max()
-                        latest_row = existing_df[existing_df['coding_dh_date'] == latest_date]
-
-                        # concatenate the latest row with response_df
-                        final_df = pd.concat([latest_row, response_df], axis=1)
-                        
-                        # drop the latest row from existing_df
-                        existing_df = existing_df[existing_df['coding_dh_date'] != latest_date]
-
-                        # concatenate existing_df and final_df
-                        result_df = pd.concat([existing_df, final_df])
-
-                        # write result_df to a CSV file
-                        result_df.to_csv(existing_output_path, index=False)
-                    
-                    else:
-                        additional_data = {'repo_full_name': row.full_name}
-                        log_error_to_file(error_file_path, additional_data, status_code, query)
-                        profile_bar.update(1)
-                        continue
-
-                except:
-                    profile_bar.total = profile_bar.total - 1
+                    response_df, status_code, query = future.result()
+                except Exception as e:
+                    console.print(f"Error getting {metadata_type} for {row.full_name}: {e}", style="bold red")
+                    response_df, status_code, query = None, None, row.get(repo_metadata_types[metadata_type]["url_column"])
+                if response_df is None:
                     additional_data = {'repo_full_name': row.full_name}
                     log_error_to_file(error_file_path, additional_data, status_code, query)
-                    profile_bar.update(1)
                     continue
-            else:
-                console.print(f"Repo {row.full_name} does not exist in the coding DH repo directory", style="bold red")
+                response_dfs.setdefault(row_index, []).append(response_df)
+            for row_index, row in enumerate(chunk):
+                if row_index in response_dfs:
+                    # concatenate the latest row with every metadata type fetched for it, replacing any metadata columns it already had
+                    metadata_df = pd.concat(response_dfs[row_index], axis=1)
+                    latest_row = pd.DataFrame([row]).reset_index(drop=True)
+                    latest_row = latest_row.drop(columns=[col for col in metadata_df.columns if col in latest_row.columns])
+                    entity_writer.add(pd.concat([latest_row, metadata_df], axis=1))
+                profile_bar.update(1)
+    profile_bar.close()
 
 def clean_owner(row: pd.DataFrame) -> pd.DataFrame:
     """Function to clean owner column
@@ -122,51 +135,212 @@ def get_repo_owners(repo_df: pd.DataFrame) -> pd.DataFrame:
     repo_df = repo_df.drop('cleaned_owner', axis=1).join(pd.DataFrame(repo_df.cleaned_owner.values.tolist()))
     return repo_df
 
-def write_entity_results_to_csv(count_column: str, row: pd.DataFrame, entity_type: str, dir_path: str):
-    """Function to write results to csv
+def write_entity_results_to_csv(count_columns: List[str], df: pd.DataFrame, entity_type: str, dir_path: str, entity_writer: Optional[EntityBatchWriter] = None):
+    """Function to write the counts of a set of entities at once, after all their count columns have been collected
     
-    :param count_column: Column that will store the count values
-    :param row: Row with the latest date
-    :param entity_type: Type of entity (user or organization or repo)
-    :param dir_path: Directory path to existing csv files
+    :param count_columns: Columns that store the count values
+    :param df: DataFrame with the latest row of each entity whose counts were updated
+    :param entity_type: Type of entity (users or orgs or repos)
+    :param dir_path: Directory path to the legacy entity csv files, used if no entity writer is given
+    :param entity_writer: Batched entity writer. If given, the updated rows are buffered in it rather than rewriting each entity's csv file.
     """
+    if entity_writer is not None:
+        entity_writer.add(df)
+        return
     entity_column = "full_name" if entity_type == "repos" else "login"
-    entity_name = row[entity_column].replace("/", "_")
     entity_type_singular = entity_type[:-1]
-    file_path = os.path.join(dir_path, f"{entity_name}_coding_dh_{entity_type_singular}.csv")
-    console.print(f"Writing to {file_path}", style="bold green")
-    if os.path.exists(file_path):
-        df = read_csv_file(file_path)
-        df['coding_dh_date'] = pd.to_datetime(df['coding_dh_date'])
-        # get the row with the latest date
-        latest_date = df['coding_dh_date'].max()
-        # update the count_column for the latest date
-        df.loc[df['coding_dh_date'] == latest_date, count_column] = row[count_column]
-        df.to_csv(file_path, index=False)
-
-def get_results(row: pd.DataFrame, count_column: str, url_column: str, auth_headers: dict, entity_type: str, dir_path: str, check_state: bool) -> pd.DataFrame:
-    """Function to get total results for each user or organization
-    
-    :param row: Row with the latest date
-    :param count_column: Column that will store the count values
-    :param url_column: Column that contains the url to get the total results
-    :param auth_headers: Authorization headers
-    :param entity_type: Type of entity (user or organization or repo)
-    :param dir_path: Directory path to existing csv files
+    for _, row in df.iterrows():
+        entity_name = row[entity_column].replace("/", "_")
+        file_path = os.path.join(dir_path, f"{entity_name}_coding_dh_{entity_type_singular}.csv")
+        console.print(f"Writing to {file_path}", style="bold green")
+        if os.path.exists(file_path):
+            entity_df = read_csv_file(file_path)
+            entity_df['coding_dh_date'] = pd.to_datetime(entity_df['coding_dh_date'])
+            # get the row with the latest date
+            latest_date = entity_df['coding_dh_date'].max()
+            # update every count column for the latest date in a single rewrite
+            for count_column in count_columns:
+                entity_df.loc[entity_df['coding_dh_date'] == latest_date, count_column] = row[count_column]
+            entity_df.to_csv(file_path, index=False)
+
+def get_count_url(url: str, check_state: bool) -> str:
+    """Function to build the url used to count the results of an entity's url column
+
+    :param url: Url from the entity's url column, possibly with a {/...} template suffix
     :param check_state: Boolean to check if the state is all
-    :return: Row with the total results"""
-    console.print(f"Getting total results for {row[url_column]}", style="bold green")
-    url = f"{row[url_column].split('{')[0]}"
+    :return: Url to count the results of"""
+    count_url = f"{url.split('{')[0]}"
     if check_state:
-        url = f"{url}?state=all"
-    total_results = check_total_pages(url, auth_headers)
-    console.print(f"Total results for {url}: {total_results}", style="bold green")
-    row[count_column] = total_results
-    write_entity_results_to_csv(count_column, row, entity_type, dir_path)
-    return row
+        count_url = f"{count_url}?state=all"
+    return count_url
+
+def get_results(count_url: str, auth_headers: dict) -> int:
+    """Function to get total results for one count of an entity. Requests draw from the shared core rate limiter so that concurrent workers stay within the GitHub quota.
 
-def get_counts(df: pd.DataFrame, url_column: str, count_column: str, entity_type: str, dir_path: str, check_state: bool, auth_headers: dict=None) -> pd.DataFrame:
-    """Function to get total results for each user or organization
+    :param count_url: Url to count the results of
+    :param auth_headers: Authorization headers
+    :return: Total results"""
+    total_results = check_total_pages(count_url, auth_headers)
+    console.print(f"Total results for {count_url}: {total_results}", style="bold green")
+    return total_results
+
+# Counts that the entity payload stored by get_new_entities already holds, keyed by the url column they would otherwise be requested from. Fields are tried in order.
+payload_count_fields = {
+    "followers_url": ["followers"],
+    "following_url": ["following"],
+    "repos_url": ["public_repos"],
+    "gists_url": ["public_gists"],
+    "forks_url": ["forks_count", "forks"],
+    "stargazers_url": ["stargazers_count"],
+    "subscribers_url": ["subscribers_count"],
+    "issues_url": ["open_issues_count", "open_issues"],
+}
+# Payload fields that only count open items, so they are not used for counts checked with state=all
+open_state_count_fields = ["open_issues_count", "open_issues"]
+
+def derive_counts_from_payload(df: pd.DataFrame, cols_df: pd.DataFrame, entity_type: str) -> List[tuple]:
+    """Function to fill missing counts from fields already stored in the entity payload, so they do not cost any API calls
+
+    :param df: DataFrame with user or organization or repository data, with a unique index
+    :param cols_df: DataFrame with the count columns and url columns
+    :param entity_type: Type of entity (users or orgs or repos)
+    :return: List of (row index, count column, total results) tuples for the counts that were derived"""
+    results = []
+    for _, row in cols_df.iterrows():
+        payload_fields = [field for field in payload_count_fields.get(row.url_column, []) if field in df.columns and field != row.count_column]
+        check_state = row['check_state'] if (entity_type == "repos") and ('check_state' in row.index) else False
+        if check_state:
+            payload_fields = [field for field in payload_fields if field not in open_state_count_fields]
+        if len(payload_fields) == 0:
+            continue
+        needs_counts = df[df[row.count_column].isna()] if row.count_column in df.columns else df
+        derived_counts = needs_counts[payload_fields].bfill(axis=1).iloc[:, 0].dropna()
+        results.extend((index, row.count_column, int(total_results)) for index, total_results in derived_counts.items())
+        console.print(f"Derived {len(derived_counts)} {row.count_column} for {entity_type} from {', '.join(payload_fields)}", style="bold blue")
+    return results
+
+def derive_counts_from_join_files(df: pd.DataFrame, cols_df: pd.DataFrame, entity_type: str) -> List[tuple]:
+    """Function to fill missing counts of entities whose interactions get_entities_interactions has already crawled in full, counting their distinct targets in the edge store
+
+    :param df: DataFrame with user or organization or repository data, with a unique index
+    :param cols_df: DataFrame with the count columns and url columns
+    :param entity_type: Type of entity (users or orgs or repos)
+    :return: List of (row index, count column, total results) tuples for the counts that were derived"""
+    data_directory_path = get_data_directory_path()
+    entity_interactions_path = os.path.join(data_directory_path, "metadata_files", "entity_interactions.csv")
+    if not os.path.exists(entity_interactions_path):
+        return []
+    entity_interaction_df = read_csv_file(entity_interactions_path)
+    entity_interaction_df = entity_interaction_df[entity_interaction_df.entity_type == entity_type[:-1]]
+    entity_column = "full_name" if entity_type == "repos" else "login"
+    status_store = EntityStatusStore(data_directory_path)
+    edge_store = EntityEdgeStore(data_directory_path)
+    results = []
+    for _, row in cols_df.iterrows():
+        subset_entity_interaction_df = entity_interaction_df[entity_interaction_df.url_column == row.url_column]
+        if len(subset_entity_interaction_df) == 0:
+            continue
+        interaction_type = subset_entity_interaction_df.interaction_type.values[0]
+        # Only entities whose interactions this join collected without errors or a threshold cut-off have complete edges
+        interaction_stage = get_interaction_stage(interaction_type, row.url_column)
+        crawled_keys = set(status_store.get_status(interaction_stage, entity_type, status="ok").entity_key)
+        needs_counts = df[df[row.count_column].isna()] if row.count_column in df.columns else df
+        needs_counts = needs_counts[needs_counts[entity_column].isin(crawled_keys)]
+        if len(needs_counts) == 0:
+            continue
+        target_counts = edge_store.count_targets(interaction_type, row.url_column, needs_counts[entity_column].unique().tolist())
+        for index, entity_key in needs_counts[entity_column].items():
+            if entity_key in target_counts:
+                results.append((index, row.count_column, int(target_counts[entity_key])))
+    if len(results) > 0:
+        console.print(f"Derived {len(results)} counts for {entity_type} from stored edges", style="bold blue")
+    return results
+
+def get_count_stage(count_column: str) -> str:
+    """Function to get the name under which the status store records the collection of a count column
+
+    :param count_column: Column that stores the count values
+    :return: Stage name"""
+    return f"counts.{count_column}"
+
+def carry_forward_counts(df: pd.DataFrame, cols_df: pd.DataFrame, entity_type: str, refresh_policy: EntityRefreshPolicy, status_store: EntityStatusStore) -> List[tuple]:
+    """Function to fill missing counts of entities that have not changed since their count was last collected, using the count recorded in the status store
+
+    :param df: DataFrame with user or organization or repository data, with a unique index
+    :param cols_df: DataFrame with the count columns and url columns
+    :param entity_type: Type of entity (users or orgs or repos)
+    :param refresh_policy: Refresh policy deciding which entities could have changed
+    :param status_store: Status store holding the last collected counts
+    :return: List of (row index, count column, total results) tuples for the counts that were carried forward"""
+    entity_column = "full_name" if entity_type == "repos" else "login"
+    results = []
+    for _, row in cols_df.iterrows():
+        needs_counts = df[df[row.count_column].isna()] if row.count_column in df.columns else df
+        if ('url' not in row.url_column) or (len(needs_counts) == 0):
+            continue
+        stage = get_count_stage(row.count_column)
+        refresh_mask = refresh_policy.select_for_refresh(status_store, needs_counts, stage, entity_type, entity_column)
+        fresh_counts = needs_counts[~refresh_mask]
+        if len(fresh_counts) == 0:
+            continue
+        recorded_counts = status_store.get_status(stage, entity_type, status="ok").set_index("entity_key").detail
+        carried_counts = pd.to_numeric(fresh_counts[entity_column].astype(str).map(recorded_counts), errors="coerce").dropna()
+        results.extend((index, row.count_column, int(total_results)) for index, total_results in carried_counts.items())
+        console.print(f"Carried forward {len(carried_counts)} {row.count_column} for {entity_type} that have not changed since they were last counted", style="bold blue")
+    return results
+
+def build_count_work_list(df: pd.DataFrame, cols_df: pd.DataFrame, entity_type: str) -> List[tuple]:
+    """Function to build the full list of counts to collect across every entity and count column, so they can be requested concurrently
+
+    :param df: DataFrame with user or organization or repository data, with a unique index
+    :param cols_df: DataFrame with the count columns and url columns
+    :param entity_type: Type of entity (users or orgs or repos)
+    :return: List of (row index, count column, count url) tuples"""
+    work_list = []
+    for _, row in cols_df.iterrows():
+        if (row.count_column in df.columns) and (df[row.count_column].notna().all()):
+            console.print(f'Counts already exist {row.count_column} for {entity_type}')
+            continue
+        if 'url' not in row.url_column or row.url_column not in df.columns:
+            console.print(f'Counts already exist {row.count_column} for {entity_type}')
+            continue
+        check_state = row['check_state'] if (entity_type == "repos") and ('check_state' in row.index) else False
+        needs_counts = df[df[row.count_column].isna()] if row.count_column in df.columns else df
+        if row.url_column == "owner.organizations_url":
+            needs_counts = needs_counts[needs_counts['owner.type'] == 'User']
+        needs_counts = needs_counts[needs_counts[row.url_column].notna()]
+        console.print(f"For {entity_type}, {len(needs_counts)} {row.count_column} need to be processed versus {len(df) - len(needs_counts)} has already been processed", style="bold blue")
+        work_list.extend((index, row.count_column, get_count_url(url, check_state)) for index, url in needs_counts[row.url_column].items())
+    return work_list
+
+def collect_counts(work_list: List[tuple], auth_headers: dict, entity_type: str, max_workers: int = 8) -> List[tuple]:
+    """Function to collect every count in a work list through a bounded pool of workers, reporting progress for each count column
+
+    :param work_list: List of (row index, count column, count url) tuples
+    :param auth_headers: Authorization headers
+    :param entity_type: Type of entity (users or orgs or repos)
+    :param max_workers: Maximum number of concurrent requests
+    :return: List of (row index, count column, total results) tuples for the counts that were collected"""
+    column_totals = {}
+    for _, count_column, _ in work_list:
+        column_totals[count_column] = column_totals.get(count_column, 0) + 1
+    progress_bars = {count_column: tqdm(total=total, desc=f"Getting total results for each {entity_type}'s {count_column}", position=position) for position, (count_column, total) in enumerate(column_totals.items())}
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(get_results, count_url, auth_headers): (index, count_column, count_url) for index, count_column, count_url in work_list}
+        for future in as_completed(futures):
+            index, count_column, count_url = futures[future]
+            try:
+                results.append((index, count_column, future.result()))
+            except Exception as e:
+                console.print(f'Issues with {count_column} for {count_url} with error: {e}', style='bold red')
+            progress_bars[count_column].update(1)
+    for progress_bar in progress_bars.values():
+        progress_bar.close()
+    return results
+
+def get_counts(df: pd.DataFrame, url_column: str, count_column: str, entity_type: str, dir_path: str, check_state: bool, auth_headers: dict=None, updated_keys: Optional[set] = None, max_workers: int = 8) -> pd.DataFrame:
+    """Function to get total results of a single count column for each user or organization
 
     :param df: DataFrame with user or organization data
     :param url_column: Column that contains the url to get the total results
@@ -175,57 +349,70 @@ def get_counts(df: pd.DataFrame, url_column: str, count_column: str, entity_type
     :param dir_path: Directory path to existing csv files
     :param check_state: Boolean to check if the state is all
     :param auth_headers: Authorization headers
+    :param updated_keys: Optional set that the logins or full names of the entities whose counts were collected are added to
+    :param max_workers: Maximum number of concurrent requests
     :return: DataFrame with the total results"""
-    if count_column in df.columns:
-        needs_counts = df[df[count_column].isna()]
-        has_counts = df[df[count_column].notna()]
-    else:
-        needs_counts = df
-        has_counts = pd.DataFrame()
-    console.print(f"For {entity_type}, {len(needs_counts)} {count_column} need to be processed versus {len(has_counts)} has already been processed", style="bold blue")
-    if url_column == "owner.organizations_url":
-        needs_counts = needs_counts[needs_counts['owner.type'] == 'User']
-    if len(has_counts) == len(df):
-        df = has_counts
-    else:
-        tqdm.pandas(desc=f"Getting total results for each {entity_type}'s {count_column}")
-        processed_needs_counts = needs_counts.reset_index(drop=True)
-        processed_needs_counts = processed_needs_counts.progress_apply(get_results, axis=1, count_column=count_column, url_column=url_column,  auth_headers=auth_headers, entity_type=entity_type, dir_path=dir_path, check_state=check_state)
-        df = pd.concat([processed_needs_counts, has_counts])
-    return df
+    cols_df = pd.DataFrame([{'count_column': count_column, 'url_column': url_column, 'check_state': check_state}])
+    return process_counts(df, cols_df, auth_headers, entity_type, dir_path, updated_keys=updated_keys, max_workers=max_workers, write_results=False)
 
-def process_counts(df: pd.DataFrame, cols_df: pd.DataFrame, auth_headers: dict, entity_type: str, dir_path: str) -> pd.DataFrame:
-    """Function to process counts for users, organizations, and repositories
+def process_counts(df: pd.DataFrame, cols_df: pd.DataFrame, auth_headers: dict, entity_type: str, dir_path: str, updated_keys: Optional[set] = None, max_workers: int = 8, write_results: bool = True, refresh_policy: Optional[EntityRefreshPolicy] = None) -> pd.DataFrame:
+    """Function to process counts for users, organizations, and repositories. Counts that the stored payloads or crawled join files already hold are filled first. The (entity, count column, url) work list is built up front for every count column and collected concurrently under the core rate limiter.
 
     :param df: DataFrame with user or organization or repository data
     :param cols_df: DataFrame with the count columns and url columns
     :param auth_headers: Authorization headers
     :param entity_type: Type of entity (users or orgs or repos)
     :param dir_path: Directory path to existing csv files
-    :return: DataFrame with the total results"""
-    check_state = False
-    for _, row in cols_df.iterrows():
-        console.print(f'Processing {row.count_column} for {entity_type}', style="bold blue")
-        if (row['count_column'] not in df.columns) or (len(df[df[row.count_column].isna()]) > 0):
-            if 'url' in row.url_column:
-                try:
-                    if entity_type == "repos":
-                        check_state = row['check_state']
-                    df = get_counts(df, row.url_column, row.count_column, entity_type, dir_path, check_state, auth_headers=auth_headers)
-                except Exception as e:
-                    console.print(f'Issues with {row.count_column} for {entity_type} with error: {e}', style='bold red')
-                    continue
-            else:
-                console.print(f'Counts already exist {row.count_column} for {entity_type}')
+    :param updated_keys: Optional set that the logins or full names of the entities whose counts were collected are added to
+    :param max_workers: Maximum number of concurrent requests
+    :param write_results: Boolean to write the updated entities once collected
+    :param refresh_policy: Optional refresh policy. If given, missing counts of entities that have not changed since their count was last collected are carried forward rather than requested again.
+    :return: DataFrame with the total results. Updated entities are written once, in a single batch, after all count columns have been processed."""
+    updated_keys = set() if updated_keys is None else updated_keys
+    entity_column = "full_name" if entity_type == "repos" else "login"
+    df = df.reset_index(drop=True)
+    # Fill what is already known locally before building the work list, so only truly unknown counts cost quota
+    derived_results = derive_counts_from_payload(df, cols_df, entity_type)
+    derived_results += derive_counts_from_join_files(df, cols_df, entity_type)
+    status_store = EntityStatusStore(get_data_directory_path())
+    carried_results = carry_forward_counts(df, cols_df, entity_type, refresh_policy, status_store) if refresh_policy is not None else []
+    for count_column in {count_column for _, count_column, _ in derived_results + carried_results}:
+        if count_column not in df.columns:
+            df[count_column] = None
+    for index, count_column, total_results in derived_results + carried_results:
+        df.at[index, count_column] = total_results
+    work_list = build_count_work_list(df, cols_df, entity_type)
+    collected_results = derived_results + collect_counts(work_list, auth_headers, entity_type, max_workers=max_workers) if len(work_list) > 0 else derived_results
+    results = collected_results + carried_results
+    if len(results) == 0:
+        return df
+    updated_count_columns = list(dict.fromkeys(count_column for _, count_column, _ in results))
+    for count_column in updated_count_columns:
+        if count_column not in df.columns:
+            df[count_column] = None
+    for index, count_column, total_results in results:
+        df.at[index, count_column] = total_results
+    updated_keys.update(df.loc[list({index for index, _, _ in results}), entity_column].dropna())
+    # Record when each count was collected, and its value, so unchanged entities can carry it forward on the next refresh. Carried forward counts keep the date they were collected.
+    for count_column in updated_count_columns:
+        column_results = [(index, total_results) for index, result_column, total_results in collected_results if result_column == count_column]
+        if len(column_results) == 0:
+            continue
+        status_store.mark(get_count_stage(count_column), entity_type, [df.at[index, entity_column] for index, _ in column_results], "ok", detail=[str(total_results) for _, total_results in column_results])
+    # Write every updated entity once, with all of its new counts, rather than once per count column
+    if write_results and len(updated_keys) > 0:
+        with EntityBatchWriter(get_data_directory_path(), entity_type) as entity_writer:
+            write_entity_results_to_csv(updated_count_columns, df[df[entity_column].isin(updated_keys)], entity_type, dir_path, entity_writer)
     return df
 
-def get_count_metadata(entity_df: pd.DataFrame, entity_type: str, dir_path: str, return_df: bool) -> pd.DataFrame:
+def get_count_metadata(entity_df: pd.DataFrame, entity_type: str, dir_path: str, return_df: bool, refresh_policy: Optional[EntityRefreshPolicy] = None) -> pd.DataFrame:
     """Function to get count metadata for users, organizations, and repositories
 
     :param entity_df: DataFrame with user or organization or repository data
     :param entity_type: Type of entity (users or orgs or repos)
     :param dir_path: Directory path to existing csv files
     :param return_df: Boolean to return the dataframe
+    :param refresh_policy: Optional refresh policy used to carry forward the counts of entities that have not changed
     :return: DataFrame with the total results"""
     auth_token = apikey.load("DH_GITHUB_DATA_PERSONAL_TOKEN")
 
@@ -237,7 +424,7 @@ def get_count_metadata(entity_df: pd.DataFrame, entity_type: str, dir_path: str,
         cols_df = read_csv_file(cols_path)
         skip_types = ['review_comments_url', 'collaborators_url']
         cols_df = cols_df[~cols_df.url_column.isin(skip_types)]
-        entity_df = process_counts(entity_df, cols_df, auth_headers, entity_type, dir_path)
+        entity_df = process_counts(entity_df, cols_df, auth_headers, entity_type, dir_path, refresh_policy=refresh_policy)
     else:
         if os.path.exists(cols_path):
             cols_df = read_csv_file(cols_path)
@@ -251,7 +438,7 @@ def get_count_metadata(entity_df: pd.DataFrame, entity_type: str, dir_path: str,
             cols_df = pd.concat([cols_df, add_cols])
             entity_df["members_url"] = entity_df["url"].apply(lambda x: x + "/public_members")
             entity_df.members_url = entity_df.members_url.str.replace('users', 'orgs')
-        entity_df = process_counts(entity_df, cols_df, auth_headers, entity_type, dir_path)
+        entity_df = process_counts(entity_df, cols_df, auth_headers, entity_type, dir_path, refresh_policy=refresh_policy)
     if return_df:
         return entity_df
             
@@ -286,25 +473,7 @@ if __name__ == "__main__":
     search_repo_queries_df = search_repo_queries_df[search_repo_queries_df.search_term_source.isin(cleaned_terms.search_term_source.unique())]
 
 
-    user_files = os.listdir(f"{data_directory_path}/historic_data/entity_files/all_users/")
-    org_files = os.listdir(f"{data_directory_path}/historic_data/entity_files/all_orgs/")
-    repo_files = os.listdir(f"{data_directory_path}/historic_data/entity_files/all_repos/")
-    cleaned_user_files = [f.split("_coding_dh_")[0] for f in user_files if f.endswith(".csv")]
-    cleaned_org_files = [f.split("_coding_dh_")[0] for f in org_files if f.endswith(".csv")]
-    cleaned_repo_files = [f.split("_coding_dh_")[0].replace("_", "/", 1) for f in repo_files if f.endswith(".csv")]
-    existing_search_user_queries_df = search_user_queries_df[search_user_queries_df.login.isin(cleaned_user_files)]
-    existing_search_org_queries_df = search_org_queries_df[search_org_queries_df.login.isin(cleaned_org_files)]
-    existing_search_repo_queries_df = search_repo_queries_df[search_repo_queries_df.full_name.isin(cleaned_repo_files)]
-    finalized_user_logins = existing_search_user_queries_df.login.unique().tolist()
-    finalized_org_logins = existing_search_org_queries_df.login.unique().tolist()
-    finalized_repo_full_names = existing_search_repo_queries_df.full_name.unique().tolist()
-
-    finalized_user_files = [f"{login}_coding_dh_user.csv" for login in finalized_user_logins]
-    finalized_org_files = [f"{login}_coding_dh_org.csv" for login in finalized_org_logins]
-    finalized_repo_files = [f"{full_name.replace('/', '_')}_coding_dh_repo.csv" for full_name in finalized_repo_full_names]
-    initial_core_users = read_combine_files(f"{data_directory_path}/historic_data/entity_files/all_users/", finalized_user_files)
-    initial_core_orgs = read_combine_files(f"{data_directory_path}/historic_data/entity_files/all_orgs/", finalized_org_files)
-    initial_core_repos = read_combine_files(f"{data_directory_path}/historic_data/entity_files/all_repos/", finalized_repo_files)
+    initial_core_users, initial_core_orgs, initial_core_repos = get_entity_files_from_search_queries(search_user_queries_df, search_org_queries_df, search_repo_queries_df, data_directory_path)
     # get_count_metadata(entity_df: pd.DataFrame, entity_type: str, dir_path: str)
     error_file_path = f"{data_directory_path}/error_logs/repo_errors.csv"
     if os.path.exists(error_file_path):
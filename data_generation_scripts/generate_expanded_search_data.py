@@ -1,8 +1,12 @@
 # Standard library imports
 import os
+import re
 import sys
+import math
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from datetime import datetime, timedelta
 from typing import List, Dict, Any, Tuple, Optional
 import warnings
 warnings.filterwarnings("ignore")
@@ -18,7 +22,8 @@ from tqdm import tqdm
 # Local application/library specific imports
 import apikey
 sys.path.append("..")
-from data_generation_scripts.general_utils import  read_csv_file, check_total_pages, check_total_results, check_rate_limit, make_request_with_rate_limiting, sort_groups_add_coding_dh_id, get_data_directory_path, clean_write_error_file, log_error_to_file
+from data_generation_scripts.general_utils import  read_csv_file, check_total_pages, check_total_results, check_rate_limit, make_request_with_rate_limiting, add_coding_dh_ids, get_data_directory_path, clean_write_error_file, log_error_to_file, search_rate_limiter, map_distinct_values, apply_schema, format_schema_for_csv
+from data_generation_scripts.generate_fulltext_index import update_fulltext_index
 
 # Load in the API key
 auth_token = apikey.load("DH_GITHUB_DATA_PERSONAL_TOKEN")
@@ -41,7 +46,7 @@ def fetch_data(query: str, data_directory_path: str, search_term: str, search_te
         2. Response: The raw response object from the requests library, providing access to response headers, status code, and other metadata.
     """
     # Initiate the request
-    response, status_code = make_request_with_rate_limiting(query, auth_headers)
+    response, status_code = make_request_with_rate_limiting(query, auth_headers, rate_limiter=search_rate_limiter)
     # Check if response is None
     if response is None:
         console.print(f"Failed to fetch data for query: {query}. Error from fetch_data function.", style="bold red")
@@ -65,38 +70,40 @@ def fetch_data(query: str, data_directory_path: str, search_term: str, search_te
             response_df["search_query"] = query
     return response_df, response
 
-def get_search_api_data(query: str, total_pages: int, data_directory_path: str, search_term: str, search_term_source: str) -> pd.DataFrame:
+def get_search_api_data(query: str, total_pages: int, data_directory_path: str, search_term: str, search_term_source: str) -> Tuple[pd.DataFrame, bool]:
     """
     Retrieves data from the search API based on the specified query across a defined number of pages. This function consolidates the data from all pages into a single DataFrame.
 
     :param query: String representing the query to be passed to the search API. This should conform to the API's query format and include any necessary parameters.
     :param total_pages: Integer specifying the total number of pages of data to be queried from the API. It determines how many API requests will be made.
     :param data_directory_path: String specifying the path to the directory where the data will be stored.
-    :return: DataFrame containing aggregated data from all queried pages of the API. 
+    :return: A tuple containing two elements:
+        1. DataFrame: Aggregated data from all queried pages of the API.
+        2. Boolean: Whether every page was fetched successfully.
     """
     # Initiate an empty list to store the dataframes
     dfs = []
+    completed = False
     pbar = tqdm(total=total_pages, desc="Getting Search API Data")
     try:
         # Get the data from the API
-        time.sleep(0.01)
         df, response = fetch_data(query, data_directory_path, search_term, search_term_source)
         dfs.append(df)
         pbar.update(1)
         # Loop through the pages. A suggestion we gathered from https://stackoverflow.com/questions/33878019/how-to-get-data-from-all-pages-in-github-api-with-python
-        while "next" in response.links.keys():
-            time.sleep(120)
+        while response is not None and "next" in response.links.keys():
             query = response.links["next"]["url"]
-            df, response = fetch_data(query, data_directory_path)
+            df, response = fetch_data(query, data_directory_path, search_term, search_term_source)
             dfs.append(df)
             pbar.update(1)
+        completed = response is not None
     except:  # pylint: disable=W0702
         console.print(f"Error with URL: {query}. Error from get_search_api_data function.", style="bold red")
 
     pbar.close()
     # Concatenate the dataframes
-    search_df = pd.concat(dfs)
-    return search_df
+    search_df = pd.concat(dfs) if len(dfs) > 0 else pd.DataFrame()
+    return search_df, completed
 
 def encode_decode(x: str) -> str:
     """
@@ -110,28 +117,236 @@ def encode_decode(x: str) -> str:
     except:
         return x
 
-def process_search_data(rates_df: pd.DataFrame, query: str, output_path: str, row_data: Dict[str, Any], data_directory_path: str) -> pd.DataFrame:
+@lru_cache(maxsize=None)
+def normalize_natural_language(natural_language: str) -> str:
+    """
+    Strips and reorders alphabetically a comma separated list of natural languages, so that "fr,en" and "en, fr" are stored the same way.
+
+    :param natural_language: Comma separated natural language codes.
+    :return: The normalized natural language codes joined by ", ".
+    """
+    return ", ".join(sorted(language.strip() for language in natural_language.split(",")))
+
+def clean_search_query(query: str) -> str:
+    """
+    Cleans a search query by decoding quotes and colons and removing the page parameter, so that every page of the same search maps to the same string.
+
+    :param query: Query string passed to the search API.
+    :return: The cleaned search query.
+    """
+    return query.replace("%22", '"').replace('"', "").replace("%3A", ":").split("&page")[0]
+
+def get_search_journal_path(data_directory_path: str) -> str:
+    """
+    Gets the path of the search completion journal.
+
+    :param data_directory_path: String specifying the path to the directory where the data will be stored.
+    :return: Path to the search journal CSV.
+    """
+    return os.path.join(data_directory_path, "derived_files", "search_journal.csv")
+
+def get_search_slice(query: str) -> Tuple[str, str]:
+    """
+    Gets the search kind and date slice of a search query. The search kind combines the entity searched for with whether it was a topic or a text search, and the date slice is the created range for queries split by year.
+
+    :param query: Query string passed to the search API.
+    :return: A tuple containing the search kind (e.g. repos_tagged) and the date slice (e.g. 2017-01-01..2017-12-31, or all).
+    """
+    entity = "repos" if "search/repositories" in query else "users"
+    search_type = "tagged" if "topic" in query else "searched"
+    date_slice = re.search(r"created(?:%3A|:)([\d-]+\.\.[\d-]+)", query)
+    return f"{entity}_{search_type}", date_slice.group(1) if date_slice is not None else "all"
+
+# Completed searches of each data directory, loaded from the journal once per run and kept up to date by record_search_journal
+completed_searches_cache: Dict[str, set] = {}
+
+def load_completed_searches(data_directory_path: str, reload: bool = False, max_age_days: Optional[int] = None) -> set:
+    """
+    Loads the cleaned search queries whose latest journal entry is complete. Slices that failed or were never finished are left out so they get retried, as are slices completed more than `max_age_days` ago so that a new run collects their new results.
+    The journal is only read the first time it is needed in a run. Entries recorded afterwards with `record_search_journal` update the loaded set.
+
+    :param data_directory_path: String specifying the path to the directory where the data will be stored.
+    :param reload: Boolean indicating whether to read the journal again, e.g. to pick up slices completed by another run. Defaults to False.
+    :param max_age_days: Optional maximum age in days of a completed slice, applied when the journal is read. Use 0 to search every slice again. Defaults to None, keeping completed slices regardless of age.
+    :return: Set of cleaned search queries that do not need to be searched again.
+    """
+    if (data_directory_path in completed_searches_cache) and not reload:
+        return completed_searches_cache[data_directory_path]
+    journal_path = get_search_journal_path(data_directory_path)
+    journal_df = read_csv_file(journal_path) if os.path.exists(journal_path) else None
+    completed_searches = set()
+    if journal_df is not None and not journal_df.empty:
+        latest_entries = journal_df.sort_values(by="completed_at").drop_duplicates(subset=["cleaned_search_query"], keep="last")
+        latest_entries = latest_entries[latest_entries.status == "complete"]
+        if max_age_days is not None:
+            cutoff = datetime.now() - timedelta(days=max_age_days)
+            latest_entries = latest_entries[pd.to_datetime(latest_entries.completed_at, errors="coerce") >= cutoff]
+        completed_searches = set(latest_entries.cleaned_search_query)
+    completed_searches_cache[data_directory_path] = completed_searches
+    return completed_searches
+
+def record_search_journal(data_directory_path: str, query: str, row_data: Dict[str, Any], status: str, total_pages: int, result_count: int, started_at: str) -> None:
+    """
+    Appends an entry to the search completion journal for a (term, search kind, date slice). Appending keeps the journal safe to share between runs that process terms concurrently, with the latest entry for a slice taking precedence.
+
+    :param data_directory_path: String specifying the path to the directory where the data will be stored.
+    :param query: Query string passed to the search API.
+    :param row_data: Dictionary representing a row of data from the search terms CSV.
+    :param status: Status of the slice, either complete or failed.
+    :param total_pages: Number of pages expected for the slice.
+    :param result_count: Number of results that were collected for the slice.
+    :param started_at: Time the slice was started, formatted as %Y-%m-%d %H:%M:%S.
+    """
+    search_kind, date_slice = get_search_slice(query)
+    journal_df = pd.DataFrame([{
+        "search_term": row_data["search_term"],
+        "search_term_source": row_data["search_term_source"],
+        "natural_language": row_data["natural_language"],
+        "search_kind": search_kind,
+        "date_slice": date_slice,
+        "cleaned_search_query": clean_search_query(query),
+        "status": status,
+        "total_pages": total_pages,
+        "result_count": result_count,
+        "started_at": started_at,
+        "completed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }])
+    journal_path = get_search_journal_path(data_directory_path)
+    if os.path.exists(journal_path):
+        journal_df.to_csv(journal_path, mode="a", header=False, index=False)
+    else:
+        os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+        journal_df.to_csv(journal_path, index=False)
+    # Keep the completed searches loaded for this run in step with the journal
+    completed_searches = load_completed_searches(data_directory_path)
+    if status == "complete":
+        completed_searches.add(clean_search_query(query))
+    else:
+        completed_searches.discard(clean_search_query(query))
+
+def get_search_log_path(output_path: str) -> str:
+    """
+    Gets the path of the append-only log segment that sits alongside a search output file. New search results are appended to this segment and only folded into the output file when it is compacted.
+
+    :param output_path: Path to the compacted search output CSV.
+    :return: Path to the JSON lines log segment for that output file.
+    """
+    return f"{os.path.splitext(output_path)[0]}_search_log.jsonl"
+
+def append_search_log(searched_df: pd.DataFrame, output_path: str) -> None:
     """
-    Processes data obtained from the search API. It uses the specified query to fetch data, adhering to the given rate limits, and then processes this data according to the row data from the search terms CSV.
+    Appends newly searched rows to the log segment of a search output file. JSON lines are used rather than CSV because each page of results can return a different set of columns.
+
+    :param searched_df: DataFrame containing the rows returned by the search API for one query.
+    :param output_path: Path to the compacted search output CSV.
+    """
+    if searched_df.empty:
+        return
+    log_path = get_search_log_path(output_path)
+    dir_name = os.path.dirname(log_path)
+    if not os.path.exists(dir_name):
+        os.makedirs(dir_name, exist_ok=True)
+    logged_rows = searched_df.to_json(orient="records", lines=True, force_ascii=False)
+    with open(log_path, "a", encoding="utf-8") as log_file:
+        log_file.write(logged_rows.rstrip("\n") + "\n")
+
+def compact_search_data(output_path: str) -> Optional[pd.DataFrame]:
+    """
+    Compacts the log segment of a search output file into the output file. The existing output is read once, combined with every logged row, grouped and deduplicated, and then written back before the log segment is removed. Rerunning a compaction after a crash is safe because duplicate rows are dropped during grouping.
+
+    :param output_path: Path to the compacted search output CSV.
+    :return: DataFrame containing the compacted search data, or None if there was nothing to compact.
+    """
+    log_path = get_search_log_path(output_path)
+    if not os.path.exists(log_path):
+        return None
+    logged_df = pd.read_json(log_path, lines=True, dtype=False, convert_dates=False, keep_default_dates=False)
+    existing_searched_df = read_csv_file(output_path, error_bad_lines=False) if os.path.exists(output_path) else None
+    if existing_searched_df is not None:
+        # previous encoding="ISO-8859-1"
+        encode_columns = ["cleaned_search_query", "search_term", "description"] if "full_name" in existing_searched_df.columns else ["cleaned_search_query", "search_term"]
+        existing_searched_df_columns = existing_searched_df.columns
+        encode_columns = [col for col in encode_columns if col in existing_searched_df_columns]
+        for encode_column in encode_columns:
+            existing_searched_df[encode_column] = map_distinct_values(existing_searched_df[encode_column], encode_decode)
+    else:
+        # If it doesn't exist, create an empty dataframe
+        existing_searched_df = pd.DataFrame()
+
+    combined_dfs = pd.concat([existing_searched_df, logged_df])
+    if "coding_dh_id" in combined_dfs.columns:
+        combined_dfs = combined_dfs.drop(columns="coding_dh_id")
+    
+    # Strip spaces and reorder alphabetically the natural language
+    combined_dfs["natural_language"] = map_distinct_values(combined_dfs["natural_language"], normalize_natural_language)
+    grouped_column = "full_name" if "full_name" in combined_dfs.columns else "login"
+    if combined_dfs[grouped_column].isnull().all():
+        console.print(f"All values in {grouped_column} are None. Skipping concatenation.")
+        final_searched_df = None
+    else:
+        subset_columns = ["coding_dh_date", "search_query"]
+        final_searched_df = add_coding_dh_ids(combined_dfs, [grouped_column], subset_columns)
+        final_searched_df = apply_schema(final_searched_df, "search_repos" if grouped_column == "full_name" else "search_users")
+        # Write to a temporary file first so that an interrupted compaction never truncates the output file
+        temp_output_path = f"{output_path}.tmp"
+        format_schema_for_csv(final_searched_df).to_csv(temp_output_path, index=False)
+        os.replace(temp_output_path, output_path)
+    os.remove(log_path)
+    return final_searched_df
+
+def compact_search_logs(data_directory_path: str) -> None:
+    """
+    Compacts every pending search log segment in the searched repo and user directories. This is run at the end of a search run, but can also be called on demand before reading the searched data.
+
+    :param data_directory_path: String specifying the path to the directory where the data will be stored.
+    """
+    log_suffix = "_search_log.jsonl"
+    log_paths = []
+    for searched_dir in ["searched_repo_data", "searched_user_data"]:
+        for dir_path, _, files in os.walk(os.path.join(data_directory_path, searched_dir)):
+            log_paths.extend(os.path.join(dir_path, file) for file in files if file.endswith(log_suffix))
+    compacted_paths = [log_path[:-len(log_suffix)] + ".csv" for log_path in log_paths]
+    for output_path in tqdm(compacted_paths, desc="Compacting search logs"):
+        compact_search_data(output_path)
+    # Keep the local full-text index in step with the newly compacted files
+    if len(compacted_paths) > 0:
+        update_fulltext_index(data_directory_path, compacted_paths)
+
+def process_search_data(rates_df: pd.DataFrame, query: str, output_path: str, row_data: Dict[str, Any], data_directory_path: str, compact: bool = False, total_pages: Optional[int] = None) -> pd.DataFrame:
+    """
+    Processes data obtained from the search API. It uses the specified query to fetch data, adhering to the given rate limits, and then processes this data according to the row data from the search terms CSV. New rows are appended to the log segment of the output file rather than rewriting the output file for every query.
 
     :param rates_df: DataFrame containing the current rate limit information.
     :param query: Query string to be passed to the search API.
     :param output_path: Path to the file where processed data will be saved.
     :param row_data: Dictionary representing a row of data from the search terms CSV.
     :param data_directory_path: String specifying the path to the directory where the data will be stored.
-    :return: DataFrame containing the processed data from the API.
+    :param compact: Boolean indicating whether to compact the log segment into the output file straight away. Defaults to False, leaving compaction to `compact_search_logs`.
+    :param total_pages: Optional number of pages for the query, as computed by the search plan. If None, it is checked against the API and the search quota is checked before fetching. Planned queries rely on the search rate limiter instead.
+    :return: DataFrame containing the processed data from the API, or None if the slice was already completed.
     """
+    if clean_search_query(query) in load_completed_searches(data_directory_path):
+        console.print(f"Skipping completed query: {query}", style="green")
+        return None
+    started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     console.print(f"Processing data for this finalized query: ", style="purple")
     console.print(query, style=f"link {query}")
-    total_pages = int(check_total_pages(query, auth_headers=auth_headers))
+    planned = total_pages is not None
+    if not planned:
+        total_pages = int(check_total_pages(query, auth_headers=auth_headers, rate_limiter=search_rate_limiter))
     total_pages = 1 if total_pages == 0 else total_pages
     console.print(f"Total pages: {total_pages}", style="green")
-    calls_remaining = rates_df["resources.search.remaining"].values[0]
-    while total_pages > calls_remaining:
-        time.sleep(3700)
-        updated_rates_df = check_rate_limit()
-        calls_remaining = updated_rates_df["resources.search.remaining"].values[0]
-    searched_df = get_search_api_data(query, total_pages, data_directory_path, row_data["search_term"], row_data["search_term_source"])
+    # Planned queries are spaced by the search rate limiter, so the rates checked when the run started are not consulted
+    if not planned:
+        calls_remaining = rates_df["resources.search.remaining"].values[0]
+        while total_pages > calls_remaining:
+            time.sleep(3700)
+            updated_rates_df = check_rate_limit()
+            calls_remaining = updated_rates_df["resources.search.remaining"].values[0]
+    searched_df, completed = get_search_api_data(query, total_pages, data_directory_path, row_data["search_term"], row_data["search_term_source"])
+    if "search_query" not in searched_df.columns:
+        record_search_journal(data_directory_path, query, row_data, "failed", total_pages, 0, started_at)
+        return searched_df
     searched_df = searched_df.reset_index(drop=True)
     searched_df["search_term"] = row_data["search_term"]
     searched_df["search_term_source"] = row_data["search_term_source"]
@@ -139,70 +354,32 @@ def process_search_data(rates_df: pd.DataFrame, query: str, output_path: str, ro
     searched_df["search_type"] = "tagged" if "topic" in query else "searched"
     searched_df["cleaned_search_query"] = searched_df.search_query.str.replace("%22", '"').str.replace('"', "").str.replace("%3A", ":").str.split("&page").str[0]
     searched_df["coding_dh_date"] = datetime.now().strftime("%Y-%m-%d")
-    if os.path.exists(output_path):
-        # If it does load it in
-        # previous encoding="ISO-8859-1"
-        existing_searched_df = read_csv_file(output_path, error_bad_lines=False)
-        encode_columns = ["cleaned_search_query", "search_term", "description"] if "repositories" in query else ["cleaned_search_query", "search_term"]
-        existing_searched_df_columns = existing_searched_df.columns
-        encode_columns = [col for col in encode_columns if col in existing_searched_df_columns]
-        existing_searched_df[encode_columns] = existing_searched_df[encode_columns].applymap(encode_decode)
-    else:
-        # If it doesn't exist, create an empty dataframe
-        existing_searched_df = pd.DataFrame()
- 
-    combined_dfs = pd.concat([existing_searched_df, searched_df])
-    if "coding_dh_id" in combined_dfs.columns:
-        combined_dfs = combined_dfs.drop(columns="coding_dh_id")
-    
-    combined_dfs["split_natural_language"] = combined_dfs["natural_language"].str.split(",")
-    # Strip spaces and reorder alphabetically the natural language
-    combined_dfs["split_natural_language"] = combined_dfs["split_natural_language"].apply(lambda x: sorted(i.strip() for i in x))
-    combined_dfs["natural_language"] = combined_dfs["split_natural_language"].apply(lambda x: ", ".join(x))
-    combined_dfs = combined_dfs.drop(columns="split_natural_language")
+    append_search_log(searched_df, output_path)
     grouped_column = "full_name" if "repositories" in query else "login"
-    if combined_dfs[grouped_column].isnull().all():
-        console.print(f"All values in {grouped_column} are None. Skipping concatenation.")
-    else:
-        grouped_dfs = combined_dfs.groupby(grouped_column)
-        processed_files = []
-        for _, group in tqdm(grouped_dfs, desc=f"Grouping files"):
-            subset_columns = ["coding_dh_date", "search_query"]
-            group = sort_groups_add_coding_dh_id(group, subset_columns)
-            processed_files.append(group)
+    result_count = int(searched_df[grouped_column].notna().sum()) if grouped_column in searched_df.columns else 0
+    record_search_journal(data_directory_path, query, row_data, "complete" if completed else "failed", total_pages, result_count, started_at)
+    if compact:
+        compact_search_data(output_path)
+    return searched_df
 
-        final_searched_df = pd.concat(processed_files).reset_index(drop=True)
-        dir_name = os.path.dirname(output_path)
 
-        if not os.path.exists(dir_name):
-            os.makedirs(dir_name, exist_ok=True)
-
-        final_searched_df.to_csv(output_path, index=False)
-
-
-def process_large_search_data(rates_df: pd.DataFrame, search_url: str, dh_term: str, params: str, initial_output_path: str, row_data: Dict[str, Any], data_directory_path: str) -> Optional[pd.DataFrame]:
+def get_date_slice_queries(search_url: str, dh_term: str, params: str) -> List[Tuple[int, str]]:
     """
-    Processes large datasets from the search API, specifically designed for queries expected to return over 1000 results. It constructs the query using the provided parameters and processes the resulting data. An example query looks like: https://api.github.com/search/repositories?q=%22Digital+Humanities%22+created%3A2017-01-01..2017-12-31+sort:updated
+    Splits a search into one query per created year, since GitHub only returns the first 1000 results of any search.
 
-    :param rates_df: DataFrame containing the current rate limit information.
     :param search_url: String representing the base URL for the search API.
     :param dh_term: String indicating the term to be searched within the API.
-    :param params: String detailing additional parameters to be passed to the search API. These parameters should be formatted as a query string.
-    :param initial_output_path: String specifying the file path where the output data will be stored.
-    :param row_data: Dictionary representing a single row from the search terms CSV, used for further processing.
-    :param data_directory_path: String specifying the path to the directory where the data will be stored.
-    :return: Optionally returns a DataFrame containing the processed data from the API. Returns None if there are no results or in case of an error.
+    :param params: String detailing additional parameters to be passed to the search API.
+    :return: List of tuples containing the year and the query for that year.
     """
     # Set the first year to be searched
     first_year = 2008
     current_year = datetime.now().year
     current_day = datetime.now().day
     current_month = datetime.now().month
+    date_slice_queries = []
     # Get the years to be searched
-    years = list(range(first_year, current_year+1))
-    for year in years:
-        # Set the output path for the year
-        yearly_output_path = initial_output_path + f"_{year}.csv"
+    for year in range(first_year, current_year+1):
         # Handle the case where the year is the current year
         if year == current_year:
             query = search_url + \
@@ -210,21 +387,37 @@ def process_large_search_data(rates_df: pd.DataFrame, search_url: str, dh_term:
         else:
             query = search_url + \
                 f'"{dh_term}"+created%3A{year}-01-01..{year}-12-31+sort:created{params}'
+        date_slice_queries.append((year, query))
+    return date_slice_queries
+
+def process_large_search_data(rates_df: pd.DataFrame, search_url: str, dh_term: str, params: str, initial_output_path: str, row_data: Dict[str, Any], data_directory_path: str) -> Optional[pd.DataFrame]:
+    """
+    Processes large datasets from the search API, specifically designed for queries expected to return over 1000 results. It constructs the query using the provided parameters and processes the resulting data. An example query looks like: https://api.github.com/search/repositories?q=%22Digital+Humanities%22+created%3A2017-01-01..2017-12-31+sort:updated
+
+    :param rates_df: DataFrame containing the current rate limit information.
+    :param search_url: String representing the base URL for the search API.
+    :param dh_term: String indicating the term to be searched within the API.
+    :param params: String detailing additional parameters to be passed to the search API. These parameters should be formatted as a query string.
+    :param initial_output_path: String specifying the file path where the output data will be stored.
+    :param row_data: Dictionary representing a single row from the search terms CSV, used for further processing.
+    :param data_directory_path: String specifying the path to the directory where the data will be stored.
+    :return: Optionally returns a DataFrame containing the processed data from the API. Returns None if there are no results or in case of an error.
+    """
+    for year, query in get_date_slice_queries(search_url, dh_term, params):
+        # Set the output path for the year
+        yearly_output_path = initial_output_path + f"_{year}.csv"
         # Get the data from the API
         process_search_data(rates_df, query, yearly_output_path, row_data, data_directory_path)   
 
-def prepare_terms_and_directories(translated_terms_output_path: str, threshold_file_path: str, target_terms: List) -> Tuple[pd.DataFrame, int]:
+def prepare_terms_and_directories(translated_terms_output_path: str, target_terms: List) -> pd.DataFrame:
     """
     Prepares the terms and directories necessary for use with the search API. This function processes 
-    translated terms, storing them in a specified output path, and reads threshold values from a given 
-    file if the code has previously errorer out, setting up the environment for subsequent API searches.
+    translated terms, storing them in a specified output path, setting up the environment for subsequent API searches.
+    Resuming after an error is handled per search slice by the search journal rather than by dropping terms here.
 
     :param translated_terms_output_path: String specifying the path to the file where translated terms are stored. 
-    :param threshold_file_path: String specifying the path to the file containing threshold values.
     :param target_terms: List of terms to be searched in the API. Used in the `generate_translations.py` file. 
-    :return: A tuple containing:
-        1. DataFrame: Contains the processed and translated terms ready for API search.
-        2. Integer: A threshold value read from the threshold file, used for filtering or other purposes in the API search.
+    :return: DataFrame containing the processed and translated terms ready for API search.
     """
     # Load in the translated terms
     cleaned_terms = read_csv_file(translated_terms_output_path, encoding='utf-8-sig')
@@ -244,12 +437,6 @@ def prepare_terms_and_directories(translated_terms_output_path: str, threshold_f
     ltr = cleaned_terms[cleaned_terms.directionality == 'ltr']
     final_terms = pd.concat([ltr, rtl])
     final_terms.loc[final_terms.search_term.str.contains("&#39;"), "search_term"] = final_terms.search_term.str.replace("&#39;", "'")
-    # Subset to just the terms that are in the threshold file
-    if os.path.exists(threshold_file_path):
-        threshold = read_csv_file(threshold_file_path)
-        final_terms = final_terms[(final_terms.index > threshold.row_index.values[0])]
-    else:
-        final_terms = final_terms
     # Return the final terms
     return final_terms
 
@@ -271,7 +458,7 @@ def search_for_topics(row: pd.Series, rates_df: pd.DataFrame, initial_repo_outpu
     console.print(f"Searching for topics with this query: ", style="purple")
     console.print(search_topics_query, style=f"link {search_topics_query}")
     # Initiate the request
-    response = make_request_with_rate_limiting(search_topics_query, auth_headers, timeout=5)
+    response, _ = make_request_with_rate_limiting(search_topics_query, auth_headers, timeout=5, rate_limiter=search_rate_limiter)
     
     # Check if response is None
     if response is None:
@@ -289,7 +476,7 @@ def search_for_topics(row: pd.Series, rates_df: pd.DataFrame, initial_repo_outpu
             tagged_query = item['name'].replace(' ', '-')
             repos_tagged_query = f'https://api.github.com/search/repositories?q=topic:"{tagged_query}"&per_page=100&page=1'
             # Check how many results
-            total_tagged_results = check_total_results(repos_tagged_query, auth_headers=auth_headers)
+            total_tagged_results = check_total_results(repos_tagged_query, auth_headers=auth_headers, rate_limiter=search_rate_limiter)
             #If results exist then proceed
             if total_tagged_results > 0:
 
@@ -322,7 +509,7 @@ def search_for_repos(row: pd.Series, search_query: str, rates_df: pd.DataFrame,
     console.print(f"Searching for repos with this query: ", style="purple")
     console.print(search_repos_query, style=f"link {search_repos_query}")
     # Check how many results
-    total_search_results = check_total_results(search_repos_query, auth_headers=auth_headers)
+    total_search_results = check_total_results(search_repos_query, auth_headers=auth_headers, rate_limiter=search_rate_limiter)
 
     if total_search_results > 0:
         output_term = row.search_term.replace(' ','+')
@@ -352,7 +539,7 @@ def search_for_users(row: pd.Series, search_query: str, rates_df: pd.DataFrame,
     console.print(f"Searching for users with this query: ", style="purple")
     console.print(search_users_query, style=f"link {search_users_query}")
     # Check how many results
-    total_search_results = check_total_results(search_users_query, auth_headers=auth_headers)
+    total_search_results = check_total_results(search_users_query, auth_headers=auth_headers, rate_limiter=search_rate_limiter)
     if total_search_results > 0:
         output_term = row.search_term.replace(' ','+')
         if total_search_results > 1000:
@@ -365,7 +552,138 @@ def search_for_users(row: pd.Series, search_query: str, rates_df: pd.DataFrame,
             final_searched_output_path = initial_user_output_path + f'{source_type}/' + f'users_searched_{output_term}.csv'
             process_search_data(rates_df, search_users_query, final_searched_output_path, row, data_directory_path)
 
-def generate_initial_search_datasets(rates_df: pd.DataFrame, initial_repo_output_path: str,  initial_user_output_path: str,  target_terms: List, data_directory_path: str):
+def get_topic_names(row: pd.Series, search_query: str) -> List[str]:
+    """
+    Gets the names of the GitHub topics that match a search term.
+
+    :param row: The row of data from the search terms CSV.
+    :param search_query: The query string to be passed to the search API.
+    :return: List of matching topic names. Empty if the term is not a topic or the request failed.
+    """
+    search_topics_query = f'https://api.github.com/search/topics?q="{search_query}"'
+    response, _ = make_request_with_rate_limiting(search_topics_query, auth_headers, timeout=5, rate_limiter=search_rate_limiter)
+    if response is None:
+        console.print(f'Failed to fetch data for query: {search_topics_query}. Error from get_topic_names function.', style='bold red')
+        return []
+    topic_names = [item['name'] for item in response.json().get('items', [])]
+    if row.search_term == 'Public History':
+        topic_names = [topic_name for topic_name in topic_names if topic_name != 'solana']
+    return topic_names
+
+def build_search_queries(row: pd.Series, topic_names: List[str], initial_repo_output_path: str, initial_user_output_path: str) -> List[Dict[str, Any]]:
+    """
+    Builds the tagged repo, searched repo and searched user queries for a search term, along with the parameters needed to split them by year and the output path they are written to.
+
+    :param row: The row of data from the search terms CSV.
+    :param topic_names: List of topic names that match the search term.
+    :param initial_repo_output_path: Path to the initial repository output file.
+    :param initial_user_output_path: Path to the initial user output file.
+    :return: List of dictionaries describing each query.
+    """
+    search_query = row.search_term.replace(' ', '+')
+    source_type = row.search_term_source.lower().replace(' ', '_')
+    output_term = row.search_term.replace(' ', '+')
+    params = "&per_page=100&page=1"
+    search_queries = []
+    for topic_name in topic_names:
+        # Topics are joined by hyphens rather than plus signs in queries
+        tagged_query = topic_name.replace(' ', '-')
+        search_queries.append({"query": f'https://api.github.com/search/repositories?q=topic:"{tagged_query}"{params}', "search_url": "https://api.github.com/search/repositories?q=topic:", "dh_term": tagged_query, "output_base": initial_repo_output_path + f'{source_type}/' + f'repos_tagged_{topic_name.replace(" ", "_")}'})
+    search_queries.append({"query": f'https://api.github.com/search/repositories?q="{search_query}"{params}', "search_url": "https://api.github.com/search/repositories?q=", "dh_term": search_query, "output_base": initial_repo_output_path + f'{source_type}/' + f'repos_searched_{output_term}'})
+    search_queries.append({"query": f'https://api.github.com/search/users?q="{search_query}"{params}', "search_url": "https://api.github.com/search/users?q=", "dh_term": search_query, "output_base": initial_user_output_path + f'{source_type}/' + f'users_searched_{output_term}'})
+    for search_query_dict in search_queries:
+        search_query_dict.update({"search_term": row.search_term, "search_term_source": row.search_term_source, "natural_language": row.natural_language, "params": params})
+    return search_queries
+
+def prefetch_total_counts(queries: List[str], max_workers: int) -> Dict[str, Optional[int]]:
+    """
+    Gets the total number of results for many search queries concurrently. Requests are spaced by the shared search rate limiter, so the workers only overlap request latency rather than exceeding the search bucket.
+
+    :param queries: List of search queries.
+    :param max_workers: Maximum number of concurrent requests.
+    :return: Dictionary mapping each query to its total count, or None if the request failed.
+    """
+    def fetch_total_count(query: str) -> Optional[int]:
+        return check_total_results(query, auth_headers=auth_headers, rate_limiter=search_rate_limiter)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        total_counts = list(tqdm(executor.map(fetch_total_count, queries), total=len(queries), desc="Prefetching total counts"))
+    return dict(zip(queries, total_counts))
+
+def generate_search_plan(final_terms: pd.DataFrame, initial_repo_output_path: str, initial_user_output_path: str, data_directory_path: str, max_workers: int = 4, max_age_days: Optional[int] = None) -> pd.DataFrame:
+    """
+    Plans a full search run before any results are fetched. Topic lookups and total counts for every term are gathered concurrently, searches over 1000 results are split into yearly slices with their own totals, and slices already completed in the search journal are dropped. Every request draws from the search rate limiter, which allows the per-minute search limit in any rolling minute, so the ETA is the number of planning and slice requests divided by that limit.
+
+    :param final_terms: DataFrame containing the processed and translated terms ready for API search.
+    :param initial_repo_output_path: Path to the initial repository output file.
+    :param initial_user_output_path: Path to the initial user output file.
+    :param data_directory_path: String specifying the path to the directory where the data will be stored.
+    :param max_workers: Maximum number of concurrent requests. Defaults to 4.
+    :param max_age_days: Optional maximum age in days of the journal entries that count as completed, see `load_completed_searches`. Defaults to None.
+    :return: DataFrame with one row per search slice.
+    """
+    planning_started = datetime.now()
+    rates_df = check_rate_limit()
+    search_limit = int(rates_df["resources.search.limit"].values[0]) if "resources.search.limit" in rates_df.columns else search_rate_limiter.max_calls
+    rows = [row for _, row in final_terms.iterrows()]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        topic_names = list(tqdm(executor.map(lambda row: get_topic_names(row, row.search_term.replace(' ', '+')), rows), total=len(rows), desc="Looking up topics"))
+    search_queries = [search_query for row, row_topic_names in zip(rows, topic_names) for search_query in build_search_queries(row, row_topic_names, initial_repo_output_path, initial_user_output_path)]
+    total_counts = prefetch_total_counts([search_query["query"] for search_query in search_queries], max_workers)
+
+    # Split the searches with more than 1000 results into yearly slices and get their totals too
+    search_slices = []
+    for search_query in search_queries:
+        total_count = total_counts[search_query["query"]]
+        if total_count is not None and total_count > 1000:
+            for year, query in get_date_slice_queries(search_query["search_url"], search_query["dh_term"], search_query["params"]):
+                search_slices.append({**search_query, "query": query, "output_path": search_query["output_base"] + f"_{year}.csv"})
+        elif total_count is None or total_count > 0:
+            search_slices.append({**search_query, "output_path": search_query["output_base"] + ".csv", "total_count": total_count})
+    if len(search_slices) == 0:
+        console.print("No search slices to plan", style="bold blue")
+        return pd.DataFrame()
+    slice_queries = [search_slice["query"] for search_slice in search_slices if "total_count" not in search_slice]
+    total_counts.update(prefetch_total_counts(slice_queries, max_workers))
+
+    plan_df = pd.DataFrame(search_slices)
+    plan_df["total_count"] = plan_df["query"].map(total_counts)
+    plan_df = plan_df[plan_df.total_count.isna() | (plan_df.total_count > 0)]
+    completed_searches = load_completed_searches(data_directory_path, reload=True, max_age_days=max_age_days)
+    plan_df = plan_df[~plan_df["query"].apply(clean_search_query).isin(completed_searches)]
+    # The search API returns at most 1000 results, 100 per page. Unknown totals are planned as a single page.
+    plan_df["total_pages"] = plan_df.total_count.fillna(1).clip(upper=1000).apply(lambda total_count: max(1, math.ceil(total_count / 100))).astype(int)
+    plan_df = plan_df.drop(columns=["output_base", "search_url", "dh_term", "params"]).reset_index(drop=True)
+
+    # Topic lookups and prefetched totals draw from the same search bucket as the slices
+    planning_requests = len(rows) + len(search_queries) + len(slice_queries)
+    search_requests = int(plan_df.total_pages.sum())
+    finish_time = planning_started + timedelta(minutes=(planning_requests + search_requests) / search_limit)
+    console.print(f"Search plan: {len(plan_df)} slices and {search_requests} search requests, after {planning_requests} planning requests, at {search_limit} search requests per minute. ETA {finish_time.strftime('%Y-%m-%d %H:%M:%S')}", style="bold blue")
+    search_plan_path = os.path.join(data_directory_path, "derived_files", "search_plan.csv")
+    os.makedirs(os.path.dirname(search_plan_path), exist_ok=True)
+    plan_df.to_csv(search_plan_path, index=False)
+    return plan_df
+
+def run_search_plan(plan_df: pd.DataFrame, rates_df: pd.DataFrame, data_directory_path: str) -> None:
+    """
+    Runs the search slices of a search plan and compacts the results once all slices have run.
+
+    :param plan_df: DataFrame with one row per search slice, as returned by `generate_search_plan`.
+    :param rates_df: DataFrame containing the current rate limit information.
+    :param data_directory_path: String specifying the path to the directory where the data will be stored.
+    """
+    if plan_df.empty:
+        return
+    for _, row in tqdm(plan_df.iterrows(), total=len(plan_df), desc="Running search plan"):
+        try:
+            process_search_data(rates_df, row["query"], row.output_path, row, data_directory_path, total_pages=int(row.total_pages))
+        except Exception as e:
+            console.print(f"Error with {row['query']}: {e}", style="bold red")
+            continue
+    compact_search_logs(data_directory_path)
+
+def generate_initial_search_datasets(rates_df: pd.DataFrame, initial_repo_output_path: str,  initial_user_output_path: str,  target_terms: List, data_directory_path: str, use_search_plan: bool = True, max_age_days: Optional[int] = None):
     """
     Generates the initial search datasets using the search API. This function retrieves data from the search API based on the specified search terms and processes the data accordingly.
 
@@ -374,6 +692,8 @@ def generate_initial_search_datasets(rates_df: pd.DataFrame, initial_repo_output
     :param initial_user_output_path: Path to the initial user output file.
     :param target_terms: List of terms to be searched in the API.
     :param data_directory_path: String specifying the path to the directory where the data will be stored.
+    :param use_search_plan: Boolean indicating whether to plan the whole run up front with `generate_search_plan`. If False, terms are searched one at a time. Defaults to True.
+    :param max_age_days: Optional maximum age in days of the slices completed in the search journal. Older slices are searched again. Defaults to None, skipping every completed slice.
     """
 
     if os.path.exists(initial_repo_output_path) == False:
@@ -388,8 +708,13 @@ def generate_initial_search_datasets(rates_df: pd.DataFrame, initial_repo_output
         clean_write_error_file(error_file, drop_fields)
     
     cleaned_terms_path = os.path.join(data_directory_path, "derived_files", "grouped_cleaned_translated_terms.csv")
-    threshold_search_errors_path = os.path.join(data_directory_path, "derived_files", "threshold_search_errors.csv")
-    final_terms = prepare_terms_and_directories(cleaned_terms_path, threshold_search_errors_path, target_terms)
+    final_terms = prepare_terms_and_directories(cleaned_terms_path, target_terms)
+    # Read the journal once with the age limit, so every slice of this run skips the same completed slices
+    load_completed_searches(data_directory_path, reload=True, max_age_days=max_age_days)
+    if use_search_plan:
+        plan_df = generate_search_plan(final_terms, initial_repo_output_path, initial_user_output_path, data_directory_path, max_age_days=max_age_days)
+        run_search_plan(plan_df, rates_df, data_directory_path)
+        return
     for index, row in final_terms.iterrows():
         try:
             # Update the search term to be displayed correctly
@@ -409,6 +734,8 @@ def generate_initial_search_datasets(rates_df: pd.DataFrame, initial_repo_output
             console.print(f"Error with {row.search_term}: {e}", style="bold red")
             # log_error_to_csv(index, row.search_term, f'{data_directory_path}/derived_files/search_errors.csv')
             continue
+    # Fold all the logged search results into their output files in one pass
+    compact_search_logs(data_directory_path)
 
 
 
@@ -0,0 +1,201 @@
+# Standard library imports
+import os
+import sys
+import sqlite3
+from typing import List, Optional
+import warnings
+warnings.filterwarnings("ignore")
+
+# Related third-party imports
+import pandas as pd
+from rich.console import Console
+from tqdm import tqdm
+
+# Local application/library specific imports
+sys.path.append("..")
+from data_generation_scripts.general_utils import read_csv_file, get_data_directory_path
+
+# Initiate the console
+console = Console()
+
+# Text fields that are indexed for every entity, regardless of whether it comes from a search result or an entity file
+indexed_text_columns = ["login", "name", "description", "bio", "topics"]
+
+# Directories that are scanned for entities, with the entity type of their files. None means the type is inferred from the file.
+indexed_directories = {
+    "searched_repo_data": "repos",
+    "searched_user_data": None,
+    os.path.join("historic_data", "entity_files", "all_repos"): "repos",
+    os.path.join("historic_data", "entity_files", "all_users"): "users",
+    os.path.join("historic_data", "entity_files", "all_orgs"): "orgs",
+    os.path.join("historic_data", "entity_partitions", "repos"): "repos",
+    os.path.join("historic_data", "entity_partitions", "users"): "users",
+    os.path.join("historic_data", "entity_partitions", "orgs"): "orgs",
+}
+
+def get_fulltext_index_path(data_directory_path: str) -> str:
+    """
+    Gets the path of the local full-text index database.
+
+    :param data_directory_path: String specifying the path to the directory where the data is stored.
+    :return: Path to the SQLite database holding the full-text index.
+    """
+    return os.path.join(data_directory_path, "derived_files", "entity_fulltext_index.db")
+
+def connect_fulltext_index(data_directory_path: str) -> sqlite3.Connection:
+    """
+    Connects to the local full-text index, creating its tables if they do not exist yet. The FTS5 table holds the searchable text, while `indexed_files` records which version of each file has been indexed so updates only touch files that changed.
+
+    :param data_directory_path: String specifying the path to the directory where the data is stored.
+    :return: Connection to the full-text index database.
+    """
+    index_path = get_fulltext_index_path(data_directory_path)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    conn = sqlite3.connect(index_path)
+    conn.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS entity_text USING fts5(
+        entity_key UNINDEXED, entity_type UNINDEXED, source_file UNINDEXED, {", ".join(indexed_text_columns)},
+        tokenize='unicode61 remove_diacritics 2')""")
+    conn.execute("CREATE TABLE IF NOT EXISTS indexed_files (source_file TEXT PRIMARY KEY, modified_time REAL, row_count INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS indexed_rows (text_rowid INTEGER PRIMARY KEY, source_file TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS indexed_rows_source_file ON indexed_rows (source_file)")
+    return conn
+
+def prepare_indexed_rows(df: pd.DataFrame, entity_type: Optional[str]) -> pd.DataFrame:
+    """
+    Prepares the rows of a search or entity file for indexing. Only the latest row per entity is kept and the topics are flattened from their list representation into plain words.
+
+    :param df: DataFrame read from a search or entity file.
+    :param entity_type: Type of entity held in the file. If None, it is inferred from the `type` column of user search results.
+    :return: DataFrame with the entity key, entity type and text columns to index.
+    """
+    entity_column = "full_name" if "full_name" in df.columns else "login"
+    if entity_column not in df.columns:
+        return pd.DataFrame()
+    if "coding_dh_date" in df.columns:
+        df = df.sort_values(by="coding_dh_date", ascending=False)
+    df = df[df[entity_column].notna()].drop_duplicates(subset=[entity_column])
+    indexed_df = pd.DataFrame({"entity_key": df[entity_column].astype(str)})
+    if entity_type is None:
+        entity_type = "users"
+        if "type" in df.columns:
+            indexed_df["entity_type"] = df["type"].map({"Organization": "orgs"}).fillna(entity_type)
+    if "entity_type" not in indexed_df.columns:
+        indexed_df["entity_type"] = entity_type
+    for column in indexed_text_columns:
+        indexed_df[column] = df[column].fillna("").astype(str) if column in df.columns else ""
+    # Repos only carry their owner's login in a flattened column
+    if "owner.login" in df.columns:
+        indexed_df["login"] = df["owner.login"].fillna("").astype(str)
+    indexed_df["topics"] = indexed_df["topics"].str.replace(r"[\[\]'\",]", " ", regex=True).str.split().str.join(" ")
+    return indexed_df
+
+def index_file(conn: sqlite3.Connection, file_path: str, entity_type: Optional[str]) -> int:
+    """
+    Indexes a single search or entity file, replacing whatever was indexed from it before.
+
+    :param conn: Connection to the full-text index database.
+    :param file_path: Path to the file to index.
+    :param entity_type: Type of entity held in the file, or None to infer it.
+    :return: Number of entities indexed from the file.
+    """
+    df = read_csv_file(file_path)
+    indexed_df = prepare_indexed_rows(df, entity_type) if df is not None else pd.DataFrame()
+    previous_rowids = conn.execute("SELECT text_rowid FROM indexed_rows WHERE source_file = ?", (file_path,)).fetchall()
+    conn.executemany("DELETE FROM entity_text WHERE rowid = ?", previous_rowids)
+    conn.execute("DELETE FROM indexed_rows WHERE source_file = ?", (file_path,))
+    insert_columns = ["entity_key", "entity_type", "source_file"] + indexed_text_columns
+    insert_query = f"INSERT INTO entity_text ({', '.join(insert_columns)}) VALUES ({', '.join(['?'] * len(insert_columns))})"
+    for record in indexed_df.itertuples(index=False):
+        cursor = conn.execute(insert_query, (record.entity_key, record.entity_type, file_path) + tuple(getattr(record, column) for column in indexed_text_columns))
+        conn.execute("INSERT INTO indexed_rows (text_rowid, source_file) VALUES (?, ?)", (cursor.lastrowid, file_path))
+    conn.execute("INSERT OR REPLACE INTO indexed_files (source_file, modified_time, row_count) VALUES (?, ?, ?)", (file_path, os.path.getmtime(file_path), len(indexed_df)))
+    return len(indexed_df)
+
+def update_fulltext_index(data_directory_path: str, file_paths: Optional[List[str]] = None) -> None:
+    """
+    Updates the local full-text index with any search or entity files that are new or have changed since they were last indexed. Files that no longer exist are removed from the index.
+
+    :param data_directory_path: String specifying the path to the directory where the data is stored.
+    :param file_paths: Optional list of files to check. If None, all the indexed directories are scanned.
+    """
+    conn = connect_fulltext_index(data_directory_path)
+    indexed_files = dict(conn.execute("SELECT source_file, modified_time FROM indexed_files").fetchall())
+    file_paths = set(file_paths) if file_paths is not None else None
+    candidate_files = []
+    for directory, entity_type in indexed_directories.items():
+        full_directory = os.path.join(data_directory_path, directory)
+        for dir_path, _, files in os.walk(full_directory):
+            for file in files:
+                file_path = os.path.join(dir_path, file)
+                if file.endswith(".csv") and (file_paths is None or file_path in file_paths):
+                    candidate_files.append((file_path, entity_type))
+    changed_files = [(file_path, entity_type) for file_path, entity_type in candidate_files if indexed_files.get(file_path) != os.path.getmtime(file_path)]
+    for file_path, entity_type in tqdm(changed_files, desc="Updating full-text index"):
+        index_file(conn, file_path, entity_type)
+    if file_paths is None:
+        existing_files = {file_path for file_path, _ in candidate_files}
+        for file_path in [file_path for file_path in indexed_files if file_path not in existing_files]:
+            previous_rowids = conn.execute("SELECT text_rowid FROM indexed_rows WHERE source_file = ?", (file_path,)).fetchall()
+            conn.executemany("DELETE FROM entity_text WHERE rowid = ?", previous_rowids)
+            conn.execute("DELETE FROM indexed_rows WHERE source_file = ?", (file_path,))
+            conn.execute("DELETE FROM indexed_files WHERE source_file = ?", (file_path,))
+    conn.commit()
+    conn.close()
+    console.print(f"Indexed {len(changed_files)} new or changed files", style="bold blue")
+
+def update_partition_index(data_directory_path: str, entity_type: str, since: float) -> None:
+    """
+    Updates the local full-text index with the entity partitions of one entity type written since a given time, e.g. the start of a collection stage, without scanning the other indexed directories.
+
+    :param data_directory_path: String specifying the path to the directory where the data is stored.
+    :param entity_type: Type of entity (repos, users or orgs) whose partitions to index.
+    :param since: Timestamp in seconds. Partitions modified at or after it are indexed.
+    """
+    partition_dir = os.path.join(data_directory_path, "historic_data", "entity_partitions", entity_type)
+    if not os.path.exists(partition_dir):
+        return
+    partition_paths = [os.path.join(partition_dir, file) for file in os.listdir(partition_dir) if file.endswith(".csv") and os.path.getmtime(os.path.join(partition_dir, file)) >= since]
+    if len(partition_paths) > 0:
+        update_fulltext_index(data_directory_path, partition_paths)
+
+def search_fulltext_index(search_term: str, data_directory_path: str, entity_types: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Searches the local full-text index for a term as a phrase, mirroring the quoted queries sent to the search API.
+
+    :param search_term: Term to search for.
+    :param data_directory_path: String specifying the path to the directory where the data is stored.
+    :param entity_types: Optional list of entity types (repos, users, orgs) to restrict the search to.
+    :return: DataFrame with one row per matching entity, its entity type and the number of indexed files it matched in.
+    """
+    conn = connect_fulltext_index(data_directory_path)
+    phrase = '"' + search_term.replace('"', '""') + '"'
+    query = "SELECT entity_key, entity_type, COUNT(*) AS matched_files FROM entity_text WHERE entity_text MATCH ?"
+    params = [phrase]
+    if entity_types:
+        query += f" AND entity_type IN ({', '.join(['?'] * len(entity_types))})"
+        params.extend(entity_types)
+    query += " GROUP BY entity_key, entity_type ORDER BY matched_files DESC"
+    matches_df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+    return matches_df
+
+def evaluate_search_terms(terms_df: pd.DataFrame, data_directory_path: str) -> pd.DataFrame:
+    """
+    Evaluates candidate search terms against the local full-text index, counting how many already collected repos, users and orgs each term matches. Terms with few or no local matches are the gaps worth spending search API quota on.
+
+    :param terms_df: DataFrame of candidate terms with a `search_term` column.
+    :param data_directory_path: String specifying the path to the directory where the data is stored.
+    :return: The terms DataFrame with `local_repos_matches`, `local_users_matches` and `local_orgs_matches` columns added.
+    """
+    terms_df = terms_df.copy()
+    for entity_type in ["repos", "users", "orgs"]:
+        terms_df[f"local_{entity_type}_matches"] = 0
+    for index, row in tqdm(terms_df.iterrows(), total=len(terms_df), desc="Evaluating search terms"):
+        matches_df = search_fulltext_index(row.search_term, data_directory_path)
+        for entity_type, count in matches_df.entity_type.value_counts().items():
+            terms_df.loc[index, f"local_{entity_type}_matches"] = count
+    return terms_df
+
+if __name__ == "__main__":
+    data_directory_path = get_data_directory_path()
+    update_fulltext_index(data_directory_path)
@@ -24,22 +24,20 @@ def get_entity_files_from_expanded_users(expanded_owners, data_directory_path):
     """
     Get the files for the expanded users
     """
-    user_files = os.listdir(f"{data_directory_path}/historic_data/entity_files/all_users/")
-    org_files = os.listdir(f"{data_directory_path}/historic_data/entity_files/all_orgs/")
-    cleaned_user_files = [f.split("_coding_dh_")[0] for f in user_files if f.endswith(".csv")]
-    cleaned_org_files = [f.split("_coding_dh_")[0] for f in org_files if f.endswith(".csv")]
-    existing_owners = expanded_owners[(expanded_owners.login.isin(cleaned_user_files)) | (expanded_owners.login.isin(cleaned_org_files))]
-    finalized_user_logins = existing_owners[existing_owners['type'] == 'User'].login.unique()
-    finalized_org_logins = existing_owners[existing_owners['type'] == 'Organization'].login.unique()
-    finalized_user_files = [f"{login}_coding_dh_user.csv" for login in finalized_user_logins]
-    finalized_org_files = [f"{login}_coding_dh_org.csv" for login in finalized_org_logins]
-    expanded_core_users = read_combine_files(f"{data_directory_path}/historic_data/entity_files/all_users/", finalized_user_files)
-    expanded_core_orgs = read_combine_files(f"{data_directory_path}/historic_data/entity_files/all_orgs/", finalized_org_files)
+    finalized_user_logins = expanded_owners[expanded_owners['type'] == 'User'].login.unique().tolist()
+    finalized_org_logins = expanded_owners[expanded_owners['type'] == 'Organization'].login.unique().tolist()
+    expanded_core_users = read_latest_entities(data_directory_path, "users", finalized_user_logins)
+    expanded_core_orgs = read_latest_entities(data_directory_path, "orgs", finalized_org_logins)
     return expanded_core_users, expanded_core_orgs
 
 def get_entity_files_from_expanded_repos(user_df, user_repo_interaction_df, data_directory_path):
-    repo_files = os.listdir(f"{data_directory_path}/historic_data/entity_files/all_repos/")
-    cleaned_repo_files = [f.split("_coding_dh_")[0].replace("_", "/", 1) for f in repo_files if f.endswith(".csv")]
+    """
+    Get the files for the repos of the expanded users. Repos are looked up in the entity locator by full name, so owners with underscores in their login are matched correctly.
+    """
+    user_repo_interaction_df = user_repo_interaction_df[user_repo_interaction_df.user_login.isin(user_df.login)] if 'user_login' in user_repo_interaction_df.columns else user_repo_interaction_df
+    finalized_repo_full_names = user_repo_interaction_df.full_name.dropna().unique().tolist()
+    expanded_core_repos = read_latest_entities(data_directory_path, "repos", finalized_repo_full_names)
+    return expanded_core_repos
 
 if __name__ == "__main__":
 
@@ -4,6 +4,7 @@ from tqdm import tqdm
 from rich.console import Console
 console = Console()
 from datetime import datetime
+import time
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -11,6 +12,7 @@ import sys
 sys.path.append("../")
 from data_generation_scripts.general_utils import get_new_entities, get_data_from_search_terms, get_data_directory_path
 from data_generation_scripts.generate_entity_metadata import get_count_metadata
+from data_generation_scripts.generate_fulltext_index import update_partition_index
 
 import apikey
 # Load auth token
@@ -38,7 +40,10 @@ def process_initial_results(search_queries_df: pd.DataFrame, data_directory_path
     entity_progress_bar = tqdm(total=potential_new_entities_df.shape[0], desc="Processing entities")
     error_file_path = os.path.join(data_directory_path, "error_logs", f"{entity_type}_errors.csv")
     console.print(f"Error file path: {error_file_path}")
+    stage_start = time.time()
     get_new_entities(f"{entity_type}s", potential_new_entities_df, temp_entity_dir, entity_progress_bar, error_file_path, write_only_new, retry_errors)
+    # Keep the local full-text index in step with the newly written entities
+    update_partition_index(data_directory_path, f"{entity_type}s", stage_start)
 
 def process_entities_counts(entity_type: str, initial_core_entities: pd.DataFrame, entity_column: str, data_directory_path: str):
     """
@@ -57,7 +62,9 @@ def process_entities_counts(entity_type: str, initial_core_entities: pd.DataFram
         subset_core_entities = initial_core_entities[~initial_core_entities[entity_column].isin(error_df[entity_column])]
     else:
         subset_core_entities = initial_core_entities
+    stage_start = time.time()
     get_count_metadata(subset_core_entities, entity_type, f"{data_directory_path}/historic_data/entity_files/all_{entity_type}/", return_df)
+    update_partition_index(data_directory_path, entity_type, stage_start)
 
 if __name__ == "__main__":
     data_directory_path = get_data_directory_path()
@@ -0,0 +1,194 @@
+import os
+import sys
+import threading
+import time
+import warnings
+warnings.filterwarnings('ignore')
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional
+
+import pandas as pd
+from tqdm import tqdm
+from rich.console import Console
+
+sys.path.append("..")
+from data_generation_scripts.general_utils import *
+from data_generation_scripts.entity_schemas import join_target_schemas
+from data_generation_scripts.generate_entity_metadata import get_count_metadata
+from data_generation_scripts.generate_entity_interactions import get_entities_interactions
+from data_generation_scripts.generate_fulltext_index import update_partition_index
+
+console = Console()
+
+entity_columns = {"users": "login", "orgs": "login", "repos": "full_name"}
+
+# Default number of stages of each kind that run at once. Caps can also be set per entity type (e.g. repos), per interaction type (e.g. repo_user) or per join (e.g. repo_stargazers).
+default_concurrency_caps = {"entities": 1, "counts": 1, "interactions": 4, "discovered": 1}
+
+def build_interaction_graph(entity_interaction_df: pd.DataFrame, entity_types: List[str]) -> Dict[str, dict]:
+    """
+    Function to build the dependency graph of the collection stages from metadata_files/entity_interactions.csv. Each entity type's entities are collected first, then their counts, then each of their interaction types, and finally the entities the interactions discovered.
+
+    Args:
+    entity_interaction_df (pd.DataFrame): The dataframe of entity_interactions.csv, with one row per interaction type
+    entity_types (List[str]): The entity types to collect (users, orgs or repos)
+
+    Returns:
+    Dict[str, dict]: The stages keyed by name, each with its stage kind, entity type and the names of the stages it depends on. Discovered stages list their sources as (interaction type, url column, source entity type) tuples, so that they only read the edges of the joins that feed them.
+    """
+    graph = {}
+    for entity_type in entity_types:
+        graph[f"entities:{entity_type}"] = {"stage": "entities", "entity_type": entity_type, "depends_on": []}
+        graph[f"counts:{entity_type}"] = {"stage": "counts", "entity_type": entity_type, "depends_on": [f"entities:{entity_type}"]}
+    for _, row in entity_interaction_df.iterrows():
+        entity_type = f"{row.entity_type}s"
+        if entity_type not in entity_types:
+            continue
+        # Join directories are named after their join type, e.g. historic_data/join_files/org_repos_join_dataset
+        join_name = os.path.basename(row.file_directory.rstrip('/')).replace('_join_dataset', '')
+        target_type = join_target_schemas.get(join_name)
+        graph[f"interactions:{entity_type}:{row.url_column}"] = {
+            "stage": "interactions",
+            "entity_type": entity_type,
+            "interaction": row.to_dict(),
+            "join_name": join_name,
+            "target_type": target_type if target_type in entity_types else None,
+            "depends_on": [f"counts:{entity_type}"],
+        }
+    for entity_type in entity_types:
+        feeding_stages = [name for name, node in graph.items() if node["stage"] == "interactions" and node["target_type"] == entity_type]
+        if len(feeding_stages) > 0:
+            graph[f"discovered:{entity_type}"] = {
+                "stage": "discovered",
+                "entity_type": entity_type,
+                "sources": [(graph[name]["interaction"]["interaction_type"], graph[name]["interaction"]["url_column"], graph[name]["entity_type"]) for name in feeding_stages],
+                "depends_on": feeding_stages,
+            }
+    return graph
+
+def run_stage(node: dict, core_entities: Dict[str, pd.DataFrame], data_directory_path: str, threshold_limit: int, retry_errors: bool, refresh_policy: Optional[EntityRefreshPolicy], incremental: bool):
+    """
+    Function to run one stage of the interaction graph
+
+    Args:
+    node (dict): The stage to run, from build_interaction_graph
+    core_entities (Dict[str, pd.DataFrame]): The core entities of each entity type
+    data_directory_path (str): The path to the data directory
+    threshold_limit (int): The maximum number of interactions to collect for an entity
+    retry_errors (bool): Whether to retry errors
+    refresh_policy (Optional[EntityRefreshPolicy]): The refresh policy for counts and interactions
+    incremental (bool): Whether to only collect new interactions of time-ordered endpoints
+    """
+    entity_type = node["entity_type"]
+    entity_column = entity_columns[entity_type]
+    temp_entity_dir = os.path.join(data_directory_path, "historic_data", "entity_files", f"all_{entity_type}")
+    core_keys = core_entities[entity_type][entity_column].dropna().unique().tolist() if entity_type in core_entities else []
+    stage_start = time.time()
+    if node["stage"] in ["entities", "discovered"]:
+        if node["stage"] == "entities":
+            potential_new_entities_df = core_entities[entity_type].drop_duplicates(subset=[entity_column])
+        else:
+            # Only the entities discovered through the interactions of the core entities are collected
+            edge_store = EntityEdgeStore(data_directory_path)
+            target_keys = set()
+            for interaction_type, url_column, source_type in node["sources"]:
+                source_keys = core_entities[source_type][entity_columns[source_type]].dropna().unique().tolist()
+                edges_df = edge_store.read_edges(interaction_types=[interaction_type], url_columns=[url_column], source_keys=source_keys, columns=["target_key"])
+                target_keys.update(edges_df.target_key.dropna().astype(str))
+            # Only full names (owner/name) can be requested as repos, and only logins as users or orgs
+            target_keys = [key for key in target_keys if ("/" in key) == (entity_type == "repos")]
+            potential_new_entities_df = pd.DataFrame({entity_column: sorted(target_keys)})
+            # Edges only hold the target's login or full name, so its url is built from it. Orgs are requested through the users endpoint too.
+            url_endpoint = "repos" if entity_type == "repos" else "users"
+            potential_new_entities_df["url"] = f"https://api.github.com/{url_endpoint}/" + potential_new_entities_df[entity_column].astype(str)
+        if len(potential_new_entities_df) == 0:
+            return
+        error_file_path = os.path.join(data_directory_path, "error_logs", f"{entity_type[:-1]}_errors.csv")
+        entity_progress_bar = tqdm(total=len(potential_new_entities_df), desc=f"Processing {node['stage']} {entity_type}", leave=False)
+        # Discovered entities that were already collected are kept as they are, only new ones are requested
+        write_only_new = node["stage"] == "discovered"
+        get_new_entities(entity_type, potential_new_entities_df, temp_entity_dir, entity_progress_bar, error_file_path, write_only_new, retry_errors)
+        # Keep the local full-text index in step with the partitions this stage wrote
+        update_partition_index(data_directory_path, entity_type, stage_start)
+        return
+    if len(core_keys) == 0:
+        return
+    entities_df = read_latest_entities(data_directory_path, entity_type, core_keys)
+    if node["stage"] == "counts":
+        get_count_metadata(entities_df, entity_type, temp_entity_dir, False, refresh_policy=refresh_policy)
+        update_partition_index(data_directory_path, entity_type, stage_start)
+    else:
+        interaction = node["interaction"]
+        get_entities_interactions(entities_df, interaction["url_column"], entity_type, interaction["file_directory"], interaction["interaction_type"], threshold_limit, interaction["source"], interaction["target"], retry_errors, False, refresh_policy=refresh_policy, incremental=incremental)
+
+def run_interaction_pipeline(core_entities: Dict[str, pd.DataFrame], data_directory_path: str, threshold_limit: int = 1000, concurrency_caps: Optional[Dict[str, int]] = None, max_workers: int = 4, retry_errors: bool = False, refresh_policy: Optional[EntityRefreshPolicy] = None, incremental: bool = False) -> Dict[str, str]:
+    """
+    Function to run the collection stages of metadata_files/entity_interactions.csv as a dependency graph. Each stage starts as soon as the stages it depends on have finished, so independent interaction types run concurrently, all drawing from the shared core rate limiter.
+
+    Args:
+    core_entities (Dict[str, pd.DataFrame]): The core entities of each entity type (users, orgs or repos), e.g. from get_data_from_search_terms
+    data_directory_path (str): The path to the data directory
+    threshold_limit (int): The maximum number of interactions to collect for an entity
+    concurrency_caps (Optional[Dict[str, int]]): The maximum number of stages running at once, keyed by stage kind (entities, counts, interactions, discovered), entity type, interaction type or join name (e.g. repo_stargazers). Defaults to default_concurrency_caps.
+    max_workers (int): The maximum number of stages running at once overall
+    retry_errors (bool): Whether to retry errors
+    refresh_policy (Optional[EntityRefreshPolicy]): The refresh policy for counts and interactions
+    incremental (bool): Whether to only collect new interactions of time-ordered endpoints
+
+    Returns:
+    Dict[str, str]: The status of each stage, either ok, failed or skipped (if a stage it depends on failed)
+    """
+    entity_interaction_df = read_csv_file(os.path.join(data_directory_path, 'metadata_files', "entity_interactions.csv"))
+    graph = build_interaction_graph(entity_interaction_df, list(core_entities.keys()))
+    concurrency_caps = {**default_concurrency_caps, **(concurrency_caps or {})}
+    semaphores = {key: threading.Semaphore(cap) for key, cap in concurrency_caps.items()}
+
+    def run_capped_stage(name: str):
+        node = graph[name]
+        cap_keys = sorted(key for key in [node["stage"], node["entity_type"], node.get("interaction", {}).get("interaction_type"), node.get("join_name")] if key in semaphores)
+        # Acquire in a fixed order so that stages sharing several caps cannot block each other
+        for key in cap_keys:
+            semaphores[key].acquire()
+        try:
+            console.print(f"Starting {name}", style="bold blue")
+            run_stage(node, core_entities, data_directory_path, threshold_limit, retry_errors, refresh_policy, incremental)
+        finally:
+            for key in reversed(cap_keys):
+                semaphores[key].release()
+
+    statuses = {}
+    running = {}
+    progress_bar = tqdm(total=len(graph), desc="Running interaction pipeline")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(statuses) < len(graph):
+            for name, node in graph.items():
+                if (name in statuses) or (name in running.values()):
+                    continue
+                if any(statuses.get(dependency) in ["failed", "skipped"] for dependency in node["depends_on"]):
+                    console.print(f"Skipping {name} as a stage it depends on failed", style="bold red")
+                    statuses[name] = "skipped"
+                    progress_bar.update(1)
+                elif all(statuses.get(dependency) == "ok" for dependency in node["depends_on"]):
+                    running[executor.submit(run_capped_stage, name)] = name
+            if len(running) == 0:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    statuses[name] = "ok"
+                except Exception as e:
+                    console.print(f"Error in {name}: {e}", style="bold red")
+                    statuses[name] = "failed"
+                progress_bar.update(1)
+    progress_bar.close()
+    return statuses
+
+if __name__ == "__main__":
+    data_directory_path = get_data_directory_path()
+    target_terms: list = ["Digital Humanities"]
+    initial_core_users, initial_core_orgs, initial_core_repos = get_data_from_search_terms(target_terms=target_terms, data_directory_path=data_directory_path, return_search_queries=False)
+    core_entities = {"users": initial_core_users, "orgs": initial_core_orgs, "repos": initial_core_repos}
+    statuses = run_interaction_pipeline(core_entities, data_directory_path, concurrency_caps={"repo_stargazers": 1}, refresh_policy=EntityRefreshPolicy(), incremental=True)
+    console.print(statuses)
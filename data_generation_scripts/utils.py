@@ -2,10 +2,13 @@
 import os
 import re
 import time
-import ast
+import threading
 import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from datetime import datetime, timedelta
-from typing import List, Optional, Union
+from typing import Any, Callable, Iterable, List, Optional, Union
 
 # Related third-party imports
 import altair as alt
@@ -18,6 +21,8 @@ from tqdm import tqdm
 
 # Local application/library specific imports
 import vl_convert as vlc
+from data_generation_scripts.entity_storage import EntitySnapshotStore, EntityStatusStore, EntityRefreshPolicy, EntityEdgeStore, EntityBatchWriter, EntityLocator, compute_payload_hash, get_interaction_stage, read_latest_entities, iter_latest_entities, iter_record_chunks
+from data_generation_scripts.entity_schemas import apply_schema, format_schema_for_csv, has_schema
 
 # Filter warnings
 warnings.filterwarnings('ignore')
@@ -29,6 +34,39 @@ auth_headers = {'Authorization': f'token {auth_token}','User-Agent': 'request'}
 
 console = Console()
 
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces out requests so that no more than `max_calls` are made in any rolling window of `period` seconds. Shared instances let concurrent workers draw from the same GitHub rate limit bucket.
+
+    :param max_calls: Maximum number of calls allowed in each window.
+    :param period: Length of the window in seconds.
+    """
+    def __init__(self, max_calls: int, period: float = 60.0):
+        self.max_calls = max_calls
+        self.period = period
+        self.call_times = deque()
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        """
+        Blocks until a call can be made without exceeding the limit, then records the call.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.call_times and now - self.call_times[0] >= self.period:
+                    self.call_times.popleft()
+                if len(self.call_times) < self.max_calls:
+                    self.call_times.append(now)
+                    return
+                sleep_for = self.period - (now - self.call_times[0])
+            time.sleep(sleep_for)
+
+# The search API allows 30 requests per minute https://docs.github.com/en/rest/search/search#rate-limit
+search_rate_limiter = RateLimiter(30, 60.0)
+# The core API allows 5000 requests per hour for authenticated users https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api
+core_rate_limiter = RateLimiter(5000, 3600.0)
+
 def set_data_directory_path(path: str) -> None:
     """
     Sets data directory path.
@@ -63,7 +101,7 @@ def check_rate_limit() -> pd.DataFrame:
     rates_df = pd.json_normalize(response.json())
     return rates_df
 
-def make_request_with_rate_limiting(url: str, auth_headers: dict, number_of_attempts: int = 3, timeout: int = 10) -> requests.Response:
+def make_request_with_rate_limiting(url: str, auth_headers: dict, number_of_attempts: int = 3, timeout: int = 10, rate_limiter: Optional[RateLimiter] = None) -> requests.Response:
     """
     Makes a GET request to the specified URL with handling for rate limiting. If the request encounters rate limiting, 
     it will attempt to retry the request a specified number of times before giving up. The function also adheres to 
@@ -73,10 +111,13 @@ def make_request_with_rate_limiting(url: str, auth_headers: dict, number_of_atte
     :param auth_headers: Dictionary containing authentication headers for the request.
     :param number_of_attempts: Integer specifying the maximum number of attempts for the request. Defaults to 3.
     :param timeout: Integer specifying the timeout in seconds to wait for a response from the server. Defaults to 10.
+    :param rate_limiter: Limiter every attempt waits on, so that concurrent workers share one rate limit bucket. Defaults to core_rate_limiter.
     :return: The response object from the requests library representing the outcome of the GET request.
     """
     # Set range for number of attempts
+    rate_limiter = core_rate_limiter if rate_limiter is None else rate_limiter
     for index in range(number_of_attempts):
+        rate_limiter.wait()
         response = requests.get(url, headers=auth_headers, timeout=timeout)
         console.print("Status code", response.status_code)
         # Check if response is valid and return it if it is
@@ -106,19 +147,20 @@ def make_request_with_rate_limiting(url: str, auth_headers: dict, number_of_atte
     console.print(f'Query failed after {number_of_attempts} attempts with code {response.status_code}. Failing URL: {url}. Error from make_request_with_rate_limiting function', style='bold red')
     return None, response.status_code
 
-def check_total_pages(url: str, auth_headers: dict) -> int:
+def check_total_pages(url: str, auth_headers: dict, rate_limiter: Optional[RateLimiter] = None) -> int:
     """
     Checks total number of pages for a given url on the GitHub API.
 
     :param url: URL to check
     :param auth_headers: Authentication headers
+    :param rate_limiter: Limiter the request waits on. Defaults to core_rate_limiter, so search urls should pass search_rate_limiter.
     :return: Total number of pages. If there are no links or response is None, returns 1.
     """
     
     finalized_url = f'{url}&per_page=1' if "?state=all" in url else f'{url}?per_page=1'
 
     # Get total number of pages
-    response, _ = make_request_with_rate_limiting(finalized_url, auth_headers)
+    response, _ = make_request_with_rate_limiting(finalized_url, auth_headers, rate_limiter=rate_limiter)
     # If response is None or there are no links, return 1
     if response is None or len(response.links) == 0:
         return 0
@@ -126,16 +168,31 @@ def check_total_pages(url: str, auth_headers: dict) -> int:
     match = re.search(r'\d+$', response.links['last']['url'])
     return int(match.group()) if match is not None else 0
 
-def check_total_results(url: str, auth_headers: dict) -> Optional[int]:
+def estimate_total_results(response: requests.Response, page_rows: int, per_page: int = 100) -> int:
+    """
+    Estimates the total number of results of a paginated url from the Link header of its first page, so a count can be recorded without a separate per_page=1 request.
+
+    :param response: Response for the first page
+    :param page_rows: Number of rows on the first page
+    :param per_page: Number of results requested per page
+    :return: Number of rows on the first page if there is no last page, otherwise the last page number times per_page, which is at most per_page - 1 over the exact total.
+    """
+    if 'last' not in response.links:
+        return page_rows
+    match = re.search(r'[?&]page=(\d+)', response.links['last']['url'])
+    return int(match.group(1)) * per_page if match is not None else page_rows
+
+def check_total_results(url: str, auth_headers: dict, rate_limiter: Optional[RateLimiter] = None) -> Optional[int]:
     """
     Checks total number of results for a given url on the GitHub API.
     
     :param url: URL to check
     :param auth_headers: Authentication headers
+    :param rate_limiter: Limiter the request waits on. Defaults to core_rate_limiter, so search urls should pass search_rate_limiter.
     :return: Total number of results. If response is None, returns None.
     """
     # Get total number of results
-    response, _ = make_request_with_rate_limiting(url, auth_headers)
+    response, _ = make_request_with_rate_limiting(url, auth_headers, rate_limiter=rate_limiter)
     # If response is None, return None
     if response is None:
         data = {'total_count': None}
@@ -144,7 +201,7 @@ def check_total_results(url: str, auth_headers: dict) -> Optional[int]:
     # Return total count
     return data.get('total_count')
         
-def read_csv_file(file_name: str, directory: Optional[str] = None, encoding: Optional[str] = 'utf-8', error_bad_lines: Optional[bool] = False) -> Optional[pd.DataFrame]:
+def read_csv_file(file_name: str, directory: Optional[str] = None, encoding: Optional[str] = 'utf-8', error_bad_lines: Optional[bool] = False, usecols: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
     """
     Reads a CSV file into a pandas DataFrame. This function allows specification of the directory, encoding, 
     and handling of bad lines in the CSV file. If the file cannot be read, the function returns None.
@@ -153,12 +210,16 @@ def read_csv_file(file_name: str, directory: Optional[str] = None, encoding: Opt
     :param directory: Optional string specifying the directory where the file is located. If None, it is assumed the file is in the current working directory.
     :param encoding: Optional string specifying the encoding used in the CSV file. Defaults to 'utf-8'.
     :param error_bad_lines: Optional boolean indicating whether to skip bad lines in the CSV. If False, an error is raised for bad lines. Defaults to False.
+    :param usecols: Optional list of columns to read. Columns missing from the file are ignored. If None, every column is read.
     :return: A pandas DataFrame containing the data from the CSV file, or None if the file cannot be read.
     """
     # Read in the file
     file_path = file_name if directory is None else os.path.join(directory, file_name)
     try:
         # Return the dataframe
+        if usecols is not None:
+            projected_columns = set(usecols)
+            return pd.read_csv(file_path, low_memory=False, encoding=encoding, error_bad_lines=error_bad_lines, usecols=lambda column: column in projected_columns)
         return pd.read_csv(file_path, low_memory=False, encoding=encoding, error_bad_lines=error_bad_lines)
     # If there's a Pandas error, print it and return None
     except pd.errors.EmptyDataError:
@@ -169,16 +230,20 @@ def read_csv_file(file_name: str, directory: Optional[str] = None, encoding: Opt
         console.print(f'Failed to read {file_name} with {encoding} encoding. Error: {e}', style='bold red')
         return None
     
-def read_combine_files(dir_path: str, files: Optional[List] = None, file_path: Optional[str] = None, grouped_columns: Optional[List] = [] , return_all: bool = False) -> pd.DataFrame:
+def read_combine_files(dir_path: str, files: Optional[List] = None, file_path: Optional[str] = None, grouped_columns: Optional[List] = [] , return_all: bool = False, schema_name: Optional[str] = None, usecols: Optional[List[str]] = None, max_workers: Optional[int] = None) -> pd.DataFrame:
     """
     Reads all CSV files in a directory, combines them into a single DataFrame, and writes the result to a file. Items are organized by most recent coding_dh_date.
-    If return_all is False, only the most recent entry for each group (defined by grouped_columns) is kept.
+    If return_all is False, only the most recent entry for each group (defined by grouped_columns) is kept. For entity directories, or if no grouped_columns are given, only the most recent entry of each file is kept.
+    Files are read concurrently in a thread pool, only reading the projected columns, and the dates are parsed and the latest entries picked once over the combined DataFrame rather than file by file.
     
     Parameters:
     dir_path (str): The path to the directory containing the CSV files.
     file_path (str): The path to the file where the combined DataFrame will be written.
     grouped_columns (list, optional): The columns to group by when return_all is False. Defaults to None.
     return_all (bool, optional): Whether to return all rows or only the most recent for each group. Defaults to False.
+    schema_name (str, optional): Name of the entity, search or join schema to apply to the combined DataFrame. Defaults to None.
+    usecols (list, optional): Columns to read from each file. coding_dh_date and the grouped columns are always read when return_all is False. Defaults to None, which reads every column.
+    max_workers (int, optional): Number of threads used to read the files. Defaults to None, which lets the executor pick.
     
     Returns:
     pd.DataFrame: The combined DataFrame.
@@ -187,45 +252,56 @@ def read_combine_files(dir_path: str, files: Optional[List] = None, file_path: O
     # Remove the output file if it already exists
     if files is None:
         files = os.listdir(dir_path)
+    # Skip .DS_Store files
+    for file in [file for file in files if '.DS_Store' in file]:
+        os.remove(os.path.join(dir_path, file))
+    files = [file for file in files if '.DS_Store' not in file]
+
+    group_by_file = ('entity' in dir_path) or (len(grouped_columns) == 0)
+    if usecols is not None and not return_all:
+        usecols = list(usecols) + ['coding_dh_date'] + ([] if group_by_file else list(grouped_columns))
     
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        file_dfs = list(tqdm(executor.map(lambda file: read_csv_file(os.path.join(dir_path, file), usecols=usecols), files), total=len(files), desc=f"Reading files in {dir_path}"))
+
     dfs = []
-    for file in tqdm(files, desc=f"Reading files in {dir_path}"):
-        # Skip .DS_Store files
-        if '.DS_Store' in file:
-            os.remove(os.path.join(dir_path, file))
+    for file_index, df in enumerate(file_dfs):
+        if df is None:
             continue
-        df = read_csv_file(os.path.join(dir_path, file))
-        
-        if df is not None:
-            try:
-                if not return_all:
-                    df['coding_dh_date'] = pd.to_datetime(df['coding_dh_date'], errors='coerce')
-                    df = df.sort_values(by="coding_dh_date", ascending=False)
-                    # get the latest date
-                    if ('entity' not in dir_path) and (len(grouped_columns) > 0):
-                        df = df.groupby(grouped_columns).first().reset_index()
-                    else:
-                        df = df[0:1]
-                    
-                if file_path is not None and os.path.exists(file_path):
-                    # Write DataFrame to file
-                    mode = "a" if os.path.exists(file_path) else "w"
-                    df.to_csv(file_path, mode=mode, header=(mode=="w"), index=False)
-                else:
-                    dfs.append(df)
-            except:
-                console.print(f"Error with file {file}", style="bold red")
-                continue
-    
+        if not return_all:
+            # Tag rows with their file so the latest entries are still picked per file
+            df['coding_dh_file_index'] = file_index
+        dfs.append(df)
+    combined_df = pd.concat(dfs, ignore_index=True) if len(dfs) > 0 else pd.DataFrame()
+
+    if not return_all and not combined_df.empty:
+        try:
+            combined_df['coding_dh_date'] = pd.to_datetime(combined_df['coding_dh_date'], errors='coerce')
+            latest_columns = ['coding_dh_file_index'] + ([] if group_by_file else list(grouped_columns))
+            combined_df = combined_df.sort_values(by="coding_dh_date", ascending=False, kind='mergesort')
+            # get the latest date
+            if group_by_file:
+                combined_df = combined_df.drop_duplicates(subset=latest_columns, keep='first')
+                combined_df = combined_df.sort_values(by=latest_columns, kind='mergesort').reset_index(drop=True)
+            else:
+                # Keep the first non-null value of each column within a group, dropping rows with null group keys, as the per-file groupby did
+                combined_df = combined_df.groupby(latest_columns).first().reset_index()
+        except KeyError as e:
+            console.print(f"Error with files in {dir_path}: missing column {e}", style="bold red")
+    combined_df = combined_df.drop(columns=['coding_dh_file_index'], errors='ignore')
+
     if file_path is not None and os.path.exists(file_path):
+        # Write DataFrame to file
+        combined_df.to_csv(file_path, mode="a", header=False, index=False)
         combined_df = read_csv_file(file_path)
-    else:
-        combined_df = pd.concat(dfs)
+    if schema_name is not None and combined_df is not None:
+        combined_df = apply_schema(combined_df, schema_name)
     return combined_df
 
+@lru_cache(maxsize=None)
 def get_headers(entity_type: str) -> pd.DataFrame:
     """
-    Gets headers for entity type.
+    Gets headers for entity type. Headers are read from disk once per entity type and cached, so callers should not modify the returned dataframe.
 
     :param entity_type: Type of entity
     :return: Headers dataframe
@@ -244,41 +320,99 @@ def get_headers(entity_type: str) -> pd.DataFrame:
         return None
     return headers
 
-def sort_groups_add_coding_dh_id(group: pd.DataFrame, subset_columns: List[str]) -> pd.DataFrame:
+def map_distinct_values(series: pd.Series, func: Callable[[Any], Any]) -> pd.Series:
     """
-    Sorts a DataFrame group based on 'coding_dh_date' and adds a new column 'coding_dh_id' with unique identifiers.
-    If the group has more than one unique row (excluding subset_columns), each row gets a unique identifier.
-    If the group has only one unique row (excluding subset_columns), it gets the identifier 0.
+    Applies a function to each distinct value of a Series rather than to every cell, then maps the results back with a single vectorized take. Columns like search terms or natural languages repeat a handful of values across many rows, so this is much faster than `apply`.
+
+    :param series: Series to transform.
+    :param func: Function to apply to each distinct non-null value.
+    :return: Series with the transformed values. Null values are left as NaN.
+    """
+    codes, uniques = pd.factorize(series)
+    mapped_uniques = np.array([func(value) for value in uniques] + [np.nan], dtype=object)
+    # Null values have a code of -1, which takes the trailing NaN
+    return pd.Series(mapped_uniques[codes], index=series.index, name=series.name)
+
+def find_list_like_cells(series: pd.Series) -> pd.Series:
+    """
+    Finds the cells of a Series that hold a list, either as a list object or as the string representation of one (e.g. "['tei', 'xml']").
+
+    :param series: Series to check.
+    :return: Boolean Series that is True for list-like cells.
+    """
+    if series.dtype != object:
+        return pd.Series(False, index=series.index)
+    try:
+        is_list_string = series.str.startswith('[', na=False) & series.str.endswith(']', na=False)
+    except AttributeError:
+        # The .str accessor is unavailable for object columns without any strings
+        is_list_string = pd.Series(False, index=series.index)
+    return is_list_string | series.map(type).eq(list)
+
+def add_coding_dh_ids(df: pd.DataFrame, grouped_columns: List[str], subset_columns: List[str]) -> pd.DataFrame:
+    """
+    Deduplicates a DataFrame within each group of `grouped_columns` and adds a 'coding_dh_id' column numbering the remaining rows of each group by 'coding_dh_date'.
+    Gives the same rows as running `df.groupby(grouped_columns)` and the old per-group `sort_groups_add_coding_dh_id` loop, but in a handful of frame-level operations:
+    list-like columns are found once for the whole frame, each row gets a content hash over the columns outside subset_columns, and the identifiers come from a single groupby-cumcount.
 
     Parameters:
-    group (pd.DataFrame): DataFrame group to sort and add identifiers to.
+    df (pd.DataFrame): DataFrame to deduplicate and add identifiers to.
+    grouped_columns (List[str]): Columns identifying each group. If empty, the whole DataFrame is treated as one group.
     subset_columns (List[str]): List of column names to exclude when checking for unique rows.
 
     Returns:
-    pd.DataFrame: The sorted DataFrame group with the new 'coding_dh_id' column.
+    pd.DataFrame: The deduplicated DataFrame, sorted by group and 'coding_dh_date', with the new 'coding_dh_id' column.
     """
-    # Convert strings that represent lists into actual lists
-    for col in group.columns:
-        group[col] = group[col].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) and x.startswith('[') and x.endswith(']') else x)
+    df = df.reset_index(drop=True)
+    if len(grouped_columns) > 0:
+        # Grouping drops rows with null keys
+        df = df[df[grouped_columns].notna().all(axis=1)].reset_index(drop=True)
+    group_keys = [df[col] for col in grouped_columns]
+
+    # List columns are excluded from the duplicate check and dropped from the output for every group in which they hold a list
+    list_cols = []
+    for col in df.columns.difference(subset_columns):
+        list_cells = find_list_like_cells(df[col])
+        if not list_cells.any():
+            continue
+        list_groups = list_cells.groupby(group_keys).transform('any') if len(group_keys) > 0 else pd.Series(True, index=df.index)
+        if list_groups.all():
+            list_cols.append(col)
+        else:
+            df.loc[list_groups, col] = np.nan
+    df = df.drop(columns=list_cols)
 
-    # Handle list columns and convert them to sorted comma-separated strings
-    list_cols = [col for col in group.columns if group[col].apply(lambda x: isinstance(x, list)).any()]
-    for col in list_cols:
-        group[col] = group[col].apply(lambda x: ', '.join(sorted(map(str, x))) if isinstance(x, list) else x)
+    content_columns = df.columns.difference(subset_columns).tolist()
+    df['coding_dh_content_hash'] = pd.util.hash_pandas_object(df[content_columns], index=False).values
 
-    subset_columns = list(set(subset_columns + list_cols))
+    # Sort by group and then by 'coding_dh_date' in ascending order, keeping the first of each set of duplicates
+    final_df = df.sort_values(by=grouped_columns + ['coding_dh_date'], kind='mergesort')
+    final_df = final_df.drop_duplicates(subset=grouped_columns + ['coding_dh_content_hash'], keep='first')
 
-    # Sort the DataFrame by 'coding_dh_date' in ascending order
-    sorted_group = group.sort_values(by='coding_dh_date')
+    # Assign unique identifiers
+    if len(grouped_columns) > 0:
+        final_df['coding_dh_id'] = final_df.groupby(grouped_columns, sort=False).cumcount()
+    else:
+        final_df['coding_dh_id'] = np.arange(len(final_df))
+    final_df = final_df.drop(columns=['coding_dh_content_hash'])
 
-    # Drop duplicates across all columns, excluding subset_columns
-    final_group = sorted_group.drop_duplicates(subset=sorted_group.columns.difference(subset_columns), keep='first')
+    return final_df.reset_index(drop=True)
 
-    # Assign unique identifiers
-    final_group['coding_dh_id'] = np.arange(len(final_group))
-    final_group = final_group.drop(columns=list_cols)
+def sort_groups_add_coding_dh_id(group: pd.DataFrame, subset_columns: List[str]) -> pd.DataFrame:
+    """
+    Sorts a DataFrame group based on 'coding_dh_date' and adds a new column 'coding_dh_id' with unique identifiers.
+    If the group has more than one unique row (excluding subset_columns), each row gets a unique identifier.
+    If the group has only one unique row (excluding subset_columns), it gets the identifier 0.
+    Prefer calling `add_coding_dh_ids` on the whole DataFrame rather than looping over groups.
 
-    return final_group
+    Parameters:
+    group (pd.DataFrame): DataFrame group to sort and add identifiers to.
+    subset_columns (List[str]): List of column names to exclude when checking for unique rows.
+
+    Returns:
+    pd.DataFrame: The sorted DataFrame group with the new 'coding_dh_id' column.
+    """
+    return add_coding_dh_ids(group, [], subset_columns)
 
 def check_headers_exist(df: pd.DataFrame, headers: pd.DataFrame) -> pd.DataFrame:
     """
@@ -288,10 +422,10 @@ def check_headers_exist(df: pd.DataFrame, headers: pd.DataFrame) -> pd.DataFrame
     :param headers: Headers dataframe
     :return: Dataframe with headers
     """
-    # Check if each column in headers exists in the response data
-    for column in headers.columns:
-        if column not in df.columns:
-            df[column] = None  # If not, assign None
+    # Add all the missing columns at once rather than one at a time
+    missing_columns = [column for column in headers.columns if column not in df.columns]
+    if len(missing_columns) > 0:
+        df = df.reindex(columns=list(df.columns) + missing_columns)
     return df
 
 def drop_columns_from_df(df: pd.DataFrame, columns: List) -> pd.DataFrame:
@@ -334,17 +468,18 @@ def log_error_to_file(error_file_path: str, additional_data: dict, status_code:
     else:
         error_df.to_csv(error_file_path, index=False)
 
-def get_new_entities(entity_type:str, potential_new_entities_df: pd.DataFrame, temp_entity_dir: str, entity_progress_bar: tqdm, error_file_path: str, write_only_new: bool, retry_errors: bool = False):
+def get_new_entities(entity_type:str, potential_new_entities: Union[pd.DataFrame, Iterable[Any]], temp_entity_dir: str, entity_progress_bar: tqdm, error_file_path: str, write_only_new: bool, retry_errors: bool = False, chunk_size: int = 1000):
     """
-    Gets new entities from GitHub API. 
+    Gets new entities from GitHub API. Candidates are streamed in chunks of lightweight records, and new and changed entities are buffered and written in batches to the entity partitions rather than to one CSV per entity, so memory stays flat however many entities are processed.
 
     :param entity_type: Type of entity
-    :param potential_new_entities_df: Potential new entities dataframe
-    :param temp_entity_dir: Temporary entity directory
+    :param potential_new_entities: Potential new entities, as a dataframe or any iterable of dicts, named tuples, dataframes or Arrow record batches (e.g. from iter_latest_entities)
+    :param temp_entity_dir: Directory of the legacy one-CSV-per-entity files. Whether an entity was already collected is looked up in the entity locator, which also indexes these files.
     :param entity_progress_bar: Entity progress bar
     :param error_file_path: Path to error file
     :param write_only_new: Boolean indicating whether to write only new entities
     :param retry_errors: Boolean indicating whether to retry errors
+    :param chunk_size: Number of candidates looked up and processed at a time
     """
     data_directory_path = get_data_directory_path()
     # Create temporary directory if it doesn't exist
@@ -404,116 +539,153 @@ def get_new_entities(entity_type:str, potential_new_entities_df: pd.DataFrame, t
     entity_column = "full_name" if entity_type == "repos" else "login"
     entity_type_singular = entity_type[:-1]
 
-    if os.path.exists(error_file_path):
-        drop_fields = [entity_column, 'error_url']
-        clean_write_error_file(error_file_path, drop_fields)
-        if retry_errors == False:
-            error_df = read_csv_file(error_file_path)
-            potential_new_entities_df = potential_new_entities_df[~potential_new_entities_df[entity_column].isin(error_df[entity_column])]
-            if potential_new_entities_df.empty:
-                console.print(f"No new entities to process for {entity_type}", style="bold blue")
-                return
-
-    if os.path.exists(excluded_file_path):
-        excluded_entities = read_csv_file(excluded_file_path)
-        # Exclude entities and check for errors
-        potential_new_entities_df = potential_new_entities_df[~potential_new_entities_df[entity_column].isin(excluded_entities[entity_column])]
+    status_store = EntityStatusStore(data_directory_path)
+    status_store.import_legacy_files("entities", entity_type, entity_column, error_file_path=error_file_path, excluded_file_path=excluded_file_path)
 
     # Get headers
     headers = get_headers(entity_type)
+    if entity_type == "repos":
+        exclude_headers = repo_exclude_headers
+    elif entity_type == "orgs":
+        exclude_headers = org_exclude_headers
+    else:
+        exclude_headers = user_exclude_headers
+    snapshot_store = EntitySnapshotStore(data_directory_path, entity_type)
+    locator = EntityLocator(data_directory_path)
+    locator.backfill(entity_type)
+    seen_keys = set()
+    seen_ids = set()
+    processed_ids = set()
+    entity_writer = EntityBatchWriter(data_directory_path, entity_type, snapshot_store=snapshot_store, locator=locator)
 
     # Update progress bar
-    entity_progress_bar.total = len(potential_new_entities_df)
+    entity_progress_bar.total = len(potential_new_entities) if hasattr(potential_new_entities, "__len__") else None
     entity_progress_bar.refresh()
     columns_to_drop = ['org_query_time', 'user_query_time', 'repo_query_time', 'search_query_time', 'coding_dh_id']
-
-    # Loop through potential new entities
-    for _, row in potential_new_entities_df.iterrows():
-        try:
-            # Create temporary file path
-            temp_entities_file_name = f"{row[entity_column].replace('/', '_').replace(' ', '_')}_coding_dh_{entity_type_singular}.csv"
-            console.print(temp_entities_file_name)
-            # Check if file exists
-            temp_file_path = os.path.join(temp_entity_dir, temp_entities_file_name)
-            if os.path.exists(temp_file_path):
-                existing_temp_entities_df = read_csv_file(temp_file_path)
-                existing_temp_entities_df = drop_columns_from_df(existing_temp_entities_df, columns_to_drop)
-                if write_only_new:
+    org_executor = ThreadPoolExecutor(max_workers=2) if entity_type == "orgs" else None
+
+    # Stream the potential new entities in chunks, so the status, alias and location lookups are made once per chunk
+    for chunk in iter_record_chunks(potential_new_entities, chunk_size):
+        chunk = [row for row in chunk if pd.notna(row.get(entity_column))]
+        chunk_keys = list({row[entity_column] for row in chunk})
+        # Leave out excluded entities and errored entities that are not due for a retry
+        blocked_keys = status_store.get_blocked_keys("entities", entity_type, chunk_keys, retry_errors)
+        entity_progress_bar.update(sum(row[entity_column] in blocked_keys for row in chunk))
+        chunk = [row for row in chunk if row[entity_column] not in blocked_keys]
+        # Resolve renamed entities to their current name and look up which entities were already collected
+        aliases = locator.resolve_aliases(entity_type, chunk_keys)
+        chunk_ids = [int(row_id) for row_id in pd.to_numeric(pd.Series([row.get("id") for row in chunk], dtype=object), errors="coerce").dropna()]
+        located_df = locator.locate(entity_type, entity_keys=chunk_keys + list(aliases.values()), entity_ids=chunk_ids)
+        located_keys = set(located_df.entity_key)
+        located_ids = set(located_df.entity_id.dropna().astype(int))
+        ok_keys = []
+
+        # Loop through potential new entities
+        for row in chunk:
+            # Reset per row so the error handler never sees values left over from the previous row, or unbound ones
+            status_code = None
+            query = row.get("url")
+            try:
+                console.print(f"Processing {row[entity_column]}")
+                # Skip rows that point at an entity already seen under another name or with the same GitHub id
+                canonical_key = aliases.get(row[entity_column], row[entity_column])
+                row_id = pd.to_numeric(row.get("id"), errors="coerce")
+                row_id = int(row_id) if pd.notna(row_id) else None
+                if (canonical_key in seen_keys) or (row_id is not None and row_id in seen_ids):
                     entity_progress_bar.update(1)
                     continue
-            else:
-                existing_temp_entities_df = pd.DataFrame()
-            # Get query
-            query = row.url
-            if entity_type == "orgs":
-                query = row.url if "/users/" in row.url else row.url.replace("/orgs/", "/users/")
-            # Make request
-            response, status_code = make_request_with_rate_limiting(query, auth_headers)
-            # If response is None, update progress bar and continue
-            if response is None and entity_type != "orgs":
-                entity_progress_bar.update(1)
-                additional_data = {entity_column: row[entity_column]}
-                log_error_to_file(error_file_path, additional_data, status_code, query)
-                continue
-            # If response is None and entity type is orgs, create empty dataframe
-            elif response is None and entity_type == "orgs":
-                response_df = pd.DataFrame(columns=headers.columns, data=None, index=None)
-            else:
-                response_data = response.json()
-                response_df = pd.json_normalize(response_data)
-                if "message" in response_df.columns:
-                    console.print(f"Error for {row[entity_column]}: {response_df.message.values[0]}", style="bold red")
+                seen_keys.add(canonical_key)
+                if row_id is not None:
+                    seen_ids.add(row_id)
+                # Check if the entity has already been collected, under its current name, an alias or its GitHub id
+                entity_exists = (canonical_key in snapshot_store.stored_keys) or (canonical_key in located_keys) or (row_id in located_ids)
+                if entity_exists and write_only_new:
+                    entity_progress_bar.update(1)
+                    continue
+                # Get query
+                query = row.url
+                if entity_type == "orgs":
+                    # Request the user and org payloads of the org at the same time
+                    query = row.url if "/users/" in row.url else row.url.replace("/orgs/", "/users/")
+                    org_query = row.url.replace("/users/", "/orgs/") if "/users/" in row.url else row.url
+                    user_future = org_executor.submit(make_request_with_rate_limiting, query, auth_headers)
+                    org_future = org_executor.submit(make_request_with_rate_limiting, org_query, auth_headers)
+                    response, status_code = user_future.result()
+                    org_response, _ = org_future.result()
+                else:
+                    # Make request
+                    response, status_code = make_request_with_rate_limiting(query, auth_headers)
+                org_data = {}
+                if entity_type == "orgs" and org_response is not None:
+                    org_data = org_response.json()
+                    if not isinstance(org_data, dict) or "message" in org_data:
+                        org_data = {}
+                # If response is None, update progress bar and continue. Orgs whose /users request failed are still stored from their /orgs payload.
+                if response is None and len(org_data) == 0:
+                    entity_progress_bar.update(1)
                     additional_data = {entity_column: row[entity_column]}
                     log_error_to_file(error_file_path, additional_data, status_code, query)
+                    status_store.mark("entities", entity_type, row[entity_column], "error", status_code, query)
+                    continue
+                response_data = response.json() if response is not None else {}
+                if isinstance(response_data, dict) and "message" in response_data:
+                    console.print(f"Error for {row[entity_column]}: {response_data['message']}", style="bold red")
+                    additional_data = {entity_column: row[entity_column]}
+                    log_error_to_file(error_file_path, additional_data, status_code, query)
+                    status_store.mark("entities", entity_type, row[entity_column], "error", status_code, query)
                     entity_progress_bar.update(1)
                     continue
+                # Record renamed users and transferred repos, which the API serves through a 301 redirect to the current name
+                served_key = response_data.get(entity_column) if isinstance(response_data, dict) else None
+                if served_key is not None and (len(response.history) > 0 or served_key != row[entity_column]):
+                    locator.record_alias(entity_type, row[entity_column], response_data.get("id"), served_key)
+                    console.print(f"{row[entity_column]} is now {served_key}", style="bold blue")
             
-            if entity_type != "orgs":
-                final_df = check_headers_exist(response_df, headers)
-                final_df = final_df[headers.columns]
-            else:
-                response_df = response_df[user_cols]
-                query = row.url.replace("/users/", "/orgs/") if "/users/" in row.url else row.url
-                response, _ = make_request_with_rate_limiting(query, auth_headers)
-                if response is None:
-                    expanded_df = pd.DataFrame(columns=headers.columns, data=None, index=None)
+                if entity_type != "orgs":
+                    final_df = check_headers_exist(pd.json_normalize(response_data), headers)
+                    final_df = final_df[headers.columns]
                 else:
-                    response_data = response.json()
-                    expanded_df = pd.json_normalize(response_data)
-                    expanded_df = check_headers_exist(expanded_df, headers)            
-                    expanded_df = expanded_df[headers.columns]
-             
-                common_columns = list(set(response_df.columns).intersection(set(expanded_df.columns)))
-                final_df = pd.merge(response_df, expanded_df, on=common_columns, how='left')
+                    # Merge the two payloads before projecting, with the user fields taking precedence over the org fields
+                    user_data = response_data if response is not None else org_data
+                    merged_data = {**org_data, **{col: user_data.get(col) for col in user_cols}}
+                    final_df = check_headers_exist(pd.json_normalize(merged_data), headers)
+                    final_df = final_df[list(dict.fromkeys(user_cols + list(headers.columns)))]
                 
-            final_df["coding_dh_date"] = datetime.now().strftime("%Y-%m-%d")
-            combined_df = pd.concat([existing_temp_entities_df, final_df])
-            grouped_dfs = combined_df.groupby(entity_column)
-            processed_files = []
-            for _, group in tqdm(grouped_dfs, desc=f"Grouping files"):
-                subset_columns = ["coding_dh_date"]
-                group = sort_groups_add_coding_dh_id(group, subset_columns)
-                processed_files.append(group)
-            final_processed_df = pd.concat(processed_files).reset_index(drop=True)
-            console.print("Length final_df", len(final_processed_df))
-            if entity_type == "repos":
-                final_processed_df = drop_columns_from_df(final_processed_df, repo_exclude_headers)
-            elif entity_type == "orgs":
-                final_processed_df = drop_columns_from_df(final_processed_df, org_exclude_headers)
-            else:
-                final_processed_df = drop_columns_from_df(final_processed_df, user_exclude_headers)
-
-            final_processed_df.to_csv(temp_file_path, index=False)
-            entity_progress_bar.update(1)
-        except Exception as e:
-            console.print(f"Error for {row[entity_column]}: {e}", style="bold red")
-            additional_data = {entity_column: row[entity_column]}
-            log_error_to_file(error_file_path, additional_data, status_code, query)
-            entity_progress_bar.update(1)
-            continue
+                coding_dh_date = datetime.now().strftime("%Y-%m-%d")
+                final_df["coding_dh_date"] = coding_dh_date
+                final_df = drop_columns_from_df(final_df, exclude_headers + columns_to_drop)
+                # Only write a new version when the projected payload has changed since the last stored version
+                entity_id = final_df["id"].values[0] if ("id" in final_df.columns) and pd.notna(final_df["id"].values[0]) else row[entity_column]
+                if entity_id in processed_ids:
+                    console.print(f"Skipping {row[entity_column]} as it was already collected under another name", style="bold blue")
+                    entity_progress_bar.update(1)
+                    continue
+                processed_ids.add(entity_id)
+                # A renamed entity may only be located under its GitHub id
+                numeric_entity_id = pd.to_numeric(entity_id, errors="coerce")
+                entity_exists = entity_exists or (pd.notna(numeric_entity_id) and int(numeric_entity_id) in located_ids)
+                payload_hash = compute_payload_hash(final_df)
+                if entity_exists and not snapshot_store.has_changed(entity_id, payload_hash):
+                    snapshot_store.record_observation(entity_id, payload_hash, coding_dh_date)
+                    ok_keys.append(row[entity_column])
+                    entity_progress_bar.update(1)
+                    continue
+                entity_writer.add(final_df, entity_id, payload_hash)
+                ok_keys.append(row[entity_column])
+                entity_progress_bar.update(1)
+            except Exception as e:
+                console.print(f"Error for {row[entity_column]}: {e}", style="bold red")
+                additional_data = {entity_column: row[entity_column]}
+                log_error_to_file(error_file_path, additional_data, status_code, query)
+                status_store.mark("entities", entity_type, row[entity_column], "error", status_code, str(e))
+                entity_progress_bar.update(1)
+                continue
+        status_store.mark("entities", entity_type, ok_keys, "ok")
 
-    # Read in all temporary files
-    # combined_entity_df = read_combine_files(temp_entity_dir)
+    # Write whatever is left in the buffer
+    entity_writer.flush()
+    if org_executor is not None:
+        org_executor.shutdown()
     entity_progress_bar.close()
     # return combined_entity_df
 
@@ -526,24 +698,30 @@ def create_queries_directories(entity_type: str, cleaned_terms: pd.DataFrame) ->
     :return: Search Queries dataframe
     """
     data_directory_path = get_data_directory_path()
+    searched_dir = os.path.join(data_directory_path, f"searched_{entity_type}_data")
+    # Group the cleaned terms once so each search file is matched with a dictionary lookup
+    grouped_cleaned_terms = {search_key: group for search_key, group in cleaned_terms.groupby(["search_term_source", "search_term"])}
     queries = []
-    for _, subdir, _ in tqdm(os.walk(data_directory_path + f"/searched_{entity_type}_data"), desc="Walking through directories"):
-        for directory in subdir:
-            for file in os.listdir(data_directory_path + f"/searched_{entity_type}_data/" + directory):
-                if file.endswith(".csv"):
-                    search_term_source = directory.replace("_", " ").title()
-                    if 'searched' in file:
-                        search_term = file.replace(".csv", "").split(f'{entity_type}s_searched_')[1].replace("+", " ").replace("&#39;", "'")
-                        if '20' in search_term:
-                            search_term = search_term.split("_20")[0]
-                    else:
-                        search_term = search_term_source
-                    
-                    subset_cleaned_terms = cleaned_terms[(cleaned_terms.search_term_source == search_term_source) & (cleaned_terms.search_term == search_term)]
-                    if not subset_cleaned_terms.empty:
-                        subset_cleaned_terms['file_path'] = f"{data_directory_path}/searched_{entity_type}_data/{directory}/{file}"
-                        subset_cleaned_terms["file_name"] = file
-                        queries.append(subset_cleaned_terms)
+    for dir_path, _, files in tqdm(os.walk(searched_dir), desc="Walking through directories"):
+        if dir_path == searched_dir:
+            continue
+        directory = os.path.basename(dir_path)
+        for file in files:
+            if file.endswith(".csv"):
+                search_term_source = directory.replace("_", " ").title()
+                if 'searched' in file:
+                    search_term = file.replace(".csv", "").split(f'{entity_type}s_searched_')[1].replace("+", " ").replace("&#39;", "'")
+                    if '20' in search_term:
+                        search_term = search_term.split("_20")[0]
+                else:
+                    search_term = search_term_source
+                
+                subset_cleaned_terms = grouped_cleaned_terms.get((search_term_source, search_term))
+                if subset_cleaned_terms is not None:
+                    subset_cleaned_terms = subset_cleaned_terms.copy()
+                    subset_cleaned_terms['file_path'] = os.path.join(dir_path, file)
+                    subset_cleaned_terms["file_name"] = file
+                    queries.append(subset_cleaned_terms)
     queries_df = pd.concat(queries)
     queries_df = queries_df.reset_index(drop=True)
     search_queries_dfs = []
@@ -555,25 +733,18 @@ def create_queries_directories(entity_type: str, cleaned_terms: pd.DataFrame) ->
     return search_queries_df
 
 def get_entity_files_from_search_queries(search_user_queries_df, search_org_queries_df, search_repo_queries_df, data_directory_path: str):
-    user_files = os.listdir(f"{data_directory_path}/historic_data/entity_files/all_users/")
-    org_files = os.listdir(f"{data_directory_path}/historic_data/entity_files/all_orgs/")
-    repo_files = os.listdir(f"{data_directory_path}/historic_data/entity_files/all_repos/")
-    cleaned_user_files = [f.split("_coding_dh_")[0] for f in user_files if f.endswith(".csv")]
-    cleaned_org_files = [f.split("_coding_dh_")[0] for f in org_files if f.endswith(".csv")]
-    cleaned_repo_files = [f.split("_coding_dh_")[0].replace("_", "/", 1) for f in repo_files if f.endswith(".csv")]
-    existing_search_user_queries_df = search_user_queries_df[search_user_queries_df.login.isin(cleaned_user_files)]
-    existing_search_org_queries_df = search_org_queries_df[search_org_queries_df.login.isin(cleaned_org_files)]
-    existing_search_repo_queries_df = search_repo_queries_df[search_repo_queries_df.full_name.isin(cleaned_repo_files)]
-    finalized_user_logins = existing_search_user_queries_df.login.unique().tolist()
-    finalized_org_logins = existing_search_org_queries_df.login.unique().tolist()
-    finalized_repo_full_names = existing_search_repo_queries_df.full_name.unique().tolist()
-
-    finalized_user_files = [f"{login}_coding_dh_user.csv" for login in finalized_user_logins]
-    finalized_org_files = [f"{login}_coding_dh_org.csv" for login in finalized_org_logins]
-    finalized_repo_files = [f"{full_name.replace('/', '_')}_coding_dh_repo.csv" for full_name in finalized_repo_full_names]
-    initial_core_users = read_combine_files(f"{data_directory_path}/historic_data/entity_files/all_users/", finalized_user_files)
-    initial_core_orgs = read_combine_files(f"{data_directory_path}/historic_data/entity_files/all_orgs/", finalized_org_files)
-    initial_core_repos = read_combine_files(f"{data_directory_path}/historic_data/entity_files/all_repos/", finalized_repo_files)
+    """
+    Gets the latest stored version of every user, org and repo found by the search queries. Entities that have not been collected yet are left out.
+
+    :param search_user_queries_df: Search queries dataframe for users
+    :param search_org_queries_df: Search queries dataframe for orgs
+    :param search_repo_queries_df: Search queries dataframe for repos
+    :param data_directory_path: Path to data directory
+    :return: Initial core users, orgs and repos dataframes
+    """
+    initial_core_users = read_latest_entities(data_directory_path, "users", search_user_queries_df.login.dropna().unique().tolist())
+    initial_core_orgs = read_latest_entities(data_directory_path, "orgs", search_org_queries_df.login.dropna().unique().tolist())
+    initial_core_repos = read_latest_entities(data_directory_path, "repos", search_repo_queries_df.full_name.dropna().unique().tolist())
     return initial_core_users, initial_core_orgs, initial_core_repos
 
 def get_data_from_search_terms(target_terms: List, data_directory_path: str, return_search_queries: bool) -> Union[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
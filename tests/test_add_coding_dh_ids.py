@@ -0,0 +1,68 @@
+import ast
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from data_generation_scripts.utils import add_coding_dh_ids
+
+
+def legacy_sort_groups_add_coding_dh_id(group: pd.DataFrame, subset_columns: list) -> pd.DataFrame:
+    """
+    The per-group implementation that add_coding_dh_ids replaced, kept here as the reference it has to match.
+    """
+    group = group.copy()
+    for col in group.columns:
+        group[col] = group[col].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) and x.startswith('[') and x.endswith(']') else x)
+    list_cols = [col for col in group.columns if group[col].apply(lambda x: isinstance(x, list)).any()]
+    for col in list_cols:
+        group[col] = group[col].apply(lambda x: ', '.join(sorted(map(str, x))) if isinstance(x, list) else x)
+    subset_columns = list(set(subset_columns + list_cols))
+    sorted_group = group.sort_values(by='coding_dh_date')
+    final_group = sorted_group.drop_duplicates(subset=sorted_group.columns.difference(subset_columns), keep='first').copy()
+    final_group['coding_dh_id'] = np.arange(len(final_group))
+    return final_group.drop(columns=list_cols)
+
+
+def legacy_add_coding_dh_ids(df: pd.DataFrame, grouped_columns: list, subset_columns: list) -> pd.DataFrame:
+    processed_groups = [legacy_sort_groups_add_coding_dh_id(group, subset_columns) for _, group in df.groupby(grouped_columns)]
+    return pd.concat(processed_groups)
+
+
+def normalise(df: pd.DataFrame, sort_columns: list) -> pd.DataFrame:
+    return df.sort_values(by=sort_columns, kind='mergesort')[sorted(df.columns)].reset_index(drop=True)
+
+
+def test_add_coding_dh_ids_matches_legacy_loop():
+    df = pd.DataFrame({
+        'org_login': ['dh-lab', 'dh-lab', 'dh-lab', 'dh-lab', 'archive', 'archive', None],
+        'full_name': ['dh-lab/site', 'dh-lab/site', 'dh-lab/site', 'dh-lab/corpus', 'archive/tools', 'archive/tools', 'orphan/repo'],
+        'description': ['Lab site', 'Lab site', 'New lab site', 'Corpus', 'Tools', 'Tools', 'Orphan'],
+        # Topics are only list-like in some groups, so they are dropped from those groups and kept in the others
+        'topics': ["['history', 'tei']", "['tei', 'history']", "['history']", "['corpus']", None, None, None],
+        'coding_dh_date': ['2024-03-01', '2024-01-01', '2024-02-01', '2024-01-01', '2024-02-01', '2024-01-01', '2024-01-01'],
+    })
+    grouped_columns = ['org_login', 'full_name']
+    subset_columns = ['coding_dh_date']
+
+    result = add_coding_dh_ids(df.copy(), grouped_columns, subset_columns)
+    expected = legacy_add_coding_dh_ids(df.copy(), grouped_columns, subset_columns)
+
+    sort_columns = grouped_columns + ['coding_dh_id']
+    pd.testing.assert_frame_equal(normalise(result, sort_columns), normalise(expected, sort_columns), check_dtype=False)
+
+
+def test_add_coding_dh_ids_numbers_versions_by_date():
+    df = pd.DataFrame({
+        'login': ['ada', 'ada', 'ada', 'grace'],
+        'bio': ['Historian', 'Historian', 'Digital historian', 'Archivist'],
+        'coding_dh_date': ['2024-01-01', '2024-02-01', '2024-03-01', '2024-01-01'],
+    })
+
+    result = add_coding_dh_ids(df, ['login'], ['coding_dh_date'])
+
+    # The repeated bio on a later date is a duplicate, so ada keeps two versions
+    assert result[result.login == 'ada'].sort_values('coding_dh_date').coding_dh_id.tolist() == [0, 1]
+    assert result[result.login == 'grace'].coding_dh_id.tolist() == [0]
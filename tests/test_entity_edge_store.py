@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from data_generation_scripts.entity_storage import EntityEdgeStore
+
+
+def read_targets(edge_store: EntityEdgeStore) -> dict:
+    edges_df = edge_store.read_edges(columns=["source_key", "target_id", "target_key"])
+    return {(source_key, target_id): target_key for source_key, target_id, target_key in edges_df.itertuples(index=False)}
+
+
+def test_record_edges_takes_stargazer_targets_from_user(tmp_path):
+    edge_store = EntityEdgeStore(str(tmp_path))
+    stargazers_df = pd.DataFrame({
+        "starred_at": ["2024-01-01T00:00:00Z", "2024-02-01T00:00:00Z"],
+        "user.login": ["ada", "grace"],
+        "user.id": [1, 2],
+        "repo_id": [100, 100],
+        "repo_full_name": ["dh-lab/site", "dh-lab/site"],
+        "coding_dh_date": ["2024-03-01", "2024-03-01"],
+    })
+
+    edge_store.record_edges("repo_user", "stargazers_url", "repos", stargazers_df, "repo_id", "repo_full_name", "user.login")
+
+    assert read_targets(edge_store) == {("dh-lab/site", 1): "ada", ("dh-lab/site", 2): "grace"}
+
+
+def test_record_edges_takes_fork_targets_from_owner(tmp_path):
+    edge_store = EntityEdgeStore(str(tmp_path))
+    forks_df = pd.DataFrame({
+        # The top-level id is the fork's own repo id, not its owner's
+        "id": [500, 501],
+        "full_name": ["ada/site", "grace/site"],
+        "owner.login": ["ada", "grace"],
+        "owner.id": [1, 2],
+        "repo_id": [100, 100],
+        "repo_full_name": ["dh-lab/site", "dh-lab/site"],
+        "coding_dh_date": ["2024-03-01", "2024-03-01"],
+    })
+
+    edge_store.record_edges("repo_user", "forks_url", "repos", forks_df, "repo_id", "repo_full_name", "owner.login")
+
+    assert read_targets(edge_store) == {("dh-lab/site", 1): "ada", ("dh-lab/site", 2): "grace"}
+
+
+def test_count_targets_keeps_joins_of_a_shared_interaction_type_apart(tmp_path):
+    edge_store = EntityEdgeStore(str(tmp_path))
+    stargazers_df = pd.DataFrame({"user.login": ["ada"], "user.id": [1], "repo_id": [100], "repo_full_name": ["dh-lab/site"]})
+    forks_df = pd.DataFrame({"id": [500], "owner.login": ["grace"], "owner.id": [2], "repo_id": [100], "repo_full_name": ["dh-lab/site"]})
+
+    edge_store.record_edges("repo_user", "stargazers_url", "repos", stargazers_df, "repo_id", "repo_full_name", "user.login")
+    edge_store.record_edges("repo_user", "forks_url", "repos", forks_df, "repo_id", "repo_full_name", "owner.login")
+
+    assert edge_store.count_targets("repo_user", "stargazers_url", ["dh-lab/site"]) == {"dh-lab/site": 1}
+    assert edge_store.count_targets("repo_user", "forks_url", ["dh-lab/site"]) == {"dh-lab/site": 1}
+    assert edge_store.read_edges(url_columns=["forks_url"], columns=["target_key"]).target_key.tolist() == ["grace"]
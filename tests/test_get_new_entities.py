@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pandas as pd
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+import data_generation_scripts.utils as utils
+from data_generation_scripts.entity_storage import read_latest_entities
+
+
+class FakeResponse:
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self.history = []
+
+    def json(self) -> dict:
+        return self.payload
+
+
+def test_org_is_stored_from_orgs_payload_when_users_request_fails(tmp_path, monkeypatch):
+    org_payload = {"login": "dh-lab", "id": 42, "name": "DH Lab", "url": "https://api.github.com/orgs/dh-lab"}
+
+    def fake_request(query, auth_headers, *args, **kwargs):
+        if "/orgs/" in query:
+            return FakeResponse(org_payload), 200
+        return None, 502
+
+    monkeypatch.setattr(utils, "get_data_directory_path", lambda: str(tmp_path))
+    monkeypatch.setattr(utils, "get_headers", lambda entity_type: pd.DataFrame(columns=["login", "id", "name", "url"]))
+    monkeypatch.setattr(utils, "make_request_with_rate_limiting", fake_request)
+    candidates_df = pd.DataFrame({"login": ["dh-lab"], "url": ["https://api.github.com/users/dh-lab"]})
+
+    utils.get_new_entities("orgs", candidates_df, str(tmp_path / "all_orgs"), tqdm(disable=True), str(tmp_path / "org_errors.csv"), False)
+
+    orgs_df = read_latest_entities(str(tmp_path), "orgs", ["dh-lab"])
+    assert orgs_df.login.tolist() == ["dh-lab"]
+    assert orgs_df.name.tolist() == ["DH Lab"]
+    assert not os.path.exists(tmp_path / "org_errors.csv")